@@ -1,44 +1,59 @@
 #!/usr/bin/env python3
 """
 Analyze GridSync test results and generate comparison plots
+
+Each scenario's metrics are loaded as {column: numpy array}: from the
+binary <name>.cols tables (METRICS_FORMAT = "columns", or converted with
+convert_metrics.py) by memory-mapping them, otherwise by parsing the CSV.
 """
 import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+from metrics import columns_path, load_columns
+
 RESULTS_DIR = "results"
 TEST_SCENARIOS = ["baseline", "loss_2", "loss_5", "delay_100ms"]
+# longer time series are thinned to about this many points before plotting
+MAX_PLOT_POINTS = 20000
 
 
-def load_test_data(scenario):
-    """Load client and server CSV files for a given scenario"""
-    scenario_dir = os.path.join(RESULTS_DIR, scenario)
+def load_metrics(path):
+    """{column: array} for a metrics file: its .cols table if present, else the CSV; None if neither exists."""
+    cols_path = columns_path(path)
+    if os.path.isdir(cols_path):
+        return load_columns(cols_path)
+    if os.path.exists(path):
+        df = pd.read_csv(path)
+        return {column: df[column].to_numpy() for column in df.columns}
+    return None
 
-    client_file = os.path.join(scenario_dir, "client_metrics.csv")
-    server_file = os.path.join(scenario_dir, "server_metrics.csv")
 
-    client_df = None
-    server_df = None
+def _rows(data):
+    return len(next(iter(data.values()))) if data else 0
 
-    if os.path.exists(client_file):
-        try:
-            client_df = pd.read_csv(client_file)
-            print(f"✓ Loaded {scenario}/client_metrics.csv ({len(client_df)} rows)")
-        except Exception as e:
-            print(f"✗ Error loading {scenario}/client_metrics.csv: {e}")
-    else:
-        print(f"✗ Missing {scenario}/client_metrics.csv")
 
-    if os.path.exists(server_file):
+def load_test_data(scenario):
+    """Load client and server metrics for a given scenario"""
+    scenario_dir = os.path.join(RESULTS_DIR, scenario)
+
+    loaded = []
+    for name in ("client_metrics.csv", "server_metrics.csv"):
+        path = os.path.join(scenario_dir, name)
+        data = None
         try:
-            server_df = pd.read_csv(server_file)
-            print(f"✓ Loaded {scenario}/server_metrics.csv ({len(server_df)} rows)")
+            data = load_metrics(path)
+            if data is None:
+                print(f"✗ Missing {scenario}/{name}")
+            else:
+                source = os.path.basename(columns_path(path)) if os.path.isdir(columns_path(path)) else name
+                print(f"✓ Loaded {scenario}/{source} ({_rows(data)} rows)")
         except Exception as e:
-            print(f"✗ Error loading {scenario}/server_metrics.csv: {e}")
-    else:
-        print(f"✗ Missing {scenario}/server_metrics.csv")
+            print(f"✗ Error loading {scenario}/{name}: {e}")
+        loaded.append(data)
 
+    client_df, server_df = loaded
     return client_df, server_df
 
 
@@ -69,8 +84,8 @@ def generate_comparison_plots():
     for scenario in TEST_SCENARIOS:
         if all_data[scenario]['client'] is not None:
             df = all_data[scenario]['client']
-            if 'latency_ms' in df.columns:
-                latencies.append(df['latency_ms'].mean())
+            if 'latency_ms' in df:
+                latencies.append(np.nanmean(df['latency_ms']))
                 labels.append(scenario.replace('_', ' ').title())
 
     if latencies:
@@ -87,8 +102,8 @@ def generate_comparison_plots():
     for scenario in TEST_SCENARIOS:
         if all_data[scenario]['client'] is not None:
             df = all_data[scenario]['client']
-            if 'loss_percentage' in df.columns and len(df) > 0:
-                loss_rates.append(df['loss_percentage'].iloc[-1])
+            if 'loss_percentage' in df and _rows(df) > 0:
+                loss_rates.append(df['loss_percentage'][-1])
                 labels.append(scenario.replace('_', ' ').title())
 
     if loss_rates:
@@ -105,8 +120,8 @@ def generate_comparison_plots():
     for scenario in TEST_SCENARIOS:
         if all_data[scenario]['client'] is not None:
             df = all_data[scenario]['client']
-            if 'jitter_ms' in df.columns:
-                jitters.append(df['jitter_ms'].mean())
+            if 'jitter_ms' in df:
+                jitters.append(np.nanmean(df['jitter_ms']))
                 labels.append(scenario.replace('_', ' ').title())
 
     if jitters:
@@ -122,10 +137,11 @@ def generate_comparison_plots():
     for i, scenario in enumerate(TEST_SCENARIOS):
         if all_data[scenario]['client'] is not None:
             df = all_data[scenario]['client']
-            if 'latency_ms' in df.columns and 'timestamp_ms' in df.columns:
+            if 'latency_ms' in df and 'timestamp_ms' in df and _rows(df) > 0:
+                step = max(1, _rows(df) // MAX_PLOT_POINTS)
                 # Normalize timestamps to start at 0
-                time_normalized = (df['timestamp_ms'] - df['timestamp_ms'].iloc[0]) / 1000.0
-                ax.plot(time_normalized, df['latency_ms'],
+                time_normalized = (df['timestamp_ms'][::step] - df['timestamp_ms'][0]) / 1000.0
+                ax.plot(time_normalized, df['latency_ms'][::step],
                         label=scenario.replace('_', ' ').title(),
                         color=colors[i], alpha=0.7, linewidth=1.5)
 
@@ -142,8 +158,8 @@ def generate_comparison_plots():
     for scenario in TEST_SCENARIOS:
         if all_data[scenario]['client'] is not None:
             df = all_data[scenario]['client']
-            if 'ping_ms' in df.columns:
-                pings.append(df['ping_ms'].mean())
+            if 'ping_ms' in df:
+                pings.append(np.nanmean(df['ping_ms']))
                 labels.append(scenario.replace('_', ' ').title())
 
     if pings:
@@ -160,8 +176,8 @@ def generate_comparison_plots():
     for scenario in TEST_SCENARIOS:
         if all_data[scenario]['server'] is not None:
             df = all_data[scenario]['server']
-            if 'cpu_percent' in df.columns:
-                cpu_usage.append(df['cpu_percent'].mean())
+            if 'cpu_percent' in df:
+                cpu_usage.append(np.nanmean(df['cpu_percent']))
                 labels.append(scenario.replace('_', ' ').title())
 
     if cpu_usage:
@@ -197,18 +213,18 @@ def generate_summary_table(all_data):
         client_df = all_data[scenario]['client']
         server_df = all_data[scenario]['server']
 
-        if client_df is not None and len(client_df) > 0:
+        if client_df is not None and _rows(client_df) > 0:
             row = {
                 'Scenario': scenario.replace('_', ' ').title(),
-                'Avg Latency (ms)': f"{client_df['latency_ms'].mean():.2f}" if 'latency_ms' in client_df else 'N/A',
-                'Avg Jitter (ms)': f"{client_df['jitter_ms'].mean():.2f}" if 'jitter_ms' in client_df else 'N/A',
-                'Avg Ping (ms)': f"{client_df['ping_ms'].mean():.2f}" if 'ping_ms' in client_df else 'N/A',
-                'Packet Loss (%)': f"{client_df['loss_percentage'].iloc[-1]:.2f}" if 'loss_percentage' in client_df else 'N/A',
-                'Packets Received': f"{client_df['packets_received'].iloc[-1]}" if 'packets_received' in client_df else 'N/A',
+                'Avg Latency (ms)': f"{np.nanmean(client_df['latency_ms']):.2f}" if 'latency_ms' in client_df else 'N/A',
+                'Avg Jitter (ms)': f"{np.nanmean(client_df['jitter_ms']):.2f}" if 'jitter_ms' in client_df else 'N/A',
+                'Avg Ping (ms)': f"{np.nanmean(client_df['ping_ms']):.2f}" if 'ping_ms' in client_df else 'N/A',
+                'Packet Loss (%)': f"{client_df['loss_percentage'][-1]:.2f}" if 'loss_percentage' in client_df else 'N/A',
+                'Packets Received': f"{client_df['packets_received'][-1]}" if 'packets_received' in client_df else 'N/A',
             }
 
-            if server_df is not None and len(server_df) > 0:
-                row['Avg CPU (%)'] = f"{server_df['cpu_percent'].mean():.2f}" if 'cpu_percent' in server_df else 'N/A'
+            if server_df is not None and _rows(server_df) > 0:
+                row['Avg CPU (%)'] = f"{np.nanmean(server_df['cpu_percent']):.2f}" if 'cpu_percent' in server_df else 'N/A'
             else:
                 row['Avg CPU (%)'] = 'N/A'
 
@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for GridSync server hot paths.
+
+Usage:
+    python3 bench.py            # run all benchmarks
+    python3 bench.py broadcast  # run only the named benchmark
+    python3 bench.py late_join
+    python3 bench.py grid_backend
+    python3 bench.py logging
+    python3 bench.py compression
+    python3 bench.py action_commit
+    python3 bench.py recv_path
+    python3 bench.py codec
+    python3 bench.py micro                        # ns/op and allocation per hot-path call
+    python3 bench.py micro --save baseline.json   # record a baseline
+    python3 bench.py micro --compare baseline.json [--threshold 0.1]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+
+from util import HEADER_FORMAT, HEADER_SIZE, SnapshotFrame, pack_header, parse_header, check_auth, MSG_ACTION, iter_actions_payload, PayloadCompressor, pack_actions_payload, unpack_actions_payload, pack_grid_payload, unpack_grid_payload, MSG_SNAPSHOT
+from game import GridGame, NumpyGridGame, np
+from logs import EventLog
+from config import LAST_K_ACTIONS
+
+
+class LossySocket:
+    """UDP socket wrapper that drops sent and received datagrams with probability `loss`."""
+
+    def __init__(self, sock, loss, seed=7):
+        self.sock = sock
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def recvfrom(self, size):
+        while True:
+            data, addr = self.sock.recvfrom(size)
+            if self.rng.random() >= self.loss:
+                return data, addr
+
+    def sendto(self, data, addr):
+        if self.rng.random() >= self.loss:
+            self.sock.sendto(data, addr)
+
+    def sendmsg(self, buffers, ancdata, flags, addr):
+        if self.rng.random() >= self.loss:
+            self.sock.sendmsg(buffers, ancdata, flags, addr)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class ReplaySocket:
+    """Receive-side socket stand-in that returns the same datagram on every call."""
+
+    def __init__(self, datagram):
+        self.datagram = bytearray(datagram)
+        self.addr = ('127.0.0.1', 9)
+
+    def recvfrom(self, size):
+        # a new bytes object per datagram, as a real recvfrom() returns
+        return bytes(self.datagram), self.addr
+
+    def recvfrom_into(self, buf):
+        nbytes = len(self.datagram)
+        buf[:nbytes] = self.datagram
+        return nbytes, self.addr
+
+
+class NullSocket:
+    """Socket stand-in that discards data, so only encoding cost is measured."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def sendto(self, data, addr):
+        self.bytes_sent += len(data)
+
+    def sendmsg(self, buffers, ancdata, flags, addr):
+        self.bytes_sent += sum(map(len, buffers))
+
+
+def _legacy_pack_header(msg_type, snapshot_id, seq_num, payload_len):
+    """pack_header() as it was before SnapshotFrame: packs the header twice."""
+    timestamp = int(time.time() * 1000)
+    packed_zero = struct.pack(HEADER_FORMAT, b"GSYN", 1, msg_type,
+                              snapshot_id, seq_num, timestamp, payload_len, 0)
+    checksum = zlib.crc32(packed_zero) & 0xFFFFFFFF
+    return struct.pack(HEADER_FORMAT, b"GSYN", 1, msg_type,
+                       snapshot_id, seq_num, timestamp, payload_len, checksum)
+
+
+def _legacy_receive(data, grid):
+    """Client receive path before recvfrom_into: zeroed header copy for the CRC, slices per field and action."""
+    zeroed = data[:24] + b"\x00\x00\x00\x00"
+    if zlib.crc32(zeroed) & 0xFFFFFFFF != struct.unpack("!I", data[24:28])[0]:
+        return
+    _, _, _, _, _, _, payload_len, _ = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    payload = data[HEADER_SIZE:HEADER_SIZE + payload_len]
+    count = struct.unpack("!H", payload[:2])[0]
+    offset = 2
+    for _ in range(count):
+        if offset + 6 > len(payload):
+            break
+        row, col, player_id = struct.unpack("!H H H", payload[offset:offset + 6])
+        offset += 6
+        grid[row][col] = player_id
+
+
+def _legacy_pack_actions_payload(actions_list):
+    """pack_actions_payload() before the array codec: bytes += per action."""
+    payload = struct.pack("!H", len(actions_list))
+    for row, col, player_id in actions_list:
+        payload += struct.pack("!H H H", row, col, player_id)
+    return payload
+
+
+def _legacy_unpack_actions_payload(payload):
+    """unpack_actions_payload() before the array codec: a slice and struct.unpack per action."""
+    count = struct.unpack("!H", payload[:2])[0]
+    res = []
+    offset = 2
+    for _ in range(count):
+        if offset + 6 > len(payload):
+            break
+        res.append(struct.unpack("!H H H", payload[offset:offset + 6]))
+        offset += 6
+    return res
+
+
+def _tick_legacy(sock, addrs, seqs, snapshot_id, payload):
+    for i, addr in enumerate(addrs):
+        header = _legacy_pack_header(MSG_SNAPSHOT, snapshot_id, seqs[i], len(payload))
+        sock.sendto(header + payload, addr)
+        seqs[i] += 1
+
+
+def _tick_frame(frame, sock, recipients, snapshot_id, payload):
+    frame.prepare(MSG_SNAPSHOT, snapshot_id, payload)
+    frame.send_many(sock, recipients)
+
+
+def _time_ticks(fn, ticks):
+    start = time.perf_counter()
+    for snapshot_id in range(1, ticks + 1):
+        fn(snapshot_id)
+    return (time.perf_counter() - start) / ticks
+
+
+def bench_broadcast(client_counts=(4, 64, 1024), real_socket=False):
+    """Per-tick snapshot broadcast cost, legacy per-client pack vs SnapshotFrame.
+
+    With real_socket, datagrams go to a local UDP sink instead of NullSocket,
+    so the numbers include the sendto/sendmsg syscalls.
+    """
+    payload = pack_actions_payload([(r % 20, r // 20, r % 4 + 1) for r in range(20)])
+    sink = None
+    if real_socket:
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        target = sink.getsockname()
+    else:
+        sock = NullSocket()
+        target = ("127.0.0.1", 9)
+
+    print(f"broadcast ({'udp sink' if real_socket else 'null socket'}, payload {len(payload)} B)")
+    print(f"  {'clients':>8} {'legacy us/tick':>15} {'frame us/tick':>14} {'speedup':>8}")
+    for n in client_counts:
+        addrs = [target] * n
+        ticks = max(20, 20000 // n)
+        seqs = [1] * n
+        legacy = _time_ticks(lambda sid: _tick_legacy(sock, addrs, seqs, sid, payload), ticks)
+        frame = SnapshotFrame()
+        recipients = [(addr, {'seq_num': 1}) for addr in addrs]
+        framed = _time_ticks(lambda sid: _tick_frame(frame, sock, recipients, sid, payload), ticks)
+        print(f"  {n:>8} {legacy * 1e6:>15.1f} {framed * 1e6:>14.1f} {legacy / framed:>7.2f}x")
+
+    if sink is not None:
+        sink.close()
+        sock.close()
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _filled_game(size, fill, seed=1):
+    rng = random.Random(seed)
+    game = GridGame(size, size)
+    cells = [(r, c) for r in range(size) for c in range(size)]
+    rng.shuffle(cells)
+    for r, c in cells[:int(len(cells) * fill)]:
+        game.claim_cell(rng.randint(1, 4), r, c)
+    return game
+
+
+def bench_late_join(sizes=(20, 200, 1000), fill=0.5, max_history_actions=50000):
+    """Full-snapshot size and encode/decode time: action history vs grid state.
+
+    The board is filled to `fill` with random owners. Action-history encoding
+    is skipped above max_history_actions: the history payload has a 2-byte
+    action count, so pack_actions_payload() raises struct.error past 65535.
+    """
+    print(f"late join (board {fill:.0%} claimed, 4 players)")
+    print(f"  {'grid':>10} {'actions':>8} {'history B':>10} {'enc ms':>8} {'dec ms':>8}"
+          f" {'grid B':>8} {'enc ms':>8} {'dec ms':>8}")
+    for size in sizes:
+        game = _filled_game(size, fill)
+        actions = game.actions
+        if len(actions) <= max_history_actions:
+            hist, hist_enc = _timed(lambda: pack_actions_payload(actions))
+            _, hist_dec = _timed(lambda: unpack_actions_payload(hist))
+            hist_cols = f"{len(hist):>10} {hist_enc * 1e3:>8.1f} {hist_dec * 1e3:>8.1f}"
+        else:
+            hist_cols = f"{'skipped':>10} {'-':>8} {'-':>8}"
+        grid, grid_enc = _timed(lambda: pack_grid_payload(game.rows, game.cols, game.owner_cells()))
+        _, grid_dec = _timed(lambda: unpack_grid_payload(grid))
+        print(f"  {f'{size}x{size}':>10} {len(actions):>8} {hist_cols}"
+              f" {len(grid):>8} {grid_enc * 1e3:>8.1f} {grid_dec * 1e3:>8.1f}")
+
+
+def bench_grid_backend(sizes=(200, 1000, 4000), batch_size=10000):
+    """Board-wide operations on the list-of-lists and NumPy GridGame backends."""
+    backends = [('python', GridGame)]
+    if np is not None:
+        backends.append(('numpy', NumpyGridGame))
+    else:
+        print("  (numpy not installed: python backend only)")
+    print(f"grid backends (batch of {batch_size} random actions)")
+    print(f"  {'grid':>10} {'backend':>8} {'init ms':>8} {'batch ms':>9} {'counts ms':>10} {'owner ms':>9}")
+    rng = random.Random(2)
+    for size in sizes:
+        batch = [(rng.randrange(size), rng.randrange(size), rng.randint(1, 4)) for _ in range(batch_size)]
+        for name, cls in backends:
+            game, init = _timed(lambda: cls(size, size))
+            _, apply = _timed(lambda: game.apply_actions(batch))
+            _, counts = _timed(game.player_counts)
+            _, owner = _timed(game.owner_cells)
+            print(f"  {f'{size}x{size}':>10} {name:>8} {init * 1e3:>8.1f} {apply * 1e3:>9.1f}"
+                  f" {counts * 1e3:>10.1f} {owner * 1e3:>9.1f}")
+
+
+def bench_logging(calls=200000):
+    """Per-call cost of a per-snapshot log line: print() vs gated/sampled EventLog."""
+    # line-buffered like stdout on a terminal, but without the terminal
+    sink = open(os.devnull, 'w', buffering=1)
+    logger = logging.getLogger('gsyn.bench')
+    logger.handlers[:] = [logging.StreamHandler(sink)]
+    logger.propagate = False
+    snapshot_id, clients, actions = 1234, 64, 20
+
+    def legacy():
+        for _ in range(calls):
+            print(f"[SERVER] Sent SNAPSHOT #{snapshot_id} to {clients} clients (actions: {actions})", file=sink)
+
+    def event_log(level, sample):
+        logger.setLevel(level)
+        events = EventLog(logger, sample={'snapshot': sample}, rate_limit=0, summary_interval=0)
+        for _ in range(calls):
+            events.info('snapshot', "Sent SNAPSHOT #%d to %d clients (actions: %d)", snapshot_id, clients, actions)
+
+    print(f"logging ({calls} snapshot log calls)")
+    cases = [
+        ('print (legacy)', legacy),
+        ('EventLog, INFO off', lambda: event_log(logging.WARNING, 1)),
+        ('EventLog, 1 in 20', lambda: event_log(logging.INFO, 20)),
+        ('EventLog, every call', lambda: event_log(logging.INFO, 1)),
+    ]
+    for name, fn in cases:
+        _, elapsed = _timed(fn)
+        print(f"  {name:<22} {elapsed / calls * 1e9:>8.0f} ns/call")
+    sink.close()
+
+
+def bench_compression(levels=(1, 6, 9), repeat=200):
+    """Compression ratio and CPU per snapshot payload, with and without the preset dictionary."""
+    rng = random.Random(4)
+    payloads = [
+        ('last-K (20)', pack_actions_payload([(rng.randrange(20), rng.randrange(20), rng.randint(1, 4)) for _ in range(20)])),
+        ('delta (400)', pack_actions_payload([(rng.randrange(20), rng.randrange(20), rng.randint(1, 4)) for _ in range(400)])),
+        ('history 200x200', pack_actions_payload(_filled_game(200, 0.5).actions)),
+    ]
+    game = _filled_game(1000, 0.5)
+    payloads.append(('grid 1000x1000', pack_grid_payload(game.rows, game.cols, game.owner_cells())))
+    print("compression (raw deflate)")
+    print(f"  {'payload':<16} {'bytes':>8} {'level':>5} {'ratio':>6} {'zdict':>6} {'us/op':>9} {'zdict us':>9}")
+    for name, payload in payloads:
+        n = max(1, repeat * 1000 // max(len(payload), 1000))
+        for level in levels:
+            row = []
+            for use_zdict in (False, True):
+                comp = PayloadCompressor(level)
+                for _ in range(n):
+                    comp.compress(payload, use_zdict)
+                payloads_done, bytes_in, bytes_out, seconds = comp.take_stats()
+                row.append((bytes_out / bytes_in, seconds / payloads_done))
+            print(f"  {name:<16} {len(payload):>8} {level:>5} {row[0][0]:>6.2f} {row[1][0]:>6.2f}"
+                  f" {row[0][1] * 1e6:>9.1f} {row[1][1] * 1e6:>9.1f}")
+
+
+def bench_action_commit(loss_rates=(0.0, 0.02, 0.05), actions=150, interval=0.02):
+    """Actions committed and ACTION commit latency through an in-process server with packet loss.
+
+    Loss is applied to the server socket in both directions. Commit latency
+    is first send to ack of an ACTION packet, so it is only measured with
+    CAP_RELIABLE_ACTIONS.
+    """
+    import client
+    import server
+    from game import create_game
+    from util import CAP_RELIABLE_ACTIONS
+
+    server.logger.setLevel(logging.WARNING)
+    client.logger.setLevel(logging.WARNING)
+    print(f"action_commit ({actions} actions, {interval * 1000:.0f}ms apart, loss both ways)")
+    print(f"  {'loss':>5} {'reliable':>8} {'applied':>8} {'retx':>5} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    offered_caps = client.CLIENT_CAPS
+    try:
+        for loss in loss_rates:
+            for reliable in (False, True):
+                client.CLIENT_CAPS = offered_caps | CAP_RELIABLE_ACTIONS if reliable else offered_caps & ~CAP_RELIABLE_ACTIONS
+                server.clients.clear()
+                server.game = create_game(server.GRID_SIZE, server.GRID_SIZE)
+                server.running = True
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(('127.0.0.1', 0))
+                # no stop timer: it would outlive this run; running = False stops it below
+                threading.Thread(target=server.serve, args=(LossySocket(sock, loss), float('inf')), daemon=True).start()
+
+                c = client.Client(server_addr=sock.getsockname())
+                c.csv_file = c.summary_file = os.devnull
+                c.start()
+                deadline = time.time() + 10
+                while c.state != 'connected' and time.time() < deadline:
+                    time.sleep(0.01)
+                # let a heartbeat ping sample in, so the retransmit timeout follows the RTT
+                time.sleep(0.6)
+                for i in range(actions):
+                    c.send_action(i // server.GRID_SIZE, i % server.GRID_SIZE)
+                    time.sleep(interval)
+                c.flush_actions()
+                deadline = time.time() + 5
+                while c.unacked_actions and time.time() < deadline:
+                    time.sleep(0.01)
+                time.sleep(0.2)
+                applied = server.game.action_seq
+                commit_ms = sorted(c.action_commit_ms)
+                c.stop()
+                server.running = False
+                time.sleep(server.SOCKET_TIMEOUT)
+                sock.close()
+                if commit_ms:
+                    p50, p99, worst = commit_ms[len(commit_ms) // 2], commit_ms[int(len(commit_ms) * 0.99)], commit_ms[-1]
+                    latency = f"{p50:>7.1f} {p99:>7.1f} {worst:>7.1f}"
+                else:
+                    latency = f"{'-':>7} {'-':>7} {'-':>7}"
+                print(f"  {loss:>5.0%} {'yes' if reliable else 'no':>8} {applied:>4}/{actions:<3} {c.action_retransmits:>5} {latency}")
+    finally:
+        client.CLIENT_CAPS = offered_caps
+
+
+def _peak_bytes_per_call(fn, calls):
+    """Average of the most memory allocated at once while fn() runs, above what was live before it."""
+    tracemalloc.start()
+    total = 0
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / calls
+
+
+def bench_recv_path(packets=100000, actions=20):
+    """Per-datagram time and transient allocation of the client receive path.
+
+    The recvfrom_into path copies none of the datagram's bytes, but every
+    memoryview it slices is an object of its own (about 184 B), so on small
+    datagrams its peak allocation is not below the legacy path's copies.
+    """
+    rng = random.Random(5)
+    payload = pack_actions_payload([(rng.randrange(20), rng.randrange(20), rng.randint(1, 4)) for _ in range(actions)])
+    sock = ReplaySocket(pack_header(MSG_SNAPSHOT, 7, 1, len(payload)) + payload)
+    grid = [[0] * 20 for _ in range(20)]
+    buf = bytearray(4096)
+    view = memoryview(buf)
+
+    def legacy():
+        data, _ = sock.recvfrom(4096)
+        _legacy_receive(data, grid)
+
+    def into_buffer():
+        nbytes, _ = sock.recvfrom_into(buf)
+        data = view[:nbytes]
+        header = parse_header(data)
+        for row, col, player_id in iter_actions_payload(data, header.size):
+            grid[row][col] = player_id
+
+    print(f"recv_path ({packets} snapshot datagrams, {actions} actions, {HEADER_SIZE + len(payload)} bytes)")
+    print(f"  {'path':<28} {'us/pkt':>7} {'peak alloc B/pkt':>17}")
+    for name, fn in (('recvfrom + slices (legacy)', legacy), ('recvfrom_into + memoryview', into_buffer)):
+        def run():
+            for _ in range(packets):
+                fn()
+        _, elapsed = _timed(run)
+        peak = _peak_bytes_per_call(fn, packets // 10)
+        print(f"  {name:<28} {elapsed / packets * 1e6:>7.2f} {peak:>17.0f}")
+
+
+def bench_codec(sizes=(20, 1000, 10000, 60000)):
+    """Action payload pack/unpack cost per 1000 actions, old per-action code vs the array codec."""
+    rng = random.Random(6)
+    print("codec (actions payload, us per 1000 actions)")
+    print(f"  {'actions':>8} {'pack old':>9} {'pack new':>9} {'unpack old':>11} {'unpack new':>11}")
+    for size in sizes:
+        actions = [(rng.randrange(1000), rng.randrange(1000), rng.randint(1, 4)) for _ in range(size)]
+        payload = pack_actions_payload(actions)
+        repeat = max(1, 200000 // size)
+        per_k = 1000 / size / repeat * 1e6
+
+        def many(fn, arg):
+            return lambda: [fn(arg) for _ in range(repeat)]
+        _, pack_old = _timed(many(_legacy_pack_actions_payload, actions))
+        _, pack_new = _timed(many(pack_actions_payload, actions))
+        _, unpack_old = _timed(many(_legacy_unpack_actions_payload, payload))
+        _, unpack_new = _timed(many(unpack_actions_payload, payload))
+        print(f"  {size:>8} {pack_old * per_k:>9.1f} {pack_new * per_k:>9.1f}"
+              f" {unpack_old * per_k:>11.1f} {unpack_new * per_k:>11.1f}")
+
+
+def _calibrate(fn, min_time):
+    """Number of fn() calls that takes at least min_time seconds."""
+    loops = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9:
+            return loops
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time * 1e9 / elapsed) + 1))
+
+
+def _ns_per_op(cases, rounds=7, min_time=0.05):
+    """Best nanoseconds per call of every (name, fn), over `rounds` passes through all the cases.
+
+    Interleaving the cases spreads each one's samples over the whole run, so a
+    burst of noise from the rest of the machine spoils one sample, not a case.
+    """
+    loops = {name: _calibrate(fn, min_time) for name, fn in cases}
+    best = dict.fromkeys(loops, float('inf'))
+    for _ in range(rounds):
+        for name, fn in cases:
+            n = loops[name]
+            start = time.perf_counter_ns()
+            for _ in range(n):
+                fn()
+            best[name] = min(best[name], (time.perf_counter_ns() - start) / n)
+    return best
+
+
+def _micro_cases(action_counts, grid_sizes):
+    """(name, fn) for every per-packet hot path, parameterized by action count and grid size."""
+    import client
+    rng = random.Random(7)
+    cases = [
+        # fixed pure-Python work: compare_baseline() scales by it to cancel machine speed drift
+        (REFERENCE_CASE, lambda: sum(i * i for i in range(200))),
+        ('pack_header[v1]', lambda: pack_header(MSG_ACTION, 0, 1234, 100, 1)),
+        ('pack_header[v2]', lambda: pack_header(MSG_ACTION, 0, 1234, 100, 2)),
+    ]
+    v1 = pack_header(MSG_SNAPSHOT, 7, 1, 0, 1)
+    v2 = pack_header(MSG_SNAPSHOT, 7, 1, 0, 2)
+    cases += [
+        ('check_auth[v1]', lambda: check_auth(v1)),
+        ('check_auth[v2]', lambda: check_auth(v2)),
+        ('parse_header[v1]', lambda: parse_header(v1)),
+        ('parse_header[v2]', lambda: parse_header(v2)),
+    ]
+    for n in action_counts:
+        actions = [(rng.randrange(20), rng.randrange(20), rng.randint(1, 4)) for _ in range(n)]
+        payload = pack_actions_payload(actions)
+        cases += [
+            (f'pack_actions_payload[{n}]', lambda actions=actions: pack_actions_payload(actions)),
+            (f'unpack_actions_payload[{n}]', lambda payload=payload: unpack_actions_payload(payload)),
+        ]
+    for size in grid_sizes:
+        game = _filled_game(size, 0.5)
+        cells = [(r, c) for r in range(size) for c in range(size)]
+        rng.shuffle(cells)
+        moves = iter([])
+
+        def apply(game=game, cells=cells):
+            nonlocal moves
+            try:
+                r, c = next(moves)
+            except StopIteration:
+                moves = iter(cells)
+                r, c = next(moves)
+            game.apply_action(1, r, c)
+        cases += [
+            (f'GridGame.apply_action[{size}x{size}]', apply),
+            (f'GridGame.get_recent_actions[{size}x{size}]', lambda game=game: game.get_recent_actions(LAST_K_ACTIONS)),
+        ]
+
+    # a connected client with its socket replaced by NullSocket, so only the snapshot handling is timed
+    c = client.Client(server_addr=('127.0.0.1', 9))
+    c.sock.close()
+    c.sock = NullSocket()
+    c.state = 'connected'
+    c.events.logger.setLevel(logging.WARNING)
+    snapshot_ids = iter(range(1, 1 << 31))
+    for n in action_counts:
+        payload = pack_actions_payload([(rng.randrange(client.GRID_SIZE), rng.randrange(client.GRID_SIZE), rng.randint(1, 4))
+                                        for _ in range(n)])
+        cases.append((f'Client._handle_snapshot[{n}]', lambda payload=payload: c._handle_snapshot(
+            MSG_SNAPSHOT, payload, next(snapshot_ids), 1, 0, 0)))
+    return cases
+
+
+
+REFERENCE_CASE = 'reference[sum 200 squares]'
+
+
+def bench_micro(action_counts=(20, 1000), grid_sizes=(20, 200)):
+    """ns/op and peak transient allocation per call for the functions run on every packet."""
+    results = {}
+    cases = _micro_cases(action_counts, grid_sizes)
+    timings = _ns_per_op(cases)
+    print("micro (best of 7 rounds, ns per call; peak bytes allocated at once during a call)")
+    print(f"  {'case':<40} {'ns/op':>10} {'alloc B/op':>11}")
+    for name, fn in cases:
+        ns = timings[name]
+        alloc = _peak_bytes_per_call(fn, 200)
+        results[name] = {'ns_per_op': round(ns, 1), 'alloc_bytes_per_op': round(alloc, 1)}
+        print(f"  {name:<40} {ns:>10.0f} {alloc:>11.0f}")
+    return results
+
+
+def compare_baseline(results, baseline, threshold):
+    """Print each case against the baseline; returns the names slower (or allocating more) by over `threshold`.
+
+    Times are scaled by how the reference case moved, so a machine that is
+    uniformly faster or slower than when the baseline was taken (frequency
+    scaling, a busy host) does not show up as a change in every case.
+    """
+    speed = 1.0
+    if REFERENCE_CASE in results and REFERENCE_CASE in baseline:
+        speed = results[REFERENCE_CASE]['ns_per_op'] / baseline[REFERENCE_CASE]['ns_per_op']
+    print(f"compared with baseline (regression above {threshold:.0%}; machine {speed:.2f}x the baseline's time, changes scaled by it)")
+    print(f"  {'case':<40} {'base ns':>10} {'ns/op':>10} {'change':>8} {'base B':>7} {'B/op':>7}")
+    regressions = []
+    for name, now in results.items():
+        if name == REFERENCE_CASE:
+            continue
+        base = baseline.get(name)
+        if base is None:
+            print(f"  {name:<40} {'-':>10} {now['ns_per_op']:>10.0f} {'new':>8}")
+            continue
+        change = now['ns_per_op'] / speed / base['ns_per_op'] - 1
+        # allocation changes of a few bytes are tracemalloc noise, not a regression
+        more_alloc = now['alloc_bytes_per_op'] > base['alloc_bytes_per_op'] * (1 + threshold) + 64
+        flag = ''
+        if change > threshold or more_alloc:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"  {name:<40} {base['ns_per_op']:>10.0f} {now['ns_per_op']:>10.0f} {change:>+8.1%}"
+              f" {base['alloc_bytes_per_op']:>7.0f} {now['alloc_bytes_per_op']:>7.0f}{flag}")
+    return regressions
+
+
+BENCHMARKS = {
+    'broadcast': lambda: (bench_broadcast(), bench_broadcast(real_socket=True)),
+    'late_join': lambda: (bench_late_join(fill=0.5), bench_late_join(fill=0.02)),
+    'grid_backend': bench_grid_backend,
+    'logging': bench_logging,
+    'compression': bench_compression,
+    'action_commit': bench_action_commit,
+    'recv_path': bench_recv_path,
+    'codec': bench_codec,
+    'micro': bench_micro,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for GridSync server hot paths.")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--save', metavar='PATH', help="write the micro results to a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare the micro results with a JSON baseline")
+    parser.add_argument('--threshold', type=float, default=0.1, help="slowdown that counts as a regression (default 0.1)")
+    args = parser.parse_args()
+
+    micro = None
+    for name in args.names or list(BENCHMARKS):
+        result = BENCHMARKS[name]()
+        if name == 'micro':
+            micro = result
+        print()
+    if (args.save or args.compare) and micro is None:
+        micro = bench_micro()
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(micro, baseline['cases'], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'cases': micro}, f, indent=2, sort_keys=True)
+        print(f"saved baseline to {args.save}")
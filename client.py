@@ -1,22 +1,57 @@
 import socket
 import struct
+import sys
 import threading
+import zlib
+import collections
 import time
-import csv
-import os
-from util import pack_header, MSG_INIT, MSG_ACTION, MSG_SNAPSHOT, MSG_ACK, MSG_HEARTBEAT, check_auth
-from config import CLIENT_SERVER_HOST, CLIENT_SERVER_PORT, CLIENT_HEARTBEAT_INTERVAL, CLIENT_HEARTBEAT_TIMEOUT, GRID_SIZE, MAX_RECV_SIZE, PACKET_LIFETIME
+from util import pack_header, pack_action_batch, CAP_ACTION_BATCH, CAP_RELIABLE_ACTIONS, CAP_CLOCK_SYNC, CAP_SNAPSHOT_ACKS, CLOCK_STAMP, CLOCK_REPLY, ACTION_ID, ACTION_ACK, decompress_payload, MSG_COMPRESSED, MSG_COMPRESSED_ZDICT, MSG_TYPE_MASK, CAP_COMPRESSION, CAP_COMPRESSION_ZDICT, unpack_fragment, pack_frag_nack, Reassembly, MSG_SNAPSHOT_FRAG, MSG_FRAG_NACK, CAP_FRAGMENTS, parse_header, iter_actions_payload, extend_seq16, HEADER_V2_SIZE, pack_caps, unpack_init_ack, unpack_grid_payload, MSG_INIT, MSG_ACTION, MSG_SNAPSHOT, MSG_ACK, MSG_HEARTBEAT, MSG_GRID_SNAPSHOT, CAP_GRID_SNAPSHOT, check_auth
+from config import CLIENT_SERVER_HOST, CLIENT_SERVER_PORT, CLIENT_HEARTBEAT_INTERVAL, CLIENT_HEARTBEAT_TIMEOUT, GRID_SIZE, MAX_RECV_SIZE, PACKET_LIFETIME, CLIENT_LOG_LEVEL, CLIENT_PROTOCOL_VERSION, FRAGMENT_NACK_TIMEOUT, FRAGMENT_MAX_NACKS, SOCKET_TIMEOUT, CLIENT_COMPRESSION, CLIENT_ACTION_BATCH_WINDOW, ACTION_BATCH_MAX, CLIENT_RELIABLE_ACTIONS, ACTION_WINDOW, ACTION_RTO_INITIAL, ACTION_RTO_MIN, ACTION_RTO_MAX, SNAPSHOT_BROADCAST_INTERVAL, CLIENT_PREDICTION, CLIENT_CLOCK_SYNC, CLIENT_METRICS_RAW_ROWS, CLIENT_METRICS_SUMMARY_INTERVAL
+from metrics import MetricsWriter
+from netstats import InFlightTable, RttEstimator, Histogram, ClockSync
+from logs import get_logger, EventLog
 import logging
 
 MAXFOURBYTE = 0xFFFFFFFF
 
+# capabilities this client offers in its INIT payload
+CLIENT_CAPS = CAP_GRID_SNAPSHOT | CAP_FRAGMENTS | CAP_ACTION_BATCH | CAP_SNAPSHOT_ACKS
+if CLIENT_COMPRESSION:
+    CLIENT_CAPS |= CAP_COMPRESSION | CAP_COMPRESSION_ZDICT
+if CLIENT_RELIABLE_ACTIONS:
+    CLIENT_CAPS |= CAP_RELIABLE_ACTIONS
+if CLIENT_CLOCK_SYNC:
+    CLIENT_CAPS |= CAP_CLOCK_SYNC
 
-# configure client console logging so UI runs print client logs to the terminal
-logging.basicConfig(level=logging.INFO, format='[CLIENT] %(message)s')
-logger = logging.getLogger('gsyn.client')
+# fragmented snapshots reassembled at once; the oldest is dropped beyond this
+MAX_REASSEMBLIES = 8
+
+
+# client console logging so UI runs print client logs to the terminal
+logger = get_logger('gsyn.client', 'CLIENT', CLIENT_LOG_LEVEL, stream=sys.stderr)
 
 SERVER_ADDR = (CLIENT_SERVER_HOST, CLIENT_SERVER_PORT)
 
+CLIENT_METRICS_HEADER = [
+    'timestamp_ms', 'client_id', 'snapshot_id', 'seq_num',
+    'server_timestamp_ms', 'recv_time_ms', 'latency_ms',
+    'jitter_ms', 'packets_received', 'packets_lost',
+    'loss_percentage', 'ping_ms',
+    'rtt_var_ms', 'min_rtt_ms', 'heartbeat_loss_percentage',
+    'clock_offset_ms'
+]
+# column types for METRICS_FORMAT "columns": 'q' int64, 'd' float64 (columns that can be empty must be 'd')
+CLIENT_METRICS_TYPES = ['q'] * 6 + ['d', 'd', 'q', 'q'] + ['d'] * 6
+
+# distributions summarized per window in client_summary.csv
+SUMMARY_STATS = ('latency', 'jitter', 'interarrival', 'rtt')
+SUMMARY_PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+CLIENT_SUMMARY_HEADER = ['timestamp_ms', 'client_id', 'window_s', 'snapshots'] + [
+    f'{stat}_{name}_ms' for stat in SUMMARY_STATS for name, _ in SUMMARY_PERCENTILES + (('max', None),)
+] + ['jitter_rfc3550_ms', 'loss_percentage', 'heartbeat_loss_percentage']
+CLIENT_SUMMARY_TYPES = ['q', 'q', 'd', 'q'] + ['d'] * (len(CLIENT_SUMMARY_HEADER) - 4)
+
 
 class Client:
     def __init__(self, server_addr=SERVER_ADDR, heartbeat_interval=CLIENT_HEARTBEAT_INTERVAL, heartbeat_timeout=CLIENT_HEARTBEAT_TIMEOUT):
@@ -25,14 +60,35 @@ class Client:
         self.heartbeat_timeout = heartbeat_timeout
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(0.5)
+        self.sock.settimeout(SOCKET_TIMEOUT)
 
         self.running = False
         self.state = 'disconnected'  # 'connecting', 'connected', 'disconnected'
+        # CAP_* bits the server agreed to in its INIT ACK
+        self.caps = 0
+        # player id from the INIT ACK (None from servers that do not send it)
+        self.player_id = None
+        # whether the INIT ACK for our latest INIT arrived; we only connect once it has
+        self.init_acked = False
+        self.init_sent_time = 0.0
+        # header version for packets we send: v1 until the INIT ACK picks one
+        self.version = 1
 
         self.seq = 1
         self.seq_lock = threading.Lock()
 
+        # actions waiting for the batching window to close (CAP_ACTION_BATCH)
+        self.pending_actions = []
+        self.action_lock = threading.Lock()
+        self._flush_timer = None
+        # CAP_RELIABLE_ACTIONS: ACTION packets not yet acked, by action id:
+        # {'cells', 'first_sent', 'last_sent', 'retries'}
+        self.unacked_actions = collections.OrderedDict()
+        self.next_action_id = 1
+        self.action_retransmits = 0
+        # ms from first send to ack for recently acked ACTION packets
+        self.action_commit_ms = collections.deque(maxlen=10000)
+
         self.last_heartbeat_ack = 0.0
         self.last_recv_time = 0.0
         # track last received seq to drop duplicates or replays
@@ -40,19 +96,23 @@ class Client:
         self.last_recv_timestamp_ms = 0
         # track last received snapshot_id to drop redundant snapshots
         self.last_snapshot_id = 0
+        # fragmented snapshots being reassembled: transfer_id -> Reassembly
+        self.reassemblies = collections.OrderedDict()
 
         # ===== PING & PACKET LOSS TRACKING =====
-        # track sent packets for ping measurement: seq -> timestamp (ms)
-        self.sent_packets = {}
-        self.sent_packets_lock = threading.Lock()
-        # rolling ping stats (ms)
+        # RTT estimate from heartbeat round trips (seconds); ping_ms is its smoothed RTT
+        self.rtt = RttEstimator()
         self.ping_ms = 0.0
-        self.ping_samples = []  # keep last 10 samples
-        # heartbeat id counter and pending heartbeats (heartbeat_id -> timestamp_ms)
+        # heartbeat id counter and heartbeats awaiting their ACK (monotonic send time);
+        # unanswered ones expire after heartbeat_timeout and count as heartbeat ACK loss
         self.heartbeat_id = 1
         self.heartbeat_lock = threading.Lock()
-        self.pending_heartbeats = {}
+        self.pending_heartbeats = InFlightTable(timeout=heartbeat_timeout)
         self.pending_heartbeats_lock = threading.Lock()
+        # server clock estimate from heartbeat timestamps (CAP_CLOCK_SYNC); latency_ms is
+        # the one-way latency of the last snapshot, corrected by it
+        self.clock = ClockSync()
+        self.latency_ms = 0.0
         # packet loss tracking: expect next seq from server
         self.expected_next_recv_seq = 1
         self.packets_lost = 0  # count of lost packets
@@ -62,119 +122,335 @@ class Client:
         # CSV metrics tracking
         self.client_id = 1
         self.csv_file = "client_metrics.csv"
-        self.csv_initialized = False
-        self.csv_lock = threading.Lock()
+        self.metrics_writer = None
         self.previous_latency_ms = None
+        # windowed percentile summaries: histograms of the current window and of the whole run
+        self.summary_file = "client_summary.csv"
+        self.summary_writer = None
+        self.stats_lock = threading.Lock()
+        self.window_stats = {stat: Histogram() for stat in SUMMARY_STATS}
+        self.total_stats = {stat: Histogram() for stat in SUMMARY_STATS}
+        self.window_start = time.monotonic()
+        self.threads = []  # listen and heartbeat threads, joined by stop() before the writers close
+        # RFC 3550 interarrival jitter: J += (|D| - J) / 16 over snapshot transit times
+        self.jitter_ms = 0.0
+        self.last_snapshot_arrival = None
 
 
         # Grid (configurable size)
         self.grid = [[0 for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
 
-        # timestamp (seconds) of last grid update received from server
+        # timestamp (seconds) of the last change to grid or the prediction
+        # overlay, so the UI redraws promptly
         self.last_grid_update = 0.0
 
+        # optimistic prediction: (row, col) of our own actions not yet decided
+        # by a snapshot. grid stays authoritative; the overlay is drawn on top
+        # of its empty cells and dropping an entry rolls it back.
+        self.predicted = set()
+        self.prediction_lock = threading.Lock()
+        self.predictions_confirmed = 0
+        self.predictions_rolled_back = 0
+
         # action buffer (kept for completeness)
         self.actions = []
-        logger.info(f'created client; server={self.server_addr} grid={GRID_SIZE}x{GRID_SIZE}')
+        # per-packet events: sampled, rate limited and counted in periodic summaries
+        self.events = EventLog(logger)
+        logger.info('created client; server=%s grid=%dx%d', self.server_addr, GRID_SIZE, GRID_SIZE)
 
     def _send(self, data):
         try:
             self.sock.sendto(data, self.server_addr)
-            # track sent packet for ping measurement
-            try:
-                if len(data) >= 14:
-                    seq = struct.unpack('!I', data[10:14])[0]
-                    now_ms = int(time.time() * 1000)
-                    with self.sent_packets_lock:
-                        self.sent_packets[seq] = now_ms
-                    msg_type = data[5]
-                    logger.info(f'sent msg_type={msg_type} seq={seq} bytes={len(data)}')
-                else:
-                    logger.info(f'sent {len(data)} bytes')
-            except Exception:
-                logger.info(f'sent {len(data)} bytes')
         except Exception:
             pass
 
-    def send_init(self):
+    def _send_packet(self, msg_type, snapshot_id=0, payload=b'', version=None):
+        """Pack and send one packet with the next seq; returns the seq used.
+
+        The seq is taken and the datagram sent under seq_lock, so packets
+        from different threads leave in seq order (the server drops seqs
+        below the last one it accepted).
+        """
+        # once the server clock is known, stamp packets in its time so its staleness check holds under skew
+        timestamp_ms = None
+        if self.clock.offset is not None:
+            now = time.time()
+            timestamp_ms = int((now + self.clock.offset_at(now)) * 1000)
         with self.seq_lock:
             s = self.seq
             self.seq += 1
-        header = pack_header(MSG_INIT, 0, s, 0)
-        logger.info(f'sending INIT seq={s}')
-        self._send(header)
+            header = pack_header(msg_type, snapshot_id, s, len(payload), self.version if version is None else version, timestamp_ms)
+            self._send(header + payload)
+        self.events.debug('sent', 'sent msg_type=%d seq=%d bytes=%d', msg_type, s, len(header) + len(payload))
+        return s
+
+    def send_init(self):
+        # set state before sending: the listen thread may already be handling
+        # the reply (ACK + full snapshot) by the time _send() returns
         self.state = 'connecting'
+        self.init_acked = False
+        self.init_sent_time = time.time()
+        # INIT goes out in the v1 layout; its version byte offers our newest version
+        s = self._send_packet(MSG_INIT, 0, pack_caps(CLIENT_CAPS), CLIENT_PROTOCOL_VERSION)
+        logger.info('sent INIT seq=%d', s)
 
     def send_action(self, row, col):
         if not (0 <= row < GRID_SIZE and 0 <= col < GRID_SIZE):
             return
-        with self.seq_lock:
-            s = self.seq
-            self.seq += 1
-        payload = struct.pack("!HH", row, col)
-        header = pack_header(MSG_ACTION, 0, s, len(payload))
-        logger.info(f'sending ACTION seq={s} row={row} col={col}')
-        self._send(header + payload)
-
-    def send_ack(self):
-        with self.seq_lock:
-            s = self.seq
-            self.seq += 1
-        header = pack_header(MSG_ACK, 0, s, 0)
-        logger.info(f'sending ACK seq={s}')
-        self._send(header)
+        if CLIENT_PREDICTION and self.state == 'connected' and self.player_id is not None and not self.grid[row][col]:
+            with self.prediction_lock:
+                self.predicted.add((row, col))
+            self.last_grid_update = time.time()
+        # once the server agreed to CAP_ACTION_BATCH every ACTION uses the batch layout
+        batched = bool(self.caps & CAP_ACTION_BATCH)
+        if self.state != 'connected':
+            # the caps (and so the ACTION layout) are only known once connected: queue until then
+            with self.action_lock:
+                self.pending_actions.append((row, col))
+            return
+        # reliable actions always go through the queue, which waits for window room
+        if not batched or (CLIENT_ACTION_BATCH_WINDOW <= 0 and not self.caps & CAP_RELIABLE_ACTIONS):
+            self._send_actions([(row, col)], batched)
+            return
+        with self.action_lock:
+            self.pending_actions.append((row, col))
+            flush = len(self.pending_actions) >= ACTION_BATCH_MAX or CLIENT_ACTION_BATCH_WINDOW <= 0
+            if self._flush_timer is None and not flush:
+                self._flush_timer = threading.Timer(CLIENT_ACTION_BATCH_WINDOW, self.flush_actions)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if flush:
+            self.flush_actions()
+
+    def flush_actions(self):
+        """Send the actions queued in the current batching window now.
+
+        With CAP_RELIABLE_ACTIONS only as many packets as fit in ACTION_WINDOW
+        are sent; the rest stay queued until acks make room.
+        """
+        reliable = bool(self.caps & CAP_RELIABLE_ACTIONS)
+        batched = bool(self.caps & CAP_ACTION_BATCH)
+        packets = []
+        with self.action_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self.state != 'connected':
+                return  # sent once the full snapshot connects us
+            actions = self.pending_actions
+            if reliable:
+                room = max(0, ACTION_WINDOW - len(self.unacked_actions))
+                actions = actions[:room * ACTION_BATCH_MAX]
+            self.pending_actions = self.pending_actions[len(actions):]
+            now = time.time()
+            # actions queued while connecting to a server without batching go out one by one
+            per_packet = ACTION_BATCH_MAX if batched else 1
+            for i in range(0, len(actions), per_packet):
+                cells = actions[i:i + per_packet]
+                action_id = None
+                if reliable:
+                    action_id = self.next_action_id
+                    self.next_action_id += 1
+                    self.unacked_actions[action_id] = {'cells': cells, 'first_sent': now, 'last_sent': now, 'retries': 0}
+                packets.append((cells, action_id))
+        for cells, action_id in packets:
+            self._send_actions(cells, batched, action_id)
+
+    def _send_actions(self, cells, batched, action_id=None):
+        if batched:
+            payload = pack_action_batch(cells)
+        else:
+            payload = struct.pack("!HH", *cells[0])
+        if action_id is not None:
+            payload = ACTION_ID.pack(action_id) + payload
+        s = self._send_packet(MSG_ACTION, 0, payload)
+        self.events.info('action', 'sent ACTION seq=%d actions=%d first=(%d,%d)', s, len(cells), *cells[0])
+
+    def _action_rto(self, retries):
+        """Retransmit timeout: the RFC 6298 RTO of the heartbeat RTT plus one snapshot interval (acks ride on snapshots)."""
+        rto = self.rtt.rto()
+        if rto is None:
+            rto = ACTION_RTO_INITIAL
+        else:
+            rto += SNAPSHOT_BROADCAST_INTERVAL
+        return min(ACTION_RTO_MAX, max(ACTION_RTO_MIN, rto) * (2 ** retries))
+
+    def prediction_overlay(self):
+        """Copy of the predicted cells as {(row, col): player_id}; draw them over empty grid cells."""
+        with self.prediction_lock:
+            return dict.fromkeys(self.predicted, self.player_id)
+
+    def _reconcile_predictions(self):
+        """Settle predicted cells against the authoritative grid after a snapshot.
+
+        A cell now owned by us is confirmed and one owned by another player
+        was rejected as occupied, so it is rolled back. A cell still empty
+        stays predicted: the action may just not have been applied yet.
+        """
+        if not self.predicted:
+            return
+        with self.prediction_lock:
+            for row, col in list(self.predicted):
+                owner = self.grid[row][col]
+                if owner == self.player_id:
+                    self.predictions_confirmed += 1
+                elif owner:
+                    self.predictions_rolled_back += 1
+                    self.events.info('prediction_rollback', 'prediction (%d,%d) rolled back: taken by player %d', row, col, owner)
+                else:
+                    continue
+                self.predicted.discard((row, col))
+
+    def _handle_action_ack(self, trailer):
+        """Drop the ACTION packets an ACTION_ACK trailer covers and fast-retransmit the gaps it shows."""
+        cumulative, bitmap = ACTION_ACK.unpack_from(trailer)
+        now = time.time()
+        resend = []
+        with self.action_lock:
+            if not self.unacked_actions:
+                return
+            # newest first send among acked packets never retransmitted: anything
+            # still unacked that was last sent before it was most likely lost
+            newest_acked = 0.0
+            for action_id in list(self.unacked_actions):
+                bit = action_id - cumulative - 2
+                if action_id <= cumulative or (0 <= bit < 32 and bitmap >> bit & 1):
+                    entry = self.unacked_actions.pop(action_id)
+                    self.action_commit_ms.append((now - entry['first_sent']) * 1000)
+                    if not entry['retries']:
+                        newest_acked = max(newest_acked, entry['first_sent'])
+            for action_id, entry in self.unacked_actions.items():
+                if entry['last_sent'] < newest_acked:
+                    entry['last_sent'] = now
+                    entry['retries'] += 1
+                    resend.append((action_id, entry['cells']))
+            flush = self.pending_actions and self._flush_timer is None
+        self._resend_actions(resend, 'fast retransmit')
+        if flush:
+            self.flush_actions()
+
+    def _check_actions(self):
+        """Retransmit ACTION packets whose retransmit timeout passed without an ack."""
+        if not self.unacked_actions or self.state != 'connected':
+            return
+        now = time.time()
+        resend = []
+        with self.action_lock:
+            for action_id, entry in self.unacked_actions.items():
+                if now - entry['last_sent'] >= self._action_rto(entry['retries']):
+                    entry['last_sent'] = now
+                    entry['retries'] += 1
+                    resend.append((action_id, entry['cells']))
+        self._resend_actions(resend, 'timeout')
+
+    def _resend_actions(self, resend, reason):
+        for action_id, cells in resend:
+            self.action_retransmits += 1
+            self.events.info('action_retransmit', 'retransmitting ACTION id=%d (%s)', action_id, reason)
+            self._send_actions(cells, True, action_id)
+
+    def send_ack(self, snapshot_id=0):
+        """Send an ACK; snapshot_id names the snapshot it acknowledges, if any."""
+        s = self._send_packet(MSG_ACK, snapshot_id)
+        self.events.debug('ack', 'sent ACK seq=%d snapshot=%d', s, snapshot_id)
 
     def start(self):
         if self.running:
             return
-        # Initialize CSV file at startup
-        with self.csv_lock:
-            self._init_csv_file()
-        
+        # Start the metrics writer at startup
+        self._init_csv_file()
+
         self.running = True
-        threading.Thread(target=self._listen_loop, daemon=True).start()
-        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
-        # send initial init
+        self.threads = [threading.Thread(target=self._listen_loop, daemon=True)]
+        self.threads[0].start()
+        # send initial init before the heartbeat loop starts, otherwise it can
+        # still see 'disconnected' and send a second INIT after we connected
         self.send_init()
+        self.threads.append(threading.Thread(target=self._heartbeat_loop, daemon=True))
+        self.threads[1].start()
 
     def stop(self):
+        self.flush_actions()
         self.running = False
         try:
             self.sock.close()
         except Exception:
             pass
+        # the listen thread may be in _log_metrics_to_csv and the heartbeat thread in
+        # _write_summary: let both finish before their writers are closed and dropped
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=self.heartbeat_interval + SOCKET_TIMEOUT + 1)
+        self.threads = []
+        if self.metrics_writer is not None:
+            self.metrics_writer.close()
+            if self.metrics_writer.dropped:
+                logger.warning('metrics writer dropped %d rows (queue full)', self.metrics_writer.dropped)
+            if self.metrics_writer.failed:
+                logger.warning('metrics writer lost %d rows (write errors)', self.metrics_writer.failed)
+            self.metrics_writer = None
+        if self.summary_writer is not None:
+            self._write_summary()
+            self.summary_writer.close()
+            self.summary_writer = None
+        latency = self.total_stats['latency']
+        if latency.total:
+            logger.info('snapshot latency p50=%.1fms p90=%.1fms p99=%.1fms p99.9=%.1fms, jitter %.2fms (RFC 3550) over %d snapshots',
+                        latency.percentile(50), latency.percentile(90), latency.percentile(99), latency.percentile(99.9),
+                        self.jitter_ms, latency.total)
+        if self.action_commit_ms:
+            commit_ms = sorted(self.action_commit_ms)
+            logger.info('ACTION commit latency p50=%.1fms p99=%.1fms over %d packets, %d retransmits',
+                        commit_ms[len(commit_ms) // 2], commit_ms[int(len(commit_ms) * 0.99)],
+                        len(commit_ms), self.action_retransmits)
+        if self.predictions_confirmed or self.predictions_rolled_back:
+            logger.info('predictions: %d confirmed, %d rolled back', self.predictions_confirmed, self.predictions_rolled_back)
+        if self.rtt.samples:
+            logger.info('heartbeat RTT srtt=%.1fms rttvar=%.1fms min=%.1fms over %d samples; %d/%d heartbeat ACKs lost (%.1f%%)',
+                        self.rtt.srtt * 1000, self.rtt.rttvar * 1000, self.rtt.min_rtt * 1000, self.rtt.samples,
+                        self.pending_heartbeats.lost, self.pending_heartbeats.sent_count,
+                        self.pending_heartbeats.loss_percentage())
+        self.events.summarize(force=True)
 
     def _listen_loop(self):
+        # one preallocated receive buffer; packets are parsed through
+        # memoryview slices of it, which handlers must not keep (Reassembly copies)
+        buf = bytearray(MAX_RECV_SIZE)
+        view = memoryview(buf)
         while self.running:
             try:
-                data, _ = self.sock.recvfrom(MAX_RECV_SIZE)
+                nbytes, _ = self.sock.recvfrom_into(buf)
             except socket.timeout:
+                self._check_timers()
                 continue
             except Exception:
                 break
 
             self.last_recv_time = time.time()
-            # validate header
-            if len(data) < 28:
-                continue
-            ok, reason = check_auth(data[:28])
-            if not ok:
-                logger.warning(f'packet rejected: {reason}')
+            data = view[:nbytes]
+            # validate and parse the header (v1 or v2)
+            header = parse_header(data)
+            if header is None:
+                self.events.log('rejected', logging.WARNING, 'packet rejected: %s', check_auth(data)[1])
                 continue
 
-            # parse header fields
-            msg_type = data[5]
-            snapshot_id = struct.unpack("!I", data[6:10])[0]
-            seq_num = struct.unpack("!I", data[10:14])[0]
-            timestamp_ms = struct.unpack("!Q", data[14:22])[0]
+            msg_type = header.msg_type
+            snapshot_id = header.snapshot_id
+            timestamp_ms = header.timestamp_ms
+            seq_num = header.seq_num
+            if header.size == HEADER_V2_SIZE and self.last_seq_received:
+                seq_num = extend_seq16(seq_num, self.last_seq_received)
 
             # common validation: drop old/duplicate or stale packets
             if seq_num <= self.last_seq_received:
-                logger.info(f'dropping packet seq={seq_num} <= last_seq={self.last_seq_received}')
+                self.events.debug('duplicate', 'dropping packet seq=%d <= last_seq=%d', seq_num, self.last_seq_received)
                 continue
             now_ms = int(time.time() * 1000)
-            if now_ms - timestamp_ms > int(PACKET_LIFETIME * 1000):
-                logger.info(f'dropping packet seq={seq_num} stale by {now_ms - timestamp_ms}ms')
+            # packet age on the server's clock, so clock skew does not make packets look stale;
+            # ACKs are exempt, as the INIT ACK and heartbeat ACKs arrive before the skew is known
+            age_ms = now_ms + self.clock.offset_at(now_ms / 1000) * 1000 - timestamp_ms
+            if age_ms > PACKET_LIFETIME * 1000 and msg_type != MSG_ACK:
+                self.events.debug('stale', 'dropping packet seq=%d stale by %dms', seq_num, age_ms)
                 continue
 
             # accept this packet
@@ -186,15 +462,24 @@ class Client:
                 if seq_num > self.expected_next_recv_seq:
                     gap = seq_num - self.expected_next_recv_seq
                     self.packets_lost += gap
-                    logger.info(f'packet loss detected: gap of {gap} (expected {self.expected_next_recv_seq}, got {seq_num})')
+                    self.events.info('loss', 'packet loss detected: gap of %d (expected %d, got %d)', gap, self.expected_next_recv_seq, seq_num)
                 self.expected_next_recv_seq = seq_num + 1
                 self.packets_received += 1
 
+            # CAP_RELIABLE_ACTIONS: an ACTION_ACK may follow the payload; slice only what is there
+            end = header.size + header.payload_len
+            if nbytes - end >= ACTION_ACK.size and self.caps & CAP_RELIABLE_ACTIONS:
+                self._handle_action_ack(data[end:])
+            payload = data[header.size:end] if header.payload_len else b''
+
             # dispatch by message type
             if msg_type == MSG_ACK:
-                self._handle_ack(snapshot_id)
-            elif msg_type == MSG_SNAPSHOT:
-                self._handle_snapshot(data, snapshot_id, seq_num, timestamp_ms, now_ms)
+                self._handle_ack(snapshot_id, payload, header.version)
+            elif msg_type & MSG_TYPE_MASK in (MSG_SNAPSHOT, MSG_GRID_SNAPSHOT):
+                self._handle_snapshot(msg_type, payload, snapshot_id, seq_num, timestamp_ms, now_ms)
+            elif msg_type == MSG_SNAPSHOT_FRAG:
+                self._handle_fragment(payload, snapshot_id, seq_num, timestamp_ms, now_ms)
+            self._check_timers()
 
 
     def _heartbeat_loop(self):
@@ -203,19 +488,18 @@ class Client:
             now = time.time()
             if self.state != 'disconnected':
                 # send heartbeat
-                with self.seq_lock:
-                    s = self.seq
-                    self.seq += 1
                 # create a heartbeat id and send it in the snapshot_id field
                 with self.heartbeat_lock:
                     self.heartbeat_id += 1
                     hb_id = self.heartbeat_id
-                hb = pack_header(MSG_HEARTBEAT, hb_id, s, 0)
-                # record pending heartbeat timestamp for ping measurement
-                now_ms = int(time.time() * 1000)
+                # record the send time for the RTT; expire heartbeats whose ACK never came
                 with self.pending_heartbeats_lock:
-                    self.pending_heartbeats[hb_id] = now_ms
-                self._send(hb)
+                    sent = time.monotonic()
+                    if self.pending_heartbeats.expire(sent):
+                        self.events.debug('heartbeat_lost', 'heartbeat ACK lost (%.1f%% so far)', self.pending_heartbeats.loss_percentage())
+                    self.pending_heartbeats.add(hb_id, sent)
+                stamp = CLOCK_STAMP.pack(int(time.time() * 1e6)) if self.caps & CAP_CLOCK_SYNC else b''
+                self._send_packet(MSG_HEARTBEAT, hb_id, stamp)
                 # check timeout
                 if now - self.last_heartbeat_ack > self.heartbeat_timeout and self.heartbeat_id > 2:
                     self.state = 'disconnected'
@@ -223,57 +507,139 @@ class Client:
             elif self.state == 'disconnected':
                 # attempt to connect
                 self.send_init()
+            self.events.summarize()
+            if self.summary_writer is not None and time.monotonic() - self.window_start >= CLIENT_METRICS_SUMMARY_INTERVAL:
+                self._write_summary()
             time.sleep(self.heartbeat_interval)
 
     # ----- helper handlers extracted from _listen_loop -----
-    def _handle_ack(self, snapshot_id):
-        """Handle an incoming ACK packet. If snapshot_id matches a pending
-        heartbeat id, compute ping and update last_heartbeat_ack. Otherwise
-        treat it as a generic ACK (e.g. INIT ack)."""
-        now_ms = int(time.time() * 1000)
+    def _handle_ack(self, snapshot_id, payload=b'', version=1):
+        """Handle an incoming ACK packet. A nonzero snapshot_id echoes a
+        heartbeat id: feed the RTT estimator and update last_heartbeat_ack.
+        Id 0 is the INIT ACK, whose header version is the one the server
+        picked for us."""
         hb_id = snapshot_id
-        handled_hb = False
         if hb_id != 0:
+            now = time.monotonic()
             with self.pending_heartbeats_lock:
-                if hb_id in self.pending_heartbeats:
-                    sent_time = self.pending_heartbeats.pop(hb_id)
-                    ping = now_ms - sent_time
-                    self.ping_samples.append(ping)
-                    if len(self.ping_samples) > 10:
-                        self.ping_samples.pop(0)
-                    self.ping_ms = sum(self.ping_samples) / len(self.ping_samples)
-                    logger.info(f'ping (heartbeat): {ping}ms (avg: {self.ping_ms:.1f}ms)')
-                    self.last_heartbeat_ack = time.time()
-                    handled_hb = True
-
-        if not handled_hb:
-            self.state = 'connecting'  # remain connecting until full snapshot
-            logger.info(f'ACK received (for INIT) snapshot={snapshot_id}')
+                sent = self.pending_heartbeats.pop(hb_id)
+                if sent is None:
+                    # duplicate, or so late it was already counted as lost
+                    self.events.debug('heartbeat_late', 'ignoring ACK for unknown heartbeat %d', hb_id)
+                    return
+                self.rtt.update(now - sent, now)
+            if len(payload) >= CLOCK_REPLY.size:
+                t1, t2, t3 = CLOCK_REPLY.unpack_from(payload)
+                self.clock.update(t1 / 1e6, t2 / 1e6, t3 / 1e6, time.time())
+            self._record_stat('rtt', (now - sent) * 1000)
+            self.ping_ms = self.rtt.srtt * 1000
+            self.events.debug('ping', 'ping (heartbeat): %.1fms (srtt: %.1fms, rttvar: %.1fms)',
+                              (now - sent) * 1000, self.ping_ms, self.rtt.rttvar * 1000)
+            self.last_heartbeat_ack = time.time()
+        else:
+            if self.state != 'connecting' or self.init_acked:
+                # the server repeats the INIT ACK with every full snapshot until it sees our ACK
+                return
+            caps, player_id = unpack_init_ack(payload)
+            if player_id != self.player_id:
+                # a new registration starts a new action id stream: queue unacked actions again under new ids
+                with self.action_lock:
+                    requeue = [cell for entry in self.unacked_actions.values() for cell in entry['cells']]
+                    self.unacked_actions.clear()
+                    self.next_action_id = 1
+                    self.pending_actions[:0] = requeue
+            self.caps, self.player_id = caps, player_id
+            self.version = version
+            self.init_acked = True  # remain connecting until full snapshot
+            logger.info('ACK received (for INIT) snapshot=%d caps=%#x header=v%d player=%s', snapshot_id, self.caps, version, self.player_id)
+
+    def _handle_fragment(self, payload, snapshot_id, seq_num, timestamp_ms, now_ms):
+        """Collect a SNAPSHOT_FRAG fragment and apply the snapshot once all fragments arrived."""
+        try:
+            transfer_id, msg_type, index, count, chunk = unpack_fragment(payload)
+        except struct.error:
+            return
+        reassembly = self.reassemblies.get(transfer_id)
+        if reassembly is None:
+            if snapshot_id != MAXFOURBYTE and snapshot_id <= self.last_snapshot_id:
+                return  # a newer snapshot was already applied
+            reassembly = self.reassemblies[transfer_id] = Reassembly(transfer_id, msg_type, count, snapshot_id)
+            while len(self.reassemblies) > MAX_REASSEMBLIES:
+                self.reassemblies.popitem(last=False)
+        if reassembly.add(index, chunk):
+            del self.reassemblies[transfer_id]
+            self._handle_snapshot(msg_type, reassembly.payload(), snapshot_id, seq_num, timestamp_ms, now_ms)
+        elif index == count - 1:
+            # the last fragment is here but some before it are not: ask for them now
+            self._send_frag_nack(reassembly)
+
+    def _check_timers(self):
+        """Run the fragment NACK and action retransmit checks, then pick the next recv timeout."""
+        self._check_reassemblies()
+        self._check_actions()
+        timeout = SOCKET_TIMEOUT
+        # wake up often enough to NACK or retransmit while something is outstanding
+        if self.reassemblies:
+            timeout = FRAGMENT_NACK_TIMEOUT
+        if self.unacked_actions:
+            timeout = min(timeout, ACTION_RTO_MIN / 2)
+        if self.sock.gettimeout() != timeout:
+            self.sock.settimeout(timeout)
+
+    def _check_reassemblies(self):
+        """NACK transfers that stalled for FRAGMENT_NACK_TIMEOUT; drop superseded or hopeless ones."""
+        if not self.reassemblies:
+            return
+        now = time.time()
+        for transfer_id, reassembly in list(self.reassemblies.items()):
+            superseded = reassembly.snapshot_id != MAXFOURBYTE and reassembly.snapshot_id <= self.last_snapshot_id
+            if superseded or reassembly.nacks >= FRAGMENT_MAX_NACKS:
+                del self.reassemblies[transfer_id]
+            elif now - reassembly.last_activity >= FRAGMENT_NACK_TIMEOUT:
+                self._send_frag_nack(reassembly)
+
+    def _send_frag_nack(self, reassembly):
+        """Report the fragments received so far; the server resends the rest."""
+        reassembly.nacks += 1
+        reassembly.last_activity = time.time()
+        payload = pack_frag_nack(reassembly.transfer_id, reassembly.count, reassembly.bitmap)
+        self._send_packet(MSG_FRAG_NACK, reassembly.snapshot_id, payload)
+        self.events.debug('frag_nack', 'sent FRAG_NACK transfer=%d received=%d/%d',
+                          reassembly.transfer_id, reassembly.received, reassembly.count)
 
     def _init_csv_file(self):
-        """Initialize CSV file with headers at startup."""
-        if not self.csv_initialized:
-            file_exists = os.path.exists(self.csv_file)
-            with open(self.csv_file, 'a', newline='') as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow([
-                        'timestamp_ms', 'client_id', 'snapshot_id', 'seq_num',
-                        'server_timestamp_ms', 'recv_time_ms', 'latency_ms',
-                        'jitter_ms', 'packets_received', 'packets_lost',
-                        'loss_percentage', 'ping_ms'
-                    ])
-                f.flush()
-                os.fsync(f.fileno())
-            self.csv_initialized = True
-
-    def _handle_snapshot(self, data, snapshot_id, seq_num, timestamp_ms, now_ms):
+        """Start the metrics writers for csv_file and summary_file (writing headers for new files)."""
+        if self.metrics_writer is None and CLIENT_METRICS_RAW_ROWS:
+            self.metrics_writer = MetricsWriter(self.csv_file, CLIENT_METRICS_HEADER, types=CLIENT_METRICS_TYPES)
+            self.metrics_writer.start()
+        if self.summary_writer is None and CLIENT_METRICS_SUMMARY_INTERVAL:
+            self.summary_writer = MetricsWriter(self.summary_file, CLIENT_SUMMARY_HEADER, types=CLIENT_SUMMARY_TYPES)
+            self.summary_writer.start()
+
+    def _handle_snapshot(self, msg_type, payload, snapshot_id, seq_num, timestamp_ms, now_ms):
         """Apply an incoming SNAPSHOT payload to the local grid."""
+        if msg_type & MSG_COMPRESSED:
+            try:
+                payload = decompress_payload(payload, bool(msg_type & MSG_COMPRESSED_ZDICT))
+            except zlib.error:
+                self.events.log('rejected', logging.WARNING, 'undecodable compressed snapshot id=%d', snapshot_id)
+                return
+            msg_type &= MSG_TYPE_MASK
             
         if snapshot_id == MAXFOURBYTE:
-            logger.info(f'FULL SNAPSHOT received id={snapshot_id} seq={seq_num}')
+            logger.info('FULL SNAPSHOT received id=%d seq=%d', snapshot_id, seq_num)
+            if not self.init_acked:
+                # without the INIT ACK we know neither the caps nor the header version to use;
+                # a pending server repeats it, otherwise (e.g. it still sees us active) re-INIT
+                if time.time() - self.init_sent_time >= self.heartbeat_interval:
+                    self.send_init()
+                return
             self.state = 'connected'
-            self.send_ack()
+            # the ACK activates us; by the full snapshot's id it also starts delta snapshots
+            self.send_ack(MAXFOURBYTE if self.caps & CAP_SNAPSHOT_ACKS else 0)
+            if self.pending_actions:
+                # actions queued again after a new INIT ACK
+                self.flush_actions()
         
         # Client timed out
         if self.state == 'disconnected':
@@ -287,77 +653,131 @@ class Client:
 
         # drop redundant snapshots unless full snapshot (MAXFOURBYTE)
         if snapshot_id <= self.last_snapshot_id and snapshot_id != MAXFOURBYTE:
-            logger.info(f'dropping SNAPSHOT id={snapshot_id} <= last_id={self.last_snapshot_id}')
+            self.events.debug('snapshot_dropped', 'dropping SNAPSHOT id=%d <= last_id=%d', snapshot_id, self.last_snapshot_id)
             return
         # Track last snapshot id unless full snapshot
         self.last_snapshot_id = snapshot_id if snapshot_id != MAXFOURBYTE else self.last_snapshot_id
-        payload_len = struct.unpack("!H", data[22:24])[0]
-        payload = data[28:28 + payload_len] if payload_len > 0 else b''
         count = 0
-        if payload:
-            try:
-                count = struct.unpack("!H", payload[:2])[0]
-                offset = 2
-                for i in range(count):
-                    if offset + 6 > len(payload):
-                        break
-                    row, col, player_id = struct.unpack("!H H H", payload[offset:offset+6])
-                    offset += 6
-                    if 0 <= row < GRID_SIZE and 0 <= col < GRID_SIZE:
-                        self.grid[row][col] = player_id
-            except Exception:
-                pass
+        if msg_type == MSG_GRID_SNAPSHOT:
+            count = self._apply_grid_payload(payload)
+        else:
+            grid = self.grid
+            for row, col, player_id in iter_actions_payload(payload):
+                if row < GRID_SIZE and col < GRID_SIZE:
+                    grid[row][col] = player_id
+                count += 1
+
+        # delta mode: tell the server which snapshot we hold so the next delta can start from it
+        if self.caps & CAP_SNAPSHOT_ACKS and snapshot_id != MAXFOURBYTE:
+            self.send_ack(snapshot_id)
+
+        self._reconcile_predictions()
 
         # mark when we last applied a grid snapshot so UI can redraw promptly
         self.last_grid_update = time.time()
-        logger.info(f'SNAPSHOT received id={snapshot_id} seq={seq_num} actions={count if payload else 0}')
+        self.events.info('snapshot', 'SNAPSHOT received id=%d seq=%d actions=%d', snapshot_id, seq_num, count if payload else 0)
 
         # Log metrics to CSV
         self._log_metrics_to_csv(snapshot_id, seq_num, timestamp_ms, now_ms)
 
-    def _log_metrics_to_csv(self, snapshot_id, seq_num, server_timestamp_ms, recv_time_ms):
-        """Log metrics to CSV file when a SNAPSHOT is received."""
-        with self.csv_lock:
-            if not self.csv_initialized:
-                self._init_csv_file()
-
-            timestamp_ms = int(time.time() * 1000)
-            latency_ms = recv_time_ms - server_timestamp_ms
+    def _apply_grid_payload(self, payload):
+        """Overwrite the local grid from a grid-state full snapshot; returns owned cell count."""
+        try:
+            rows, cols, cells = unpack_grid_payload(payload)
+        except Exception:
+            return 0
+        for r in range(min(rows, GRID_SIZE)):
+            row_cells = cells[r * cols:r * cols + min(cols, GRID_SIZE)]
+            self.grid[r][:len(row_cells)] = row_cells
+        return len(cells) - cells.count(0)
+
+    def _record_stat(self, stat, value):
+        with self.stats_lock:
+            self.window_stats[stat].record(value)
+            self.total_stats[stat].record(value)
+
+    def _write_summary(self):
+        """Queue one percentile row for the window just ended and start a new one."""
+        writer = self.summary_writer
+        if writer is None:
+            return
+        now = time.monotonic()
+        with self.stats_lock:
+            window, self.window_stats = self.window_stats, {stat: Histogram() for stat in SUMMARY_STATS}
+            window_s, self.window_start = now - self.window_start, now
+        if not any(hist.total for hist in window.values()):
+            return
+        row = [int(time.time() * 1000), self.client_id, round(window_s, 3), window['latency'].total]
+        for stat in SUMMARY_STATS:
+            hist = window[stat]
+            for _, q in SUMMARY_PERCENTILES:
+                value = hist.percentile(q)
+                row.append('' if value is None else round(value, 3))
+            row.append('' if hist.max is None else round(hist.max, 3))
+        with self.recv_stats_lock:
+            total_packets = self.packets_received + self.packets_lost
+            loss_percentage = (self.packets_lost / total_packets * 100.0) if total_packets > 0 else 0.0
+        row += [round(self.jitter_ms, 3), round(loss_percentage, 3), round(self.pending_heartbeats.loss_percentage(), 3)]
+        writer.write(row)
 
-            jitter_ms = 0.0
+    def _log_metrics_to_csv(self, snapshot_id, seq_num, server_timestamp_ms, recv_time_ms):
+        """Record a received SNAPSHOT in the histograms and queue its raw CSV row."""
+        # recv time on the server's clock, so skew between the hosts is not counted as latency
+        clock_offset_ms = self.clock.offset_at(recv_time_ms / 1000) * 1000
+        latency_ms = recv_time_ms + clock_offset_ms - server_timestamp_ms
+        self.latency_ms = latency_ms
+
+        jitter_ms = 0.0
+        # until the first clock sync reply the latency still includes the skew: keep it out of the stats
+        if self.clock.offset is not None or not self.caps & CAP_CLOCK_SYNC:
             if self.previous_latency_ms is not None:
                 jitter_ms = abs(latency_ms - self.previous_latency_ms)
+                self.jitter_ms += (jitter_ms - self.jitter_ms) / 16
+                self._record_stat('jitter', jitter_ms)
             self.previous_latency_ms = latency_ms
+            self._record_stat('latency', latency_ms)
 
-            with self.recv_stats_lock:
-                packets_received = self.packets_received
-                packets_lost = self.packets_lost
-                total_packets = packets_received + packets_lost
-                loss_percentage = (packets_lost / total_packets * 100.0) if total_packets > 0 else 0.0
-
-            ping_ms = self.ping_ms
-
-            with open(self.csv_file, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    timestamp_ms, self.client_id, snapshot_id, seq_num,
-                    server_timestamp_ms, recv_time_ms, latency_ms,
-                    jitter_ms, packets_received, packets_lost,
-                    loss_percentage, ping_ms
-                ])
-                f.flush()
-                os.fsync(f.fileno())
+        arrival = time.monotonic()
+        if self.last_snapshot_arrival is not None:
+            self._record_stat('interarrival', (arrival - self.last_snapshot_arrival) * 1000)
+        self.last_snapshot_arrival = arrival
 
-  
+        writer = self.metrics_writer
+        if writer is None:
+            return
+        timestamp_ms = int(time.time() * 1000)
+
+        with self.recv_stats_lock:
+            packets_received = self.packets_received
+            packets_lost = self.packets_lost
+        total_packets = packets_received + packets_lost
+        loss_percentage = (packets_lost / total_packets * 100.0) if total_packets > 0 else 0.0
+
+        writer.write([
+            timestamp_ms, self.client_id, snapshot_id, seq_num,
+            server_timestamp_ms, recv_time_ms, latency_ms,
+            jitter_ms, packets_received, packets_lost,
+            loss_percentage, self.ping_ms,
+            round(self.rtt.rttvar * 1000, 3) if self.rtt.samples else '',
+            round(self.rtt.min_rtt * 1000, 3) if self.rtt.samples else '',
+            round(self.pending_heartbeats.loss_percentage(), 3),
+            round(clock_offset_ms, 3)
+        ])
 
 
 if __name__ == '__main__':
     # simple CLI run for manual testing
-    c = Client()
+    import argparse
+    parser = argparse.ArgumentParser(description="GridSync client")
+    parser.add_argument('--host', default=CLIENT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=CLIENT_SERVER_PORT)
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run')
+    args = parser.parse_args()
+    c = Client(server_addr=(args.host, args.port))
     c.start()
     try:
         start = time.time()
-        while time.time() - start < 20:
+        while time.time() - start < args.duration:
             time.sleep(1)
     except KeyboardInterrupt:
         pass
@@ -7,24 +7,77 @@ Modify these variables to change behavior without editing client.py or server.py
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 9999
 SERVER_RUN_DURATION = 120  # seconds; set to float('inf') for indefinite runtime
+SERVER_ENGINE = "threaded"  # "threaded" (recv loop + broadcast thread) or "asyncio" (single event loop)
+SERVER_WORKERS = 1  # >1 runs that many SO_REUSEPORT worker processes sharing one board (Linux)
 
 # ========== CLIENT CONFIGURATION ==========
 CLIENT_SERVER_HOST = "127.0.0.1"
 CLIENT_SERVER_PORT = 9999
 CLIENT_HEARTBEAT_INTERVAL = 0.5  # seconds between heartbeat sends
 CLIENT_HEARTBEAT_TIMEOUT = 3.0  # seconds before disconnection if no ACK
+CLIENT_ACTION_BATCH_WINDOW = 0.008  # seconds; actions queued within this window share one ACTION packet (0 = one packet per action)
+ACTION_BATCH_MAX = 256  # most actions in one batched ACTION packet
+CLIENT_RELIABLE_ACTIONS = True  # offer CAP_RELIABLE_ACTIONS: unacked ACTION packets are retransmitted
+ACTION_WINDOW = 32  # most unacked ACTION packets in flight; later actions wait for acks
+ACTION_RTO_INITIAL = 0.25  # seconds; retransmit timeout until the first heartbeat RTT sample
+ACTION_RTO_MIN = 0.08  # seconds; bounds of the retransmit timeout (heartbeat RTO + one snapshot interval, doubled per retry)
+ACTION_RTO_MAX = 2.0
+CLIENT_PREDICTION = True  # show own actions on empty cells at once, until the server confirms or rejects them
+CLIENT_CLOCK_SYNC = True  # offer CAP_CLOCK_SYNC: heartbeats estimate the server clock offset so latency is true one-way latency
 
 # ========== PROTOCOL CONFIGURATION ==========
 HEARTBEAT_INTERVAL = 0.5  # seconds; server-side heartbeat broadcast interval
 HEARTBEAT_TIMEOUT = 3.0  # seconds; server marks client inactive if no ACK in this time
+ACTION_ACK_LINGER = 1.0  # seconds; action acks keep riding on a client's packets after its last ACTION
+SERVER_PROTOCOL_VERSION = 2  # newest header version the server accepts in INIT (2 = compact 18-byte header)
+CLIENT_PROTOCOL_VERSION = 2  # header version the client offers in INIT (1 = legacy 28-byte header only)
 
 # ========== SNAPSHOT & ACTION UPDATES ==========
 SNAPSHOT_BROADCAST_INTERVAL = 0.05  # seconds between snapshot broadcasts
+TICK_DEGRADE = True  # stretch the tick interval while the broadcast work exceeds TICK_BUDGET of it
+TICK_MAX_INTERVAL = 0.2  # seconds; slowest tick rate degrade mode may fall back to
+TICK_BUDGET = 0.8  # fraction of the tick interval the broadcast work may use before degrading
 LAST_K_ACTIONS = 20  # number of recent actions to include in snapshots
+SNAPSHOT_MODE = "redundant"  # "redundant" (last K actions) or "delta" (actions since each client's last ACK)
+DELTA_MAX_ACTIONS = 400  # delta mode: resync with a full snapshot when a client is further behind than this
+SNAPSHOT_HISTORY = 256  # delta mode: how many recent snapshot ids the server can map back to an action seq
+FULL_SNAPSHOT_ENCODING = "grid"  # "grid" (bit-packed board, O(grid)) or "actions" (whole action history)
 
 # ========== GRID CONFIGURATION ==========
 GRID_SIZE = 20  # 20x20 grid
 MAX_PLAYERS = 4  # maximum number of concurrent players
+ACTION_LOG_CAPACITY = 4096  # actions kept in the server's ring-buffer log (older history is checkpointed)
+GRID_BACKEND = "python"  # "python" (list of lists) or "numpy" (ndarray grid, for very large GRID_SIZE; needs numpy)
+
+# ========== LOGGING ==========
+SERVER_LOG_LEVEL = "INFO"  # "DEBUG" also logs every packet; "WARNING" keeps only problems
+CLIENT_LOG_LEVEL = "INFO"
+LOG_SAMPLE = {'snapshot': 20, 'action': 1}  # event -> log only 1 in N occurrences
+LOG_RATE_LIMIT = 20  # max lines per second per event (0 = unlimited); the rest are counted
+LOG_SUMMARY_INTERVAL = 5.0  # seconds between "summary" lines with per-event counts (0 = off)
+
+# ========== METRICS CSV WRITER ==========
+METRICS_BATCH_SIZE = 64  # rows written per batch by the background metrics writer
+METRICS_FLUSH_INTERVAL = 1.0  # seconds; queued rows are flushed at least this often
+METRICS_QUEUE_SIZE = 10000  # rows buffered in memory before the writer falls behind
+METRICS_BLOCK_WHEN_FULL = False  # True: callers wait for queue room; False: drop the row and count it
+METRICS_FSYNC = False  # fsync after each flushed batch
+METRICS_FORMAT = "csv"  # "csv", or "columns": binary columnar <name>.cols tables (typed arrays per column, memory-mapped by analyze_results.py)
+CLIENT_METRICS_RAW_ROWS = True  # client writes one client_metrics.csv row per snapshot (False keeps multi-hour runs small)
+CLIENT_METRICS_SUMMARY_INTERVAL = 10.0  # seconds between percentile rows in client_summary.csv (0 = off)
+
+# ========== SNAPSHOT FRAGMENTATION ==========
+FRAGMENT_SIZE = 1200  # bytes of snapshot payload per SNAPSHOT_FRAG datagram (fits the 1280-byte IPv6 minimum MTU)
+FRAGMENT_CACHE = 64  # fragmented transfers the server keeps to answer FRAG_NACKs
+FRAGMENT_RETRY_INTERVAL = 1.0  # seconds; a fragmented full snapshot is re-sent at most this often (NACKs repair it meanwhile)
+FRAGMENT_NACK_TIMEOUT = 0.05  # seconds without a new fragment before the client NACKs the missing ones
+FRAGMENT_MAX_NACKS = 20  # client drops an incomplete transfer after this many NACKs
+
+# ========== SNAPSHOT COMPRESSION ==========
+COMPRESSION_LEVEL = 1  # zlib level for snapshots to clients that offer compression (0 = never compress); 6+ is ~5x slower on big boards for a few % smaller
+COMPRESSION_MIN_SIZE = 64  # bytes; smaller snapshot payloads are sent uncompressed
+COMPRESSION_USE_ZDICT = True  # use the preset GridSync deflate dictionary with clients that offer it
+CLIENT_COMPRESSION = True  # client offers compression (and the preset dictionary) in INIT
 
 # ========== SOCKET CONFIGURATION ==========
 SOCKET_TIMEOUT = 0.5  # seconds; socket timeout for recv operations
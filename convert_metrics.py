@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Convert metrics CSVs into the binary columnar format (METRICS_FORMAT = "columns").
+
+Each <name>.csv becomes <name>.cols next to it, which analyze_results.py
+memory-maps instead of parsing the CSV. Column types are inferred: 'q'
+(int64) when every cell is an integer, otherwise 'd' (float64, with empty
+cells as NaN). Columns that are not numeric are left out with a warning.
+
+Usage:
+    python3 convert_metrics.py                 # every metrics CSV in results/
+    python3 convert_metrics.py path/to/client_metrics.csv ...
+"""
+import csv
+import os
+import shutil
+import sys
+
+from metrics import ColumnFiles, columns_path
+
+RESULTS_DIR = "results"
+TEST_SCENARIOS = ["baseline", "loss_2", "loss_5", "delay_100ms"]
+METRICS_FILES = ["client_metrics.csv", "server_metrics.csv", "client_summary.csv"]
+
+BATCH_ROWS = 65536
+
+
+def _narrow(typecode, value):
+    """Column type after seeing one more cell: 'q', 'd' or None (not numeric)."""
+    if typecode == 'q':
+        try:
+            int(value)
+            return 'q'
+        except ValueError:
+            typecode = 'd'
+    if typecode == 'd' and value != '':
+        try:
+            float(value)
+        except ValueError:
+            return None
+    return typecode
+
+
+def convert(csv_path, out_path=None):
+    """Write csv_path as a .cols table (replacing an existing one); returns (out_path, rows)."""
+    out_path = out_path or columns_path(csv_path)
+    # two streaming passes: the types need every cell, then the rows are written in batches
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        types = ['q'] * len(header)
+        for row in reader:
+            if not row:
+                continue
+            # a short (torn) row is padded with empty cells in pass 2, so count them here too
+            row += [''] * (len(header) - len(row))
+            for i, value in enumerate(row[:len(header)]):
+                if types[i] is not None:
+                    types[i] = _narrow(types[i], value)
+    keep = [i for i, t in enumerate(types) if t is not None]
+    for i, t in enumerate(types):
+        if t is None:
+            print(f"  {csv_path}: skipping non-numeric column {header[i]}")
+
+    if os.path.exists(out_path):
+        shutil.rmtree(out_path)
+    table = ColumnFiles(out_path, [header[i] for i in keep], [types[i] for i in keep])
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        batch = []
+        for row in reader:
+            if not row:
+                continue
+            row += [''] * (len(header) - len(row))
+            batch.append([row[i] for i in keep])
+            if len(batch) >= BATCH_ROWS:
+                table.append(batch)
+                batch = []
+        if batch:
+            table.append(batch)
+    table.close()
+    return out_path, table.rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        paths = sys.argv[1:]
+    else:
+        paths = [os.path.join(RESULTS_DIR, s, name) for s in TEST_SCENARIOS for name in METRICS_FILES]
+        paths = [p for p in paths if os.path.exists(p)]
+    for path in paths:
+        out_path, rows = convert(path)
+        print(f"{path} -> {out_path} ({rows} rows)")
@@ -1,19 +1,324 @@
+import collections
+import itertools
+import multiprocessing
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # optional: only needed for NumpyGridGame
+    np = None
+
+# claim_cell() results
+ACTION_APPLIED = 0
+ACTION_OCCUPIED = 1
+ACTION_INVALID = 2
+
+
 class GridGame:
-    def __init__(self, rows=20, cols=20):
+    """Authoritative board plus a bounded log of the actions applied to it.
+
+    The log is a fixed-capacity ring of (row, col, player_id) triples in a
+    typed array. Every action gets a monotonic sequence number (action_seq
+    counts them), so "actions since seq N" is a slice of the ring as long as
+    N is still retained. Whenever the ring is about to overwrite actions that
+    are not yet covered, the grid is checkpointed; the checkpoint plus the
+    actions after it always reproduce the board, so older history can go.
+    Owner ids are uint16 throughout (log, checkpoint, owner_cells()).
+    """
+
+    __slots__ = ('rows', 'cols', 'grid', 'capacity', '_log', '_seq', '_base',
+                 '_checkpoint', '_checkpoint_seq')
+
+    def __init__(self, rows=20, cols=20, capacity=4096):
         self.rows = rows
         self.cols = cols
         self.grid = [[0 for _ in range(cols)] for _ in range(rows)]
-        self.actions = []
+        self.capacity = capacity
+        self._log = array('H', bytes(2 * 3 * capacity))
+        self._seq = 0
+        # lowest seq actions_since() may be asked for (moved by clear_actions)
+        self._base = 0
+        self._checkpoint = array('H', bytes(2 * rows * cols))
+        self._checkpoint_seq = 0
 
     def apply_action(self, player_id, row, col):
         if 0 <= row < self.rows and 0 <= col < self.cols:
+            seq = self._seq
+            if seq - self._checkpoint_seq >= self.capacity:
+                self.checkpoint()
             self.grid[row][col] = player_id
-            self.actions.append((row, col, player_id))
+            i = (seq % self.capacity) * 3
+            log = self._log
+            log[i] = row
+            log[i + 1] = col
+            log[i + 2] = player_id
+            self._seq = seq + 1
             return True
         return False
 
+    def claim_cell(self, player_id, row, col):
+        """Apply an action only if the cell is still free (first writer wins)."""
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return ACTION_INVALID
+        if self.grid[row][col] != 0:
+            return ACTION_OCCUPIED
+        self.apply_action(player_id, row, col)
+        return ACTION_APPLIED
+
+    def apply_actions(self, actions):
+        """Claim cells for a batch of (row, col, player_id) in order.
+
+        Returns one ACTION_* result per action; within the batch the first
+        writer to a free cell wins, like separate claim_cell() calls.
+        """
+        return [self.claim_cell(player_id, row, col) for row, col, player_id in actions]
+
+    def player_counts(self):
+        """Number of cells owned by each player id (0 = free)."""
+        return collections.Counter(itertools.chain.from_iterable(self.grid))
+
+    def is_full(self):
+        return all(all(row) for row in self.grid)
+
+    def _append_log(self, triples):
+        """Append actions already applied to the grid, as a flat array('H') of triples."""
+        cap = self.capacity
+        end = self._seq + len(triples) // 3
+        if len(triples) > cap * 3:
+            triples = triples[-cap * 3:]
+        start = end - len(triples) // 3
+        i = (start % cap) * 3
+        first = min(len(triples), cap * 3 - i)
+        self._log[i:i + first] = triples[:first]
+        if first < len(triples):
+            self._log[:len(triples) - first] = triples[first:]
+        self._seq = end
+        if end - self._checkpoint_seq > cap:
+            # the grid already includes the whole batch, so checkpoint at its end
+            self.checkpoint()
+
+    @property
+    def action_seq(self):
+        """Number of actions applied so far; the seq the next action will get."""
+        return self._seq
+
+    @property
+    def oldest_action_seq(self):
+        """Oldest seq still answerable by actions_since()."""
+        return max(self._base, self._seq - self.capacity)
+
+    def actions_since(self, seq):
+        """Actions with sequence number >= seq, oldest first.
+
+        Returns None when seq is older than the retained history; the caller
+        then needs a full snapshot instead.
+        """
+        if seq < self.oldest_action_seq:
+            return None
+        end = self._seq
+        if seq >= end:
+            return []
+        cap = self.capacity
+        start_i = seq % cap
+        end_i = end % cap
+        log = self._log
+        if start_i < end_i:
+            flat = log[start_i * 3:end_i * 3]
+        else:
+            flat = log[start_i * 3:] + log[:end_i * 3]
+        return list(zip(flat[0::3], flat[1::3], flat[2::3]))
+
     def get_recent_actions(self, limit=20):
-        return self.actions[-limit:] if len(self.actions) > limit else list(self.actions)
+        return self.actions_since(max(self.oldest_action_seq, self._seq - limit))
+
+    def checkpoint(self):
+        """Record the current board so the log before this point can be discarded."""
+        self._checkpoint = self.owner_cells()
+        self._checkpoint_seq = self._seq
+
+    @property
+    def actions(self):
+        """Actions that rebuild the current board: the checkpointed cells, then the log after it."""
+        cols = self.cols
+        restored = [(i // cols, i % cols, owner)
+                    for i, owner in enumerate(self._checkpoint) if owner]
+        return restored + self.actions_since(max(self._checkpoint_seq, self.oldest_action_seq))
+
+    def owner_cells(self):
+        """Row-major owner id of every cell, as an array('H')."""
+        cells = array('H')
+        for row in self.grid:
+            cells.fromlist(row)
+        return cells
+
+    def clear_actions(self):
+        """Discard the action history; sequence numbers keep counting."""
+        self.checkpoint()
+        self._base = self._seq
+
+
+class NumpyGridGame(GridGame):
+    """GridGame backed by a 2-D NumPy array, for boards of thousands of cells a side.
+
+    Board-wide work (checkpoints, owner_cells(), player_counts(), batch
+    apply_actions()) is vectorized; single actions behave exactly like
+    GridGame. Requires numpy.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, rows=20, cols=20, capacity=4096, dtype=None):
+        if np is None:
+            raise ImportError("NumpyGridGame requires numpy (pip3 install numpy)")
+        super().__init__(0, 0, capacity)
+        self.rows = rows
+        self.cols = cols
+        self.grid = np.zeros((rows, cols), dtype=dtype or np.uint16)
+        self._checkpoint = array('H', bytes(2 * rows * cols))
+
+    def apply_actions(self, actions):
+        """Vectorized batch claim; `actions` is an (N, 3) array-like of row, col, player_id.
+
+        Returns an int8 array of ACTION_* results in input order.
+        """
+        batch = np.asarray(actions, dtype=np.int64).reshape(-1, 3)
+        rows, cols, players = batch[:, 0], batch[:, 1], batch[:, 2]
+        results = np.full(len(batch), ACTION_OCCUPIED, dtype=np.int8)
+        valid = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        results[~valid] = ACTION_INVALID
+
+        idx = np.flatnonzero(valid)
+        flat = rows[idx] * self.cols + cols[idx]
+        board = self.grid.reshape(-1)
+        free = board[flat] == 0
+        idx, flat = idx[free], flat[free]
+        # first writer wins: np.unique returns the first index of each cell
+        _, first = np.unique(flat, return_index=True)
+        first.sort()
+        winners = idx[first]
+        if len(winners):
+            board[flat[first]] = players[winners]
+            results[winners] = ACTION_APPLIED
+            self._append_log(array('H', batch[winners].astype(np.uint16).tobytes()))
+        return results
+
+    def player_counts(self):
+        counts = np.bincount(self.grid.reshape(-1))
+        return collections.Counter({pid: int(n) for pid, n in enumerate(counts) if n})
+
+    def is_full(self):
+        return bool(self.grid.all())
+
+    @property
+    def actions(self):
+        cells = np.frombuffer(self._checkpoint, dtype=np.uint16)
+        owned = np.flatnonzero(cells)
+        restored = list(zip((owned // self.cols).tolist(), (owned % self.cols).tolist(),
+                            cells[owned].tolist()))
+        return restored + self.actions_since(max(self._checkpoint_seq, self.oldest_action_seq))
+
+    def owner_cells(self):
+        cells = array('H')
+        cells.frombytes(self.grid.astype(np.uint16, copy=False).tobytes())
+        return cells
+
+
+def create_game(rows, cols, capacity=4096, backend="python"):
+    """Build the server's game state for the configured GRID_BACKEND."""
+    if backend == "numpy":
+        return NumpyGridGame(rows, cols, capacity)
+    return GridGame(rows, cols, capacity)
+
+
+class SharedGridGame:
+    """GridGame whose grid and action log live in shared memory.
+
+    Used by the multi-process server: every worker holds the same instance
+    (inherited at process start) and all writes go through one lock, so the
+    "cell occupied" rule is enforced across workers. Cells are first-writer-
+    wins here, which also bounds the action log at rows * cols entries.
+    """
+
+    def __init__(self, rows=20, cols=20):
+        self.rows = rows
+        self.cols = cols
+        self._cells = multiprocessing.RawArray('H', rows * cols)
+        # flat (row, col, player_id) triples
+        self._log = multiprocessing.RawArray('H', rows * cols * 3)
+        self._count = multiprocessing.RawValue('I', 0)
+        self._base = multiprocessing.RawValue('I', 0)
+        self._lock = multiprocessing.Lock()
+
+    @property
+    def grid(self):
+        """Copy of the board as a list of rows."""
+        cols = self.cols
+        with self._lock:
+            flat = self._cells[:]
+        return [flat[r * cols:(r + 1) * cols] for r in range(self.rows)]
+
+    @property
+    def actions(self):
+        with self._lock:
+            return self._read_log(0, self._count.value)
+
+    def _read_log(self, start, end):
+        flat = self._log[start * 3:end * 3]
+        return list(zip(flat[0::3], flat[1::3], flat[2::3]))
+
+    @property
+    def action_seq(self):
+        return self._count.value
+
+    @property
+    def oldest_action_seq(self):
+        return self._base.value
+
+    def actions_since(self, seq):
+        with self._lock:
+            if seq < self._base.value:
+                return None
+            return self._read_log(seq, self._count.value)
+
+    def claim_cell(self, player_id, row, col):
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return ACTION_INVALID
+        idx = row * self.cols + col
+        with self._lock:
+            if self._cells[idx] != 0:
+                return ACTION_OCCUPIED
+            self._cells[idx] = player_id
+            n = self._count.value
+            self._log[n * 3] = row
+            self._log[n * 3 + 1] = col
+            self._log[n * 3 + 2] = player_id
+            self._count.value = n + 1
+        return ACTION_APPLIED
+
+    def apply_action(self, player_id, row, col):
+        return self.claim_cell(player_id, row, col) == ACTION_APPLIED
+
+    def apply_actions(self, actions):
+        return [self.claim_cell(player_id, row, col) for row, col, player_id in actions]
+
+    def player_counts(self):
+        with self._lock:
+            return collections.Counter(self._cells[:])
+
+    def is_full(self):
+        with self._lock:
+            return all(self._cells[:])
+
+    def get_recent_actions(self, limit=20):
+        with self._lock:
+            n = self._count.value
+            return self._read_log(max(self._base.value, n - limit), n)
+
+    def owner_cells(self):
+        with self._lock:
+            return array('H', self._cells[:])
 
     def clear_actions(self):
-        self.actions.clear()
+        # the log is already bounded, so only hide the history from actions_since()
+        with self._lock:
+            self._base.value = self._count.value
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Headless load generator: hundreds to thousands of GSYN clients in one process.
+
+Every simulated client is an asyncio datagram endpoint with its own UDP
+socket, so the server sees one address (one player) per client. It speaks
+the same INIT / HEARTBEAT / ACTION / snapshot protocol as client.Client
+(batched actions, grid snapshots, fragments, compression; actions are not
+retransmitted) and keeps its own copy of the grid. Actions follow a pattern:
+
+    uniform   Poisson arrivals at --rate per client, on random cells
+    hotspot   Poisson arrivals, HOTSPOT_SHARE of them in a small square at
+              the centre of the grid, so clients contend for the same cells
+    burst     --burst actions in one batched packet, at the same average rate
+
+The report covers what the server delivered (snapshot datagrams and bytes
+per second, actions sent vs. seen applied), the snapshot one-way latency
+from the header timestamp (meaningful when the server shares this host's
+clock), the action commit latency (send until a snapshot shows the cell
+as ours), and divergence: after the actions stop an observer client joins,
+and every client's grid is compared with the full snapshot it receives.
+
+The server rejects clients beyond MAX_PLAYERS; --spawn-server starts
+server.py with MAX_PLAYERS raised to fit.
+
+Usage:
+    python3 loadgen.py --spawn-server --clients 500 --rate 2 --pattern hotspot
+    python3 loadgen.py --spawn-server --server-set SNAPSHOT_MODE=delta --pattern burst
+    python3 loadgen.py --host 10.0.0.5 --port 9999 --clients 200 --duration 60
+"""
+import argparse
+import ast
+import asyncio
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+from util import (pack_header, parse_header, extend_seq16, pack_caps, unpack_init_ack, pack_action_batch,
+                  iter_actions_payload, unpack_grid_payload, unpack_fragment, decompress_payload, Reassembly,
+                  HEADER_V2_SIZE, MSG_INIT, MSG_ACTION, MSG_ACK, MSG_HEARTBEAT, MSG_SNAPSHOT, MSG_GRID_SNAPSHOT,
+                  MSG_SNAPSHOT_FRAG, MSG_COMPRESSED, MSG_COMPRESSED_ZDICT, MSG_TYPE_MASK, CAP_GRID_SNAPSHOT, CAP_FRAGMENTS, CAP_COMPRESSION,
+                  CAP_COMPRESSION_ZDICT, CAP_ACTION_BATCH, CAP_SNAPSHOT_ACKS)
+from netstats import Histogram
+from config import (CLIENT_SERVER_HOST, CLIENT_SERVER_PORT, CLIENT_HEARTBEAT_INTERVAL, CLIENT_PROTOCOL_VERSION,
+                    GRID_SIZE)
+
+MAXFOURBYTE = 0xFFFFFFFF
+
+LOADGEN_CAPS = CAP_GRID_SNAPSHOT | CAP_FRAGMENTS | CAP_COMPRESSION | CAP_COMPRESSION_ZDICT | CAP_ACTION_BATCH | CAP_SNAPSHOT_ACKS
+
+PATTERNS = ('uniform', 'hotspot', 'burst')
+HOTSPOT_SIZE = 3  # side of the contended square
+HOTSPOT_SHARE = 0.8  # share of hotspot-pattern actions aimed at it
+COMMIT_TIMEOUT = 5.0  # seconds; an action not seen applied by then counts as unconfirmed
+CONNECT_TIMEOUT = 5.0  # seconds to wait for the INIT ACK and full snapshot
+
+
+class SimClient(asyncio.DatagramProtocol):
+    def __init__(self, stats, grid_size=GRID_SIZE, caps=LOADGEN_CAPS):
+        self.stats = stats
+        self.grid_size = grid_size
+        self.offered_caps = caps
+        self.transport = None
+        self.seq = 1
+        self.version = 1
+        self.caps = 0
+        self.player_id = None
+        self.state = 'disconnected'
+        self.connected = asyncio.get_running_loop().create_future()
+        self.cells = [0] * (grid_size * grid_size)
+        self.last_snapshot_id = 0
+        self.last_seq_received = 0
+        self.reassembly = None
+        self.heartbeat_id = 1
+        # (row, col) -> send time (monotonic) of our actions not yet seen applied
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _send(self, msg_type, snapshot_id=0, payload=b'', version=None):
+        header = pack_header(msg_type, snapshot_id, self.seq, len(payload), self.version if version is None else version)
+        self.seq += 1
+        self.transport.sendto(header + payload)
+
+    def send_init(self):
+        self.state = 'connecting'
+        self._send(MSG_INIT, 0, pack_caps(self.offered_caps), CLIENT_PROTOCOL_VERSION)
+
+    def send_heartbeat(self):
+        self.heartbeat_id += 1
+        self._send(MSG_HEARTBEAT, self.heartbeat_id)
+
+    def send_actions(self, cells):
+        now = time.monotonic()
+        for cell in cells:
+            self.pending.setdefault(cell, now)
+        self._send(MSG_ACTION, 0, pack_action_batch(cells))
+        self.stats.actions_sent += len(cells)
+
+    def datagram_received(self, data, addr):
+        stats = self.stats
+        stats.datagrams += 1
+        stats.bytes += len(data)
+        header = parse_header(data)
+        if header is None:
+            stats.rejected += 1
+            return
+        seq_num = header.seq_num
+        if header.size == HEADER_V2_SIZE and self.last_seq_received:
+            seq_num = extend_seq16(seq_num, self.last_seq_received)
+        if seq_num <= self.last_seq_received:
+            return
+        if self.last_seq_received and seq_num > self.last_seq_received + 1:
+            stats.lost += seq_num - self.last_seq_received - 1
+        self.last_seq_received = seq_num
+        payload = data[header.size:header.size + header.payload_len]
+
+        msg_type = header.msg_type
+        if msg_type == MSG_ACK:
+            if header.snapshot_id == 0:
+                self.caps, self.player_id = unpack_init_ack(payload)
+                self.version = header.version
+        elif msg_type == MSG_SNAPSHOT_FRAG:
+            self._handle_fragment(payload, header)
+        elif msg_type & MSG_TYPE_MASK in (MSG_SNAPSHOT, MSG_GRID_SNAPSHOT):
+            self._handle_snapshot(msg_type, payload, header.snapshot_id, header.timestamp_ms)
+
+    def _handle_fragment(self, payload, header):
+        try:
+            transfer_id, msg_type, index, count, chunk = unpack_fragment(payload)
+        except struct.error:
+            return
+        if self.reassembly is None or self.reassembly.transfer_id != transfer_id:
+            # one transfer at a time: a lost fragment is repaired by the server's full snapshot retry
+            self.reassembly = Reassembly(transfer_id, msg_type, count, header.snapshot_id)
+        if self.reassembly.add(index, chunk):
+            snapshot = self.reassembly.payload()
+            self.reassembly = None
+            self._handle_snapshot(msg_type, snapshot, header.snapshot_id, header.timestamp_ms)
+
+    def _handle_snapshot(self, msg_type, payload, snapshot_id, timestamp_ms):
+        if msg_type & MSG_COMPRESSED:
+            try:
+                payload = decompress_payload(payload, bool(msg_type & MSG_COMPRESSED_ZDICT))
+            except zlib.error:
+                return
+            msg_type &= MSG_TYPE_MASK
+        full = snapshot_id == MAXFOURBYTE
+        if full and self.player_id is None:
+            # INIT ACK lost: the server repeats it with the full snapshots while we are pending
+            return
+        if full:
+            self.state = 'connected'
+            self._send(MSG_ACK, MAXFOURBYTE if self.caps & CAP_SNAPSHOT_ACKS else 0)
+            if not self.connected.done():
+                self.connected.set_result(True)
+        elif self.state != 'connected' or snapshot_id <= self.last_snapshot_id:
+            return
+        else:
+            self.last_snapshot_id = snapshot_id
+
+        stats = self.stats
+        stats.snapshots += 1
+        stats.snapshot_latency.record(time.time() * 1000 - timestamp_ms)
+        size = self.grid_size
+        cells = self.cells
+        if msg_type == MSG_GRID_SNAPSHOT:
+            try:
+                rows, cols, grid = unpack_grid_payload(payload)
+            except Exception:
+                return
+            for r in range(min(rows, size)):
+                cells[r * size:r * size + min(cols, size)] = grid[r * cols:r * cols + min(cols, size)]
+        else:
+            for row, col, player_id in iter_actions_payload(payload):
+                if row < size and col < size:
+                    cells[row * size + col] = player_id
+
+        if not full and self.caps & CAP_SNAPSHOT_ACKS:
+            self._send(MSG_ACK, snapshot_id)
+        if self.pending:
+            self._settle(time.monotonic())
+
+    def _settle(self, now):
+        """Match our pending actions against the grid: applied, taken by someone else, or timed out."""
+        stats = self.stats
+        cells = self.cells
+        size = self.grid_size
+        for cell, sent in list(self.pending.items()):
+            owner = cells[cell[0] * size + cell[1]]
+            if owner == self.player_id:
+                stats.commit_latency.record((now - sent) * 1000)
+                stats.actions_applied += 1
+            elif owner:
+                stats.actions_contended += 1
+            elif now - sent > COMMIT_TIMEOUT:
+                stats.actions_unconfirmed += 1
+            else:
+                continue
+            del self.pending[cell]
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class LoadStats:
+    def __init__(self):
+        self.datagrams = 0
+        self.bytes = 0
+        self.snapshots = 0
+        self.lost = 0
+        self.rejected = 0
+        self.actions_sent = 0
+        self.actions_applied = 0
+        self.actions_contended = 0
+        self.actions_unconfirmed = 0
+        self.snapshot_latency = Histogram()
+        self.commit_latency = Histogram()
+        # how late the event loop wakes up: when this grows, the latencies above are the load generator's own backlog
+        self.loop_lag = Histogram()
+
+
+def _pick_cell(pattern, size):
+    if pattern == 'hotspot' and random.random() < HOTSPOT_SHARE:
+        low = max(0, size // 2 - HOTSPOT_SIZE // 2)
+        high = min(size, low + HOTSPOT_SIZE) - 1
+        return random.randint(low, high), random.randint(low, high)
+    return random.randrange(size), random.randrange(size)
+
+
+async def _heartbeats(client, stop):
+    while not stop.is_set():
+        client.send_heartbeat()
+        await asyncio.sleep(CLIENT_HEARTBEAT_INTERVAL)
+
+
+async def _watch_loop(stats, stop, interval=0.05):
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        stats.loop_lag.record((time.monotonic() - start - interval) * 1000)
+
+
+async def _actions(client, pattern, rate, burst):
+    size = client.grid_size
+    count = burst if pattern == 'burst' else 1
+    while True:
+        # Poisson arrivals; a burst of `count` keeps the same average action rate
+        await asyncio.sleep(random.expovariate(rate / count))
+        client.send_actions([_pick_cell(pattern, size) for _ in range(count)])
+
+
+async def _connect(loop, addr, stats, caps=LOADGEN_CAPS):
+    _, client = await loop.create_datagram_endpoint(lambda: SimClient(stats, caps=caps), remote_addr=addr)
+    client.send_init()
+    try:
+        await asyncio.wait_for(asyncio.shield(client.connected), CONNECT_TIMEOUT)
+    except asyncio.TimeoutError:
+        # rejected (MAX_PLAYERS) or the INIT / full snapshot was lost
+        client.close()
+        return None
+    return client
+
+
+def _percentiles(hist):
+    if not hist.total:
+        return "no samples"
+    return "p50=%.1fms p90=%.1fms p99=%.1fms p99.9=%.1fms max=%.1fms (%d samples)" % (
+        hist.percentile(50), hist.percentile(90), hist.percentile(99), hist.percentile(99.9), hist.max, hist.total)
+
+
+async def run_load(addr, clients=100, rate=1.0, pattern='uniform', burst=10, duration=10.0, ramp=1.0, settle=1.0):
+    """Connect `clients` simulated clients, drive actions for `duration` seconds and print a report."""
+    loop = asyncio.get_running_loop()
+    stats = LoadStats()
+
+    # spread the INITs over `ramp` seconds so the server is not hit by one burst of joins
+    started = time.monotonic()
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.ensure_future(_connect(loop, addr, stats)))
+        await asyncio.sleep(ramp / clients)
+    sims = [c for c in await asyncio.gather(*tasks) if c is not None]
+    print(f"connected {len(sims)}/{clients} clients in {time.monotonic() - started:.1f}s")
+    if not sims:
+        return stats
+
+    stop = asyncio.Event()
+    heartbeats = [asyncio.ensure_future(_heartbeats(c, stop)) for c in sims]
+    heartbeats.append(asyncio.ensure_future(_watch_loop(stats, stop)))
+    actions = [asyncio.ensure_future(_actions(c, pattern, rate, burst)) for c in sims]
+    base = (stats.datagrams, stats.bytes, stats.snapshots)
+    started = time.monotonic()
+    await asyncio.sleep(duration)
+    for task in actions:
+        task.cancel()
+    elapsed = time.monotonic() - started
+    datagrams, nbytes, snapshots = (now - then for now, then in zip((stats.datagrams, stats.bytes, stats.snapshots), base))
+
+    # let the last actions reach every client, then take the authoritative board from a fresh full snapshot
+    await asyncio.sleep(settle)
+    now = time.monotonic() + COMMIT_TIMEOUT
+    for c in sims:
+        c._settle(now)
+    observer = await _connect(loop, addr, LoadStats(), LOADGEN_CAPS)
+    stop.set()
+    await asyncio.gather(*heartbeats)
+
+    print(f"pattern {pattern}, {rate:g} actions/s per client, {elapsed:.1f}s")
+    print(f"  server -> clients: {datagrams / elapsed:,.0f} datagrams/s, {nbytes / elapsed / 1e6:.2f} MB/s, "
+          f"{snapshots / elapsed:,.0f} snapshots/s ({snapshots / elapsed / len(sims):.1f} per client), "
+          f"{stats.lost} datagrams lost")
+    print(f"  actions: {stats.actions_sent} sent ({stats.actions_sent / elapsed:,.0f}/s), {stats.actions_applied} applied, "
+          f"{stats.actions_contended} taken by another client, {stats.actions_unconfirmed} unconfirmed")
+    print(f"  snapshot latency: {_percentiles(stats.snapshot_latency)}")
+    print(f"  commit latency:   {_percentiles(stats.commit_latency)}")
+    print(f"  loadgen loop lag: {_percentiles(stats.loop_lag)}")
+    if observer is None:
+        print("  divergence: observer could not join (raise MAX_PLAYERS by one)")
+    else:
+        diverged = [sum(a != b for a, b in zip(c.cells, observer.cells)) for c in sims]
+        print(f"  divergence: {sum(1 for d in diverged if d)}/{len(sims)} clients differ from the server, "
+              f"{sum(diverged)} cells in total (max {max(diverged)} on one client)")
+        observer.close()
+    for c in sims:
+        c.close()
+    return stats
+
+
+def spawn_server(port, max_players, overrides=()):
+    """Start server.py in a child process on `port` with MAX_PLAYERS raised to `max_players`.
+
+    `overrides` are extra (name, value) config settings, e.g. ('SNAPSHOT_MODE', 'delta').
+    """
+    settings = [('SERVER_PORT', port), ('MAX_PLAYERS', max_players), ('SERVER_RUN_DURATION', float('inf'))]
+    code = "".join(f"config.{name} = {value!r}\n" for name, value in settings + list(overrides))
+    code = "import config\n" + code.replace("inf\n", "float('inf')\n") + "import server; server.main()"
+    return subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=CLIENT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=CLIENT_SERVER_PORT)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1.0, help='actions per second per client')
+    parser.add_argument('--pattern', choices=PATTERNS, default='uniform')
+    parser.add_argument('--burst', type=int, default=10, help='actions per packet with --pattern burst')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load after all clients joined')
+    parser.add_argument('--ramp', type=float, default=1.0, help='seconds over which clients join')
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait after the load before the divergence check')
+    parser.add_argument('--spawn-server', action='store_true', help='start server.py with MAX_PLAYERS = clients + 1')
+    parser.add_argument('--server-set', action='append', default=[], metavar='NAME=VALUE',
+                        help='config override for the spawned server, e.g. SNAPSHOT_MODE=delta (repeatable)')
+    args = parser.parse_args()
+
+    # one socket per client: lift the open file limit as far as the hard limit allows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.clients + 64) if hard != resource.RLIM_INFINITY else args.clients + 64, hard))
+
+    server = None
+    if args.spawn_server:
+        overrides = []
+        for setting in args.server_set:
+            name, _, value = setting.partition('=')
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass  # a bare string such as delta
+            overrides.append((name, value))
+        server = spawn_server(args.port, args.clients + 1, overrides)
+        time.sleep(1.0)
+    try:
+        asyncio.run(run_load((args.host, args.port), args.clients, args.rate, args.pattern, args.burst,
+                             args.duration, args.ramp, args.settle))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
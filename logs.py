@@ -0,0 +1,100 @@
+"""
+Logging helpers for the per-packet hot paths of the server and client.
+
+Messages use %-style arguments so nothing is formatted unless the line is
+actually emitted. EventLog adds, per named event, 1-in-N sampling
+(LOG_SAMPLE), a lines-per-second cap (LOG_RATE_LIMIT) and a count of every
+occurrence, which summarize() reports periodically as one line, so the
+totals stay visible when the individual lines are sampled or disabled.
+"""
+import logging
+import sys
+import time
+
+from config import LOG_SAMPLE, LOG_RATE_LIMIT, LOG_SUMMARY_INTERVAL
+
+
+def get_logger(name, prefix, level, stream=sys.stdout):
+    """Logger writing '[prefix] message' lines to stream at the given level name."""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(f'[{prefix}] %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+class EventLog:
+    def __init__(self, logger, sample=LOG_SAMPLE, rate_limit=LOG_RATE_LIMIT,
+                 summary_interval=LOG_SUMMARY_INTERVAL, clock=time.monotonic):
+        self.logger = logger
+        self.sample = dict(sample)
+        self.rate_limit = rate_limit
+        self.summary_interval = summary_interval
+        self.clock = clock
+
+        # occurrences and suppressed lines since the last summary
+        self.counts = {}
+        self.suppressed = {}
+        # rate limit window per event: event -> [window_start, lines_in_window]
+        self._windows = {}
+        self._last_summary = clock()
+
+    def log(self, event, level, msg, *args):
+        """Count one `event` and log msg % args unless gated, sampled out or rate limited."""
+        counts = self.counts
+        count = counts[event] = counts.get(event, 0) + 1
+        if self.logger.isEnabledFor(level):
+            self._emit(event, count, level, msg, args)
+
+    # debug()/info() repeat the count-and-gate step inline rather than calling
+    # log(), so a disabled hot-path line costs one call and two dict lookups
+    def debug(self, event, msg, *args):
+        counts = self.counts
+        count = counts[event] = counts.get(event, 0) + 1
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._emit(event, count, logging.DEBUG, msg, args)
+
+    def info(self, event, msg, *args):
+        counts = self.counts
+        count = counts[event] = counts.get(event, 0) + 1
+        if self.logger.isEnabledFor(logging.INFO):
+            self._emit(event, count, logging.INFO, msg, args)
+
+    def _emit(self, event, count, level, msg, args):
+        every = self.sample.get(event, 1)
+        if every > 1 and count % every != 1:
+            return
+        if self.rate_limit:
+            now = self.clock()
+            window = self._windows.get(event)
+            if window is None or now - window[0] >= 1.0:
+                window = self._windows[event] = [now, 0]
+            if window[1] >= self.rate_limit:
+                self.suppressed[event] = self.suppressed.get(event, 0) + 1
+                return
+            window[1] += 1
+        self.logger.log(level, msg, *args)
+
+    def summarize(self, force=False):
+        """Log one INFO line with event counts if summary_interval has passed; call from a periodic loop."""
+        if not self.summary_interval and not force:
+            return
+        now = self.clock()
+        elapsed = now - self._last_summary
+        if elapsed < self.summary_interval and not force:
+            return
+        self._last_summary = now
+        counts, self.counts = self.counts, {}
+        suppressed, self.suppressed = self.suppressed, {}
+        if not counts or not self.logger.isEnabledFor(logging.INFO):
+            return
+        parts = []
+        for event in sorted(counts):
+            part = f"{event}={counts[event]}"
+            if suppressed.get(event):
+                part += f" (rate-limited {suppressed[event]})"
+            parts.append(part)
+        self.logger.info("summary over %.1fs: %s", elapsed, ", ".join(parts))
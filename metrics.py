@@ -0,0 +1,245 @@
+"""
+Background CSV metrics writer shared by the server and the client.
+
+write() only puts the row on an in-memory queue; a writer thread keeps the
+file open and appends rows in batches, flushing every METRICS_BATCH_SIZE
+rows or METRICS_FLUSH_INTERVAL seconds, so the receive and broadcast paths
+never touch the disk. When the queue is full (disk slower than the row
+rate) rows are dropped and counted, or with METRICS_BLOCK_WHEN_FULL the
+caller waits for room instead. A batch the file refuses (disk full, I/O
+error) is logged and counted as failed, and the writer keeps draining.
+
+With METRICS_FORMAT = "columns" the same rows go to a binary columnar
+table instead: a <name>.cols directory holding header.json (column names,
+array typecodes, byte order) and one append-only file of fixed-width values
+per column ('q' int64 or 'd' float64; empty CSV cells become NaN, so
+nullable columns must be 'd'). load_columns() memory-maps each column with
+numpy, so a multi-gigabyte soak run loads without parsing any text, and
+convert_metrics.py turns existing CSVs into the same format.
+"""
+import array
+import csv
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+
+from config import METRICS_BATCH_SIZE, METRICS_FLUSH_INTERVAL, METRICS_QUEUE_SIZE, METRICS_BLOCK_WHEN_FULL, METRICS_FSYNC, METRICS_FORMAT
+
+logger = logging.getLogger('gsyn.metrics')
+
+_CLOSE = object()
+
+COLUMNS_FORMAT = "gsyn-columns"
+COLUMNS_VERSION = 1
+COLUMNS_SUFFIX = ".cols"
+COLUMN_TYPES = ('q', 'd')
+
+
+def columns_path(path):
+    """The .cols directory used in place of a .csv path."""
+    base, ext = os.path.splitext(path)
+    return path if ext == COLUMNS_SUFFIX else base + COLUMNS_SUFFIX
+
+
+def _column_file(path, name):
+    return os.path.join(path, name + ".bin")
+
+
+class _CsvFile:
+    def __init__(self, path, header):
+        self.f = open(path, 'a', newline='')
+        if self.f.tell() == 0:
+            csv.writer(self.f).writerow(header)
+            self.f.flush()
+        self.writer = csv.writer(self.f)
+
+    def append(self, rows):
+        self.writer.writerows(rows)
+
+    def flush(self, fsync=False):
+        self.f.flush()
+        if fsync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class ColumnFiles:
+    """Append-only columnar table: header.json plus one typed array file per column."""
+
+    def __init__(self, path, header, types=None):
+        header = list(header)
+        types = list(types) if types is not None else ['d'] * len(header)
+        if len(types) != len(header) or any(t not in COLUMN_TYPES for t in types):
+            raise ValueError(f"{path}: need one of {COLUMN_TYPES} per column")
+        os.makedirs(path, exist_ok=True)
+        header_file = os.path.join(path, "header.json")
+        meta = {'format': COLUMNS_FORMAT, 'version': COLUMNS_VERSION, 'byteorder': sys.byteorder,
+                'columns': [{'name': n, 'type': t} for n, t in zip(header, types)]}
+        if os.path.exists(header_file):
+            with open(header_file) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"{path}: existing table has different columns or byte order")
+        else:
+            with open(header_file, 'w') as f:
+                json.dump(meta, f, indent=1)
+        self.path = path
+        self.types = types
+        self.files = [open(_column_file(path, name), 'ab') for name in header]
+        # a batch torn by a crash leaves some columns longer: cut them back to the complete rows
+        rows = min(f.tell() // array.array(t).itemsize for f, t in zip(self.files, types))
+        for f, t in zip(self.files, types):
+            f.truncate(rows * array.array(t).itemsize)
+            f.seek(0, os.SEEK_END)
+        self.rows = rows
+
+    def append(self, rows):
+        for i, (f, t) in enumerate(zip(self.files, self.types)):
+            if t == 'd':
+                values = array.array('d', (math.nan if row[i] in ('', None) else float(row[i]) for row in rows))
+            else:
+                values = array.array('q', (int(row[i]) for row in rows))
+            values.tofile(f)
+        self.rows += len(rows)
+
+    def flush(self, fsync=False):
+        for f in self.files:
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def read_columns(path):
+    """{name: array.array} of a .cols table, without numpy (for merging and small files)."""
+    with open(os.path.join(path, "header.json")) as f:
+        meta = json.load(f)
+    columns = {}
+    for column in meta['columns']:
+        values = array.array(column['type'])
+        with open(_column_file(path, column['name']), 'rb') as f:
+            values.frombytes(f.read())
+        if meta['byteorder'] != sys.byteorder:
+            values.byteswap()
+        columns[column['name']] = values
+    rows = min((len(v) for v in columns.values()), default=0)
+    return {name: values[:rows] if len(values) > rows else values for name, values in columns.items()}
+
+
+def load_columns(path):
+    """{name: read-only numpy.memmap} of a .cols table; needs numpy."""
+    import numpy as np
+    with open(os.path.join(path, "header.json")) as f:
+        meta = json.load(f)
+    order = '<' if meta['byteorder'] == 'little' else '>'
+    dtypes = {c['name']: np.dtype(order + ('i8' if c['type'] == 'q' else 'f8')) for c in meta['columns']}
+    rows = min((os.path.getsize(_column_file(path, name)) // dtype.itemsize for name, dtype in dtypes.items()),
+               default=0)
+    columns = {}
+    for name, dtype in dtypes.items():
+        if rows:
+            columns[name] = np.memmap(_column_file(path, name), dtype=dtype, mode='r', shape=(rows,))
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+    return columns
+
+
+class MetricsWriter:
+    def __init__(self, path, header, batch_size=METRICS_BATCH_SIZE, flush_interval=METRICS_FLUSH_INTERVAL,
+                 queue_size=METRICS_QUEUE_SIZE, block_when_full=METRICS_BLOCK_WHEN_FULL, fsync=METRICS_FSYNC,
+                 types=None, format=METRICS_FORMAT):
+        # format "columns" writes path's .cols table instead, with `types` per column (default all 'd');
+        # os.devnull stays a plain file so callers can still discard rows that way
+        self.format = "csv" if path == os.devnull else format
+        self.path = columns_path(path) if self.format == "columns" else path
+        self.header = list(header)
+        self.types = types
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_when_full = block_when_full
+        self.fsync = fsync
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        # rows lost because writing their batch raised
+        self.failed = 0
+        self._thread = None
+
+    def start(self):
+        """Open the file or table (writing the header if it is new) and start the writer thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(self._open(),), daemon=True,
+                                        name=f"metrics-{os.path.basename(self.path)}")
+        self._thread.start()
+
+    def write(self, row):
+        """Queue one row; returns False if it was dropped because the queue is full."""
+        try:
+            self.queue.put(row, block=self.block_when_full)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=5.0):
+        """Write out the queued rows and stop the writer thread."""
+        if self._thread is None:
+            return
+        self.queue.put(_CLOSE)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _open(self):
+        if self.format == "columns":
+            return ColumnFiles(self.path, self.header, self.types)
+        return _CsvFile(self.path, self.header)
+
+    def _run(self, f):
+        batch = []
+        last_flush = time.monotonic()
+        closing = False
+        while not closing:
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                row = self.queue.get(timeout=timeout)
+                if row is _CLOSE:
+                    closing = True
+                else:
+                    batch.append(row)
+                    # take whatever else is already waiting without blocking
+                    while len(batch) < self.batch_size:
+                        row = self.queue.get_nowait()
+                        if row is _CLOSE:
+                            closing = True
+                            break
+                        batch.append(row)
+            except queue.Empty:
+                pass
+
+            if closing or len(batch) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval:
+                if batch:
+                    try:
+                        f.append(batch)
+                        f.flush(self.fsync)
+                        self.written += len(batch)
+                    except Exception:
+                        logger.exception("Error writing %d metrics rows to %s", len(batch), self.path)
+                        self.failed += len(batch)
+                    batch = []
+                last_flush = time.monotonic()
+        try:
+            f.close()
+        except Exception:
+            logger.exception("Error closing metrics file %s", self.path)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Userspace UDP impairment proxy: netem without root, tc or tcpdump.
+
+Clients send to the proxy's listen port; it opens one upstream socket per
+client address toward the server (so the server still sees one address
+per player) and forwards both directions through an impairment:
+
+    --loss PCT              independent loss
+    --gilbert P R [BAD GOOD] Gilbert-Elliott bursty loss, netem's gemodel:
+                            P% good->bad and R% bad->good transitions per
+                            packet, losing BAD% (default 100) of packets in
+                            the bad state and GOOD% (default 0) in the good one
+    --delay MS --jitter MS  delay, uniform in delay +- jitter (packets may reorder)
+    --reorder PCT           that share of packets skips the delay
+    --duplicate PCT         that share is delivered twice
+    --rate KBIT [--limit N] bandwidth cap with a queue of N packets (drop tail)
+
+Each direction draws from its own RNG seeded from --seed, so a run makes
+the same loss/delay decision for the Nth packet every time. Every decision
+is logged to --trace (CSV), and --pcap writes the delivered packets as a
+classic raw-IP pcap that pcap_stats.py and Wireshark read, so a scenario
+needs no capture privileges either. Run one proxy per scenario on its own
+ports to run scenarios concurrently (see run_proxy_tests.sh).
+
+Usage:
+    python3 netem_proxy.py --listen 10000 --server 127.0.0.1:9999 --loss 2
+    python3 netem_proxy.py --listen 10000 --server 127.0.0.1:9999 --delay 100 --jitter 10 \\
+        --trace proxy_trace.csv --pcap capture.pcap
+"""
+import argparse
+import asyncio
+import signal
+import socket
+import struct
+import time
+import random
+
+from metrics import MetricsWriter
+from util import parse_header
+
+TRACE_HEADER = ['time_ms', 'direction', 'client', 'bytes', 'msg_type', 'seq_num', 'event', 'delay_ms']
+
+# classic pcap, microsecond timestamps, linktype 101 (raw IPv4)
+PCAP_GLOBAL_HEADER = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101)
+PCAP_RECORD = struct.Struct("<IIII")
+IPV4_HEADER = struct.Struct("!BBHHHBBH4s4s")
+UDP_HEADER = struct.Struct("!HHHH")
+
+
+class GilbertElliott:
+    """Two-state Markov loss: bursts of loss while in the bad state."""
+
+    def __init__(self, p, r, loss_bad=1.0, loss_good=0.0, rng=random):
+        self.p = p
+        self.r = r
+        self.loss_bad = loss_bad
+        self.loss_good = loss_good
+        self.rng = rng
+        self.bad = False
+
+    def lost(self):
+        rng = self.rng
+        if self.bad:
+            if rng.random() < self.r:
+                self.bad = False
+        elif rng.random() < self.p:
+            self.bad = True
+        return rng.random() < (self.loss_bad if self.bad else self.loss_good)
+
+
+class Impairment:
+    """Loss, duplication, delay/jitter/reordering and a rate cap for one direction."""
+
+    def __init__(self, rng, loss=0.0, gilbert=None, delay=0.0, jitter=0.0, reorder=0.0, duplicate=0.0,
+                 rate_bps=0, limit=1000):
+        self.rng = rng
+        self.loss = loss
+        self.gilbert = GilbertElliott(*gilbert, rng=rng) if gilbert else None
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.rate_bps = rate_bps
+        self.limit = limit
+        # rate cap: when the link finishes sending what is queued, and departure times of the queue
+        self.link_free_at = 0.0
+        self.queue = []
+        self.counts = {'forwarded': 0, 'lost': 0, 'duplicated': 0, 'queue_full': 0}
+
+    def schedule(self, now, size):
+        """Delays (seconds) of the copies to deliver, or (None, reason) if the packet is dropped."""
+        rng = self.rng
+        if self.gilbert is not None:
+            if self.gilbert.lost():
+                self.counts['lost'] += 1
+                return None, 'lost'
+        elif self.loss and rng.random() < self.loss:
+            self.counts['lost'] += 1
+            return None, 'lost'
+        copies = 1
+        if self.duplicate and rng.random() < self.duplicate:
+            copies = 2
+            self.counts['duplicated'] += 1
+
+        delays = []
+        for _ in range(copies):
+            delay = self.delay
+            if self.jitter:
+                delay += rng.uniform(-self.jitter, self.jitter)
+            if self.reorder and rng.random() < self.reorder:
+                delay = 0.0
+            delay = max(0.0, delay)
+            if self.rate_bps:
+                queue = self.queue
+                while queue and queue[0] <= now:
+                    queue.pop(0)
+                if len(queue) >= self.limit:
+                    self.counts['queue_full'] += 1
+                    continue
+                # serialize after what is already queued, then add the propagation delay
+                start = max(now, self.link_free_at)
+                self.link_free_at = start + size * 8 / self.rate_bps
+                queue.append(self.link_free_at)
+                delay += self.link_free_at - now
+            delays.append(delay)
+        if not delays:
+            return None, 'queue_full'
+        self.counts['forwarded'] += 1
+        return delays, 'duplicated' if len(delays) > 1 else 'forwarded'
+
+
+class PcapWriter:
+    """Delivered datagrams as raw IPv4/UDP records in a classic pcap file."""
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(PCAP_GLOBAL_HEADER)
+        self.ip_id = 0
+
+    def write(self, data, src, dst):
+        self.ip_id = (self.ip_id + 1) & 0xFFFF
+        total = IPV4_HEADER.size + UDP_HEADER.size + len(data)
+        ip = bytearray(IPV4_HEADER.pack(0x45, 0, total, self.ip_id, 0, 64, socket.IPPROTO_UDP, 0,
+                                        socket.inet_aton(src[0]), socket.inet_aton(dst[0])))
+        checksum = sum(struct.unpack("!10H", ip))
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        struct.pack_into("!H", ip, 10, ~checksum & 0xFFFF)
+        # a zero UDP checksum means "not computed" in IPv4
+        packet = bytes(ip) + UDP_HEADER.pack(src[1], dst[1], UDP_HEADER.size + len(data), 0) + data
+        now = time.time()
+        self.f.write(PCAP_RECORD.pack(int(now), int(now % 1 * 1e6), len(packet), len(packet)) + packet)
+
+    def close(self):
+        self.f.close()
+
+
+class _Upstream(asyncio.DatagramProtocol):
+    """The proxy's socket toward the server for one client."""
+
+    def __init__(self, proxy, client_addr):
+        self.proxy = proxy
+        self.client_addr = client_addr
+        self.transport = None
+        self.backlog = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        for data in self.backlog:
+            transport.sendto(data)
+        self.backlog = None
+
+    def send(self, data):
+        if self.transport is None:
+            self.backlog.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        self.proxy.forward('down', data, self.client_addr)
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    def __init__(self, server_addr, up, down, trace=None, pcap=None):
+        self.server_addr = server_addr
+        self.impairments = {'up': up, 'down': down}
+        self.trace = trace
+        self.pcap = pcap
+        self.transport = None
+        self.listen_addr = None
+        # client address -> its _Upstream
+        self.upstreams = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.listen_addr = transport.get_extra_info('sockname')
+
+    def datagram_received(self, data, addr):
+        upstream = self.upstreams.get(addr)
+        if upstream is None:
+            upstream = self.upstreams[addr] = _Upstream(self, addr)
+            loop = asyncio.get_running_loop()
+            loop.create_task(loop.create_datagram_endpoint(lambda: upstream, remote_addr=self.server_addr))
+        self.forward('up', data, addr)
+
+    def forward(self, direction, data, client_addr):
+        loop = asyncio.get_running_loop()
+        delays, event = self.impairments[direction].schedule(loop.time(), len(data))
+        if self.trace is not None:
+            header = parse_header(data)
+            self.trace.write([int(time.time() * 1000), direction, f"{client_addr[0]}:{client_addr[1]}", len(data),
+                              header.msg_type if header else '', header.seq_num if header else '', event,
+                              ';'.join(f"{d * 1000:.1f}" for d in delays) if delays else ''])
+        for delay in delays or ():
+            if delay > 0:
+                loop.call_later(delay, self._deliver, direction, data, client_addr)
+            else:
+                self._deliver(direction, data, client_addr)
+
+    def _deliver(self, direction, data, client_addr):
+        if direction == 'up':
+            self.upstreams[client_addr].send(data)
+            if self.pcap is not None:
+                self.pcap.write(data, client_addr, self.server_addr)
+        else:
+            self.transport.sendto(data, client_addr)
+            if self.pcap is not None:
+                self.pcap.write(data, self.server_addr, client_addr)
+
+
+def _host_port(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def build_impairment(args, seed):
+    gilbert = None
+    if args.gilbert:
+        p, r, *rest = [v / 100 for v in args.gilbert]
+        gilbert = (p, r, *rest)
+    return Impairment(random.Random(seed), loss=args.loss / 100, gilbert=gilbert, delay=args.delay / 1000,
+                      jitter=args.jitter / 1000, reorder=args.reorder / 100, duplicate=args.duplicate / 100,
+                      rate_bps=args.rate * 1000, limit=args.limit)
+
+
+async def run_proxy(args):
+    loop = asyncio.get_running_loop()
+    clean = Impairment(random.Random(0))
+    up = build_impairment(args, 2 * args.seed) if args.direction in ('both', 'up') else clean
+    down = build_impairment(args, 2 * args.seed + 1) if args.direction in ('both', 'down') else clean
+    trace = None
+    if args.trace:
+        trace = MetricsWriter(args.trace, TRACE_HEADER, format='csv')
+        trace.start()
+    pcap = PcapWriter(args.pcap) if args.pcap else None
+    transport, proxy = await loop.create_datagram_endpoint(
+        lambda: ImpairmentProxy(_host_port(args.server), up, down, trace, pcap), local_addr=(args.host, args.listen))
+    print(f"proxy {args.host}:{args.listen} -> {args.server}", flush=True)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await asyncio.wait_for(stop.wait(), args.duration)
+    except asyncio.TimeoutError:
+        pass
+    transport.close()
+    for upstream in proxy.upstreams.values():
+        if upstream.transport is not None:
+            upstream.transport.close()
+    if trace is not None:
+        trace.close()
+    if pcap is not None:
+        pcap.close()
+    for direction, impairment in (('client -> server', up), ('server -> client', down)):
+        print(f"{direction}: " + ", ".join(f"{k} {v}" for k, v in impairment.counts.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--listen', type=int, required=True, help='port clients send to')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--server', default='127.0.0.1:9999', help='server address (host:port)')
+    parser.add_argument('--direction', choices=('both', 'up', 'down'), default='both',
+                        help='impair both directions (like netem on lo), only client->server, or only server->client')
+    parser.add_argument('--loss', type=float, default=0.0, metavar='PCT')
+    parser.add_argument('--gilbert', type=float, nargs='+', metavar='PCT', help='P R [BAD GOOD], all percentages')
+    parser.add_argument('--delay', type=float, default=0.0, metavar='MS')
+    parser.add_argument('--jitter', type=float, default=0.0, metavar='MS')
+    parser.add_argument('--reorder', type=float, default=0.0, metavar='PCT')
+    parser.add_argument('--duplicate', type=float, default=0.0, metavar='PCT')
+    parser.add_argument('--rate', type=float, default=0, metavar='KBIT', help='bandwidth cap per direction (0 = none)')
+    parser.add_argument('--limit', type=int, default=1000, help='packets queued behind the rate cap before drops')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace', metavar='CSV', help='log every packet and what happened to it')
+    parser.add_argument('--pcap', metavar='PATH', help='write delivered packets to a pcap file')
+    parser.add_argument('--duration', type=float, default=None, help='seconds to run (default: until SIGINT/SIGTERM)')
+    args = parser.parse_args()
+    if args.gilbert and len(args.gilbert) not in (2, 3, 4):
+        parser.error('--gilbert takes P R [BAD [GOOD]]')
+    asyncio.run(run_proxy(args))
+
+
+if __name__ == "__main__":
+    main()
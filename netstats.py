@@ -0,0 +1,214 @@
+"""Round-trip, latency and clock bookkeeping for the client."""
+import array
+import collections
+
+
+class InFlightTable:
+    """Send times of packets awaiting a reply, for RTT samples and loss counts.
+
+    Entries live in fixed arrays indexed by id modulo the table size, so the
+    table never grows however many replies are lost; entries that go
+    unanswered for `timeout` (or whose slot is reused) are counted as lost.
+    """
+
+    def __init__(self, size=64, timeout=3.0):
+        self.size = size
+        self.timeout = timeout
+        # id 0 marks a free slot, so ids must start at 1
+        self.ids = array.array('Q', bytes(8 * size))
+        self.sent = array.array('d', bytes(8 * size))
+        self.sent_count = 0
+        self.replied = 0
+        self.lost = 0
+
+    def add(self, packet_id, now):
+        """Record a packet sent at `now`; an unanswered entry in its slot counts as lost."""
+        slot = packet_id % self.size
+        if self.ids[slot]:
+            self.lost += 1
+        self.ids[slot] = packet_id
+        self.sent[slot] = now
+        self.sent_count += 1
+
+    def pop(self, packet_id):
+        """Send time of a packet whose reply arrived, or None if it is unknown, expired or already answered."""
+        slot = packet_id % self.size
+        if self.ids[slot] != packet_id:
+            return None
+        self.ids[slot] = 0
+        self.replied += 1
+        return self.sent[slot]
+
+    def expire(self, now):
+        """Count entries waiting longer than `timeout` as lost and free their slots; returns how many."""
+        ids, sent = self.ids, self.sent
+        expired = 0
+        for slot in range(self.size):
+            if ids[slot] and now - sent[slot] > self.timeout:
+                ids[slot] = 0
+                expired += 1
+        self.lost += expired
+        return expired
+
+    def __len__(self):
+        return self.size - self.ids.count(0)
+
+    def loss_percentage(self):
+        """Share of answered-or-lost packets that were lost."""
+        settled = self.replied + self.lost
+        return self.lost / settled * 100.0 if settled else 0.0
+
+
+class RttEstimator:
+    """RFC 6298 smoothed RTT and RTT variance (gains 1/8 and 1/4) plus a windowed minimum RTT."""
+
+    def __init__(self, min_window=10.0, alpha=0.125, beta=0.25, k=4):
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.min_window = min_window
+        self.srtt = None
+        self.rttvar = None
+        self.latest = None
+        self.samples = 0
+        # smallest sample in the last ~min_window seconds
+        self.min_rtt = None
+        self._min_time = 0.0
+
+    def update(self, rtt, now):
+        """Add one RTT sample taken at `now` (only from packets that were not retransmitted)."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        if self.min_rtt is None or rtt <= self.min_rtt or now - self._min_time > self.min_window:
+            self.min_rtt = rtt
+            self._min_time = now
+        self.latest = rtt
+        self.samples += 1
+
+    def rto(self, granularity=0.0):
+        """SRTT + max(G, K * RTTVAR); None before the first sample."""
+        if self.srtt is None:
+            return None
+        return self.srtt + max(granularity, self.k * self.rttvar)
+
+
+class Histogram:
+    """Log-linear (HDR-style) histogram for the latency, jitter and RTT summaries.
+
+    Values are counted in buckets whose width grows with the value, so any
+    percentile is accurate to within 1/sub_buckets of the value (about 3%
+    by default) in a few hundred counters, however many samples it sees.
+    """
+
+    def __init__(self, max_value=60000.0, resolution=0.001, sub_bits=5):
+        # values are counted as integer units of `resolution` (default 1 us for ms values)
+        self.resolution = resolution
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.max_units = int(max_value / resolution)
+        self.counts = array.array('Q', bytes(8 * (self._index(self.max_units) + 1)))
+        self.reset()
+
+    def reset(self):
+        """Forget every sample (start a new window)."""
+        counts = self.counts
+        for i in range(len(counts)):
+            counts[i] = 0
+        self.total = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, units):
+        # the first 2*half values get one bucket each; above that each power of
+        # two is split into `half` buckets
+        shift = units.bit_length() - self.sub_bits
+        if shift <= 0:
+            return units
+        return (shift + 1) * self.half + (units >> shift) - self.half
+
+    def _value(self, index):
+        """Midpoint of a bucket, in value units."""
+        if index < 2 * self.half:
+            return index * self.resolution
+        shift = index // self.half - 1
+        low = (index % self.half + self.half) << shift
+        return (low + ((1 << shift) - 1) / 2) * self.resolution
+
+    def record(self, value):
+        """Count one sample; negative values count as 0, values past max_value as max_value."""
+        units = min(max(0, int(value / self.resolution)), self.max_units)
+        self.counts[self._index(units)] += 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Value at or below which q percent of the samples fall; None if empty."""
+        if not self.total:
+            return None
+        rank = max(1, -(-self.total * q // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else None
+
+
+class ClockSync:
+    """Estimate of the server's clock, used to turn server timestamps into one-way latency.
+
+    Takes NTP-style four-timestamp exchanges: the offset of each is
+    ((t2 - t1) + (t3 - t4)) / 2, and like NTP's clock filter it trusts the
+    lowest-delay exchange of the last few, since queueing on either path
+    skews the offset by up to half the extra delay. Drift is the
+    least-squares slope of those filtered offsets over time.
+    """
+
+    def __init__(self, filter_size=8, drift_window=64, min_drift_span=30.0):
+        self.min_drift_span = min_drift_span
+        # recent exchanges: (delay, offset, local time)
+        self.samples = collections.deque(maxlen=filter_size)
+        # filtered offsets over time, for the drift: (local time, offset)
+        self.history = collections.deque(maxlen=drift_window)
+        self.offset = None
+        self.delay = None
+        self.drift = 0.0
+        self._ref = 0.0
+
+    def update(self, t1, t2, t3, t4):
+        """Add one exchange: client send t1, server receive t2, server send t3, client receive t4 (seconds)."""
+        delay = max(0.0, (t4 - t1) - (t3 - t2))
+        self.samples.append((delay, ((t2 - t1) + (t3 - t4)) / 2, t4))
+        self.delay, self.offset, self._ref = min(self.samples)
+        if not self.history or self.history[-1][0] != self._ref:
+            self.history.append((self._ref, self.offset))
+            self._update_drift()
+
+    def _update_drift(self):
+        history = self.history
+        if history[-1][0] - history[0][0] < self.min_drift_span:
+            return
+        n = len(history)
+        mean_t = sum(t for t, _ in history) / n
+        mean_o = sum(o for _, o in history) / n
+        var = sum((t - mean_t) ** 2 for t, _ in history)
+        if var > 0:
+            self.drift = sum((t - mean_t) * (o - mean_o) for t, o in history) / var
+
+    def offset_at(self, local_time):
+        """Server clock minus local clock at `local_time` (seconds); 0 before the first exchange."""
+        if self.offset is None:
+            return 0.0
+        return self.offset + self.drift * (local_time - self._ref)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Bytes-on-wire per second from the tcpdump captures in results/.
+
+For every scenario capture this reports packets and bytes per second by
+GSYN message type, with the 28-byte v1 and the compact v2 header (10 bytes
+less on every packet but INIT): packets captured in one layout are counted
+as they are for that column and converted for the other, so v1, v2 and
+mixed captures all compare the same way. Reads classic pcap files
+directly, so it needs neither tcpdump nor scapy.
+
+Usage:
+    python3 pcap_stats.py                  # all scenarios in results/
+    python3 pcap_stats.py path/to/capture.pcap ...
+"""
+import os
+import struct
+import sys
+
+from util import (HEADER_SIZE, HEADER_V2_SIZE, MSG_TYPE_MASK, MSG_INIT, MSG_ACTION, MSG_SNAPSHOT, MSG_ACK, MSG_HEARTBEAT,
+                  MSG_GRID_SNAPSHOT, MSG_SNAPSHOT_FRAG, MSG_FRAG_NACK)
+
+RESULTS_DIR = "results"
+TEST_SCENARIOS = ["baseline", "loss_2", "loss_5", "delay_100ms"]
+
+MSG_NAMES = {
+    MSG_INIT: "INIT", MSG_ACTION: "ACTION", MSG_SNAPSHOT: "SNAPSHOT",
+    MSG_ACK: "ACK", MSG_HEARTBEAT: "HEARTBEAT", MSG_GRID_SNAPSHOT: "GRID_SNAPSHOT",
+    MSG_SNAPSHOT_FRAG: "SNAPSHOT_FRAG", MSG_FRAG_NACK: "FRAG_NACK",
+}
+
+# link-layer header length by pcap linktype
+LINK_HEADER_LEN = {
+    0: 4,     # BSD loopback
+    1: 14,    # Ethernet
+    101: 0,   # raw IP
+    113: 16,  # Linux cooked capture
+    276: 20,  # Linux cooked capture v2
+}
+
+
+def read_pcap(path):
+    """Yield (timestamp_s, wire_len, udp_payload) for every UDP/IPv4 packet in a classic pcap."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic = data[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        endian = ">"
+    else:
+        raise ValueError(f"{path}: not a classic pcap file (pcapng is not supported)")
+    nanos = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+    linktype = struct.unpack_from(endian + "I", data, 20)[0]
+    if linktype not in LINK_HEADER_LEN:
+        raise ValueError(f"{path}: unsupported linktype {linktype}")
+    link_len = LINK_HEADER_LEN[linktype]
+    record = struct.Struct(endian + "IIII")
+
+    offset = 24
+    while offset + record.size <= len(data):
+        ts_sec, ts_frac, incl_len, orig_len = record.unpack_from(data, offset)
+        offset += record.size
+        frame = data[offset:offset + incl_len]
+        offset += incl_len
+        ip = frame[link_len:]
+        if len(ip) < 20 or ip[0] >> 4 != 4 or ip[9] != 17:
+            continue
+        ihl = (ip[0] & 0x0F) * 4
+        udp_payload = ip[ihl + 8:]
+        yield ts_sec + ts_frac / (1e9 if nanos else 1e6), orig_len, udp_payload
+
+
+def capture_stats(path):
+    """Per message type packet and byte counts for one capture, plus its duration."""
+    by_type = {}
+    first = last = None
+    for ts, wire_len, payload in read_pcap(path):
+        if payload[:4] == b"GSYN":
+            msg_type, header_size = payload[5], HEADER_SIZE
+        elif payload[:2] == b"GS" and len(payload) > 3 and payload[2] == 2:
+            msg_type, header_size = payload[3], HEADER_V2_SIZE
+        else:
+            continue
+        # compression flags do not make a different type
+        msg_type &= MSG_TYPE_MASK
+        first = ts if first is None else first
+        last = ts
+        stats = by_type.setdefault(msg_type, {'packets': 0, 'v1_bytes': 0, 'v2_bytes': 0})
+        stats['packets'] += 1
+        # INIT keeps the v1 layout in v2 so any server can read it
+        saved = 0 if msg_type == MSG_INIT else HEADER_SIZE - HEADER_V2_SIZE
+        if header_size == HEADER_SIZE:
+            stats['v1_bytes'] += wire_len
+            stats['v2_bytes'] += wire_len - saved
+        else:
+            stats['v1_bytes'] += wire_len + saved
+            stats['v2_bytes'] += wire_len
+    duration = (last - first) if first is not None else 0.0
+    return by_type, duration
+
+
+def print_report(name, path):
+    by_type, duration = capture_stats(path)
+    if not by_type or duration <= 0:
+        print(f"{name}: no GSYN traffic in {path}")
+        return None
+    print(f"{name} ({path}, {duration:.1f}s)")
+    print(f"  {'type':<14} {'pkts/s':>8} {'B/s (v1)':>10} {'B/s (v2)':>10} {'saved':>7}")
+    total = total_v2 = 0
+    for msg_type in sorted(by_type):
+        stats = by_type[msg_type]
+        total += stats['v1_bytes']
+        total_v2 += stats['v2_bytes']
+        print(f"  {MSG_NAMES.get(msg_type, msg_type):<14} {stats['packets'] / duration:>8.1f}"
+              f" {stats['v1_bytes'] / duration:>10.0f} {stats['v2_bytes'] / duration:>10.0f}"
+              f" {1 - stats['v2_bytes'] / stats['v1_bytes']:>6.1%}")
+    print(f"  {'total':<14} {sum(s['packets'] for s in by_type.values()) / duration:>8.1f}"
+          f" {total / duration:>10.0f} {total_v2 / duration:>10.0f} {1 - total_v2 / total:>6.1%}")
+    return total / duration, total_v2 / duration
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        targets = [(os.path.basename(p), p) for p in sys.argv[1:]]
+    else:
+        targets = [(s, os.path.join(RESULTS_DIR, s, "capture.pcap")) for s in TEST_SCENARIOS]
+    for name, path in targets:
+        if not os.path.exists(path):
+            print(f"{name}: missing {path}")
+            continue
+        print_report(name, path)
+        print()
@@ -181,6 +181,11 @@ run_scenario() {
         print_warning "client_metrics.csv not found"
     fi
     
+    if [ -f "client_summary.csv" ]; then
+        mv "client_summary.csv" "$results_dir/client_summary.csv"
+        print_success "Moved client_summary.csv to $results_dir/"
+    fi
+    
     if [ -f "server_metrics.csv" ]; then
         mv "server_metrics.csv" "$results_dir/server_metrics.csv"
         print_success "Moved server_metrics.csv to $results_dir/"
@@ -188,6 +193,15 @@ run_scenario() {
         print_warning "server_metrics.csv not found"
     fi
     
+    # binary columnar tables (METRICS_FORMAT = "columns")
+    for table in client_metrics.cols client_summary.cols server_metrics.cols; do
+        if [ -d "$table" ]; then
+            rm -rf "$results_dir/$table"
+            mv "$table" "$results_dir/$table"
+            print_success "Moved $table to $results_dir/"
+        fi
+    done
+    
     # Print CSV line counts
     if [ -f "$results_dir/client_metrics.csv" ]; then
         local client_lines=$(wc -l < "$results_dir/client_metrics.csv" | tr -d ' ')
@@ -0,0 +1,124 @@
+#!/bin/bash
+
+# GridSync Phase 3 - Test Suite without root
+# Runs the same four scenarios as run_complete_tests.sh, but impairs traffic
+# with netem_proxy.py instead of tc netem and captures with the proxy instead
+# of tcpdump. Each scenario gets its own ports and results folder, so all
+# four run at the same time.
+
+set -e  # Exit on error
+
+# Colors for output
+RED='\033[0;31m'
+GREEN='\033[0;32m'
+YELLOW='\033[1;33m'
+BLUE='\033[0;34m'
+NC='\033[0m' # No Color
+
+# Configuration
+TEST_DURATION=${TEST_DURATION:-60}
+BASE_PORT=10000   # scenario N: server on BASE_PORT + 2N, proxy on BASE_PORT + 2N + 1
+SEED=1
+ROOT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+print_status() {
+    echo -e "${BLUE}[INFO]${NC} $1"
+}
+
+print_success() {
+    echo -e "${GREEN}[SUCCESS]${NC} $1"
+}
+
+print_error() {
+    echo -e "${RED}[ERROR]${NC} $1"
+}
+
+print_warning() {
+    echo -e "${YELLOW}[WARNING]${NC} $1"
+}
+
+# Run one scenario: server <- proxy (impairment, capture) <- client, all in results/<name>
+run_scenario() {
+    local scenario_name=$1
+    local server_port=$2
+    local proxy_args=$3
+    local proxy_port=$((server_port + 1))
+    local results_dir="$ROOT_DIR/results/$scenario_name"
+
+    mkdir -p "$results_dir"
+    rm -f "$results_dir"/*.csv "$results_dir/capture.pcap"
+    rm -rf "$results_dir"/*.cols
+    cd "$results_dir"
+
+    python3 "$ROOT_DIR/server.py" --port "$server_port" > server.log 2>&1 &
+    local server_pid=$!
+    python3 "$ROOT_DIR/netem_proxy.py" --listen "$proxy_port" --server "127.0.0.1:$server_port" \
+        --seed "$SEED" $proxy_args --trace proxy_trace.csv --pcap capture.pcap > proxy.log 2>&1 &
+    local proxy_pid=$!
+    sleep 2  # Give server and proxy time to start
+
+    # the client exits on its own after TEST_DURATION and flushes its CSVs
+    python3 "$ROOT_DIR/client.py" --port "$proxy_port" --duration "$TEST_DURATION" > client.log 2>&1 || true
+    sleep 1
+
+    # SIGTERM: the server stops like at the end of its run and flushes server_metrics.csv
+    kill "$server_pid" 2>/dev/null || true
+    kill "$proxy_pid" 2>/dev/null || true
+    wait "$server_pid" "$proxy_pid" 2>/dev/null || true
+}
+
+main() {
+    echo ""
+    print_status "========================================="
+    print_status "GridSync Phase 3 - Test Suite (userspace netem)"
+    print_status "========================================="
+    echo ""
+
+    if ! python3 -c "import psutil" &> /dev/null; then
+        print_error "psutil Python module not found"
+        print_error "Install with: pip3 install psutil"
+        exit 1
+    fi
+
+    print_status "Running 4 scenarios concurrently for ${TEST_DURATION} seconds..."
+    run_scenario "baseline" $BASE_PORT "" &
+    local pids=($!)
+    run_scenario "loss_2" $((BASE_PORT + 2)) "--loss 2" &
+    pids+=($!)
+    run_scenario "loss_5" $((BASE_PORT + 4)) "--loss 5" &
+    pids+=($!)
+    run_scenario "delay_100ms" $((BASE_PORT + 6)) "--delay 100" &
+    pids+=($!)
+
+    local failed=0
+    for pid in "${pids[@]}"; do
+        wait "$pid" || failed=1
+    done
+    if [ $failed -eq 1 ]; then
+        print_warning "A scenario exited with an error; check the logs in results/"
+    fi
+
+    for scenario in baseline loss_2 loss_5 delay_100ms; do
+        local results_dir="$ROOT_DIR/results/$scenario"
+        if [ -f "$results_dir/client_metrics.csv" ]; then
+            print_success "$scenario: client_metrics.csv has $(wc -l < "$results_dir/client_metrics.csv" | tr -d ' ') lines"
+        else
+            print_warning "$scenario: client_metrics.csv not found"
+        fi
+        tail -n 2 "$results_dir/proxy.log" | sed "s/^/  /"
+    done
+
+    cd "$ROOT_DIR"
+    if [ -f "analyze_results.py" ]; then
+        print_status "Running analysis..."
+        python3 analyze_results.py
+        print_success "Analysis complete"
+    fi
+
+    echo ""
+    print_success "All tests completed"
+    print_status "Run ./validate_results.sh to verify all files are present"
+    echo ""
+}
+
+main
@@ -0,0 +1,82 @@
+"""
+Fixed-timestep tick scheduler for the server snapshot broadcast.
+
+Deadlines are absolute on the monotonic clock (deadline N = start + N *
+interval), so the time spent doing a tick does not push later ticks back
+the way sleep(interval)-then-work does. If a tick runs so late that whole
+periods have already passed, those deadlines are skipped and counted
+instead of being run back to back.
+
+In degrade mode the interval is stretched (up to max_interval) while the
+smoothed work time exceeds `budget` of the interval, and eased back once
+the load drops, so an overloaded server sends fewer snapshots instead of
+piling up latency.
+"""
+import math
+import time
+
+
+class TickScheduler:
+    def __init__(self, interval, degrade=False, max_interval=None, budget=0.8, clock=time.monotonic):
+        self.base_interval = interval
+        self.interval = interval
+        self.degrade = degrade
+        self.max_interval = max_interval or interval
+        self.budget = budget
+        self.clock = clock
+
+        self.next_deadline = clock() + interval
+        self.ticks = 0
+        self.total_skipped = 0
+        # stats of the most recent tick
+        self.lateness = 0.0
+        self.work = 0.0
+        self.skipped = 0
+        self._avg_work = 0.0
+        self._tick_start = 0.0
+
+    def time_until_next(self):
+        """Seconds until the next deadline (0 if it has passed)."""
+        return max(0.0, self.next_deadline - self.clock())
+
+    def wait(self):
+        """Block until the next deadline (threaded engine)."""
+        delay = self.time_until_next()
+        if delay > 0:
+            time.sleep(delay)
+
+    def begin(self):
+        """Mark the start of a tick; returns how late it started, in seconds."""
+        now = self.clock()
+        self._tick_start = now
+        self.lateness = max(0.0, now - self.next_deadline)
+        return self.lateness
+
+    def elapsed(self):
+        """Seconds spent in the current tick so far."""
+        return self.clock() - self._tick_start
+
+    def end(self):
+        """Mark the end of a tick and move to the next deadline."""
+        now = self.clock()
+        self.work = now - self._tick_start
+        self.ticks += 1
+        # smoothed work time drives degrade mode
+        self._avg_work += (self.work - self._avg_work) / 8
+        if self.degrade:
+            self._adjust_interval()
+
+        next_deadline = self.next_deadline + self.interval
+        self.skipped = 0
+        if next_deadline <= now:
+            # already missed one or more whole periods: skip them
+            self.skipped = math.floor((now - next_deadline) / self.interval) + 1
+            next_deadline += self.skipped * self.interval
+            self.total_skipped += self.skipped
+        self.next_deadline = next_deadline
+
+    def _adjust_interval(self):
+        if self._avg_work > self.budget * self.interval and self.interval < self.max_interval:
+            self.interval = min(self.max_interval, self.interval * 1.25)
+        elif self._avg_work < 0.5 * self.budget * self.interval and self.interval > self.base_interval:
+            self.interval = max(self.base_interval, self.interval / 1.25)
@@ -1,92 +1,237 @@
+import asyncio
+import collections
+import logging
+import signal
 import socket
 import struct
 import time
 import threading
-import csv
-import os
 import psutil
-from util import pack_header, pack_actions_payload, MSG_INIT, MSG_ACTION, MSG_SNAPSHOT, MSG_ACK, MSG_HEARTBEAT, check_auth
-from game import GridGame
-from config import SERVER_HOST, SERVER_PORT, SERVER_RUN_DURATION, SNAPSHOT_BROADCAST_INTERVAL, LAST_K_ACTIONS, GRID_SIZE, SOCKET_TIMEOUT, PACKET_LIFETIME, MAX_PLAYERS
+from util import pack_header, unpack_action_batch, CAP_ACTION_BATCH, CAP_RELIABLE_ACTIONS, CAP_CLOCK_SYNC, CAP_SNAPSHOT_ACKS, CLOCK_STAMP, CLOCK_REPLY, ACTION_ID, ActionAcks, PayloadCompressor, MSG_COMPRESSED, MSG_COMPRESSED_ZDICT, CAP_COMPRESSION, CAP_COMPRESSION_ZDICT, fragment_payload, unpack_frag_nack, MSG_SNAPSHOT_FRAG, MSG_FRAG_NACK, CAP_FRAGMENTS, parse_header, extend_seq16, HEADER_V2_SIZE, pack_actions_payload, pack_grid_payload, pack_init_ack, unpack_caps, SnapshotFrame, MSG_GRID_SNAPSHOT, CAP_GRID_SNAPSHOT, MSG_INIT, MSG_ACTION, MSG_SNAPSHOT, MSG_ACK, MSG_HEARTBEAT
+from scheduler import TickScheduler
+from metrics import MetricsWriter
+from logs import get_logger, EventLog
+from game import create_game, ACTION_APPLIED, ACTION_OCCUPIED
+from config import SERVER_HOST, SERVER_PORT, SERVER_RUN_DURATION, SNAPSHOT_BROADCAST_INTERVAL, LAST_K_ACTIONS, GRID_SIZE, SOCKET_TIMEOUT, PACKET_LIFETIME, MAX_PLAYERS, SERVER_ENGINE, SERVER_WORKERS, SNAPSHOT_MODE, DELTA_MAX_ACTIONS, SNAPSHOT_HISTORY, HEARTBEAT_INTERVAL, FULL_SNAPSHOT_ENCODING, ACTION_LOG_CAPACITY, GRID_BACKEND, TICK_DEGRADE, TICK_MAX_INTERVAL, TICK_BUDGET, SERVER_LOG_LEVEL, SERVER_PROTOCOL_VERSION, FRAGMENT_SIZE, FRAGMENT_CACHE, FRAGMENT_RETRY_INTERVAL, SOCKET_BUFFER_SIZE, COMPRESSION_LEVEL, COMPRESSION_MIN_SIZE, COMPRESSION_USE_ZDICT, ACTION_WINDOW, ACTION_ACK_LINGER
 
 SERVER_ADDR = (SERVER_HOST, SERVER_PORT)
 
+logger = get_logger('gsyn.server', 'SERVER', SERVER_LOG_LEVEL)
+# per-packet events: sampled, rate limited and counted in periodic summaries
+events = EventLog(logger)
+
 MAXFOURBYTE = 0xFFFFFFFF
 
 # Client dictionary: addr -> {player_id, seq_num, last_seen, state}
 clients = {}
 snapshot_id = 0
+last_tick_seq = 0  # game.action_seq covered by the previous tick's snapshot
 running = True
 next_player_id = 1
+packets_received = 0
+# multiprocessing.Value holding the next player id when running sharded
+shared_player_counter = None
 
 # Game logic
-game = GridGame(GRID_SIZE, GRID_SIZE)
+game = create_game(GRID_SIZE, GRID_SIZE, ACTION_LOG_CAPACITY, GRID_BACKEND)
 
-# CSV metrics tracking
+# CSV metrics tracking (rows are written by a background MetricsWriter)
 csv_file = "server_metrics.csv"
-csv_initialized = False
-csv_lock = threading.Lock()
-
-
-def _register_client(addr):
-    """Register a new client address and return the client_data dict and player_id."""
+metrics_writer = None
+SERVER_METRICS_HEADER = [
+    'timestamp_ms', 'snapshot_id', 'active_clients',
+    'total_actions', 'cpu_percent', 'packets_received',
+    'tick_interval_ms', 'tick_work_ms', 'tick_lateness_ms', 'ticks_skipped',
+    'compression_ratio', 'compress_us'
+]
+# column types for METRICS_FORMAT "columns": 'q' int64, 'd' float64 (columns that can be empty must be 'd')
+SERVER_METRICS_TYPES = ['q', 'q', 'q', 'q', 'd', 'q', 'd', 'd', 'd', 'd', 'd', 'd']
+
+# reusable header templates for the per-tick snapshot broadcast, per protocol version
+snapshot_frames = {1: SnapshotFrame(1), 2: SnapshotFrame(2)}
+
+# grid (bool) -> (game, action seq, full snapshot payload, encodings), see _full_snapshot_payload()
+full_payloads = {}
+# delta mode: snapshot_id -> game.action_seq at the time it was built
+snapshot_action_seqs = collections.OrderedDict()
+
+# fragmented snapshots: transfer_id -> (snapshot_id, fragment payloads), kept to answer FRAG_NACKs
+fragment_cache = collections.OrderedDict()
+next_transfer_id = 1
+
+# snapshot payload compression for clients with CAP_COMPRESSION
+compressor = PayloadCompressor(COMPRESSION_LEVEL, COMPRESSION_MIN_SIZE)
+# caps bits that change how a snapshot payload is encoded on the wire
+_ENCODING_CAPS = CAP_COMPRESSION | CAP_COMPRESSION_ZDICT | CAP_FRAGMENTS
+
+
+def _allocate_player_id():
+    """Reserve the next player id, or return None once MAX_PLAYERS is reached.
+
+    When sharded, the counter is shared by all workers so ids stay unique
+    and MAX_PLAYERS applies to the whole server rather than per worker.
+    """
     global next_player_id
+    if shared_player_counter is not None:
+        with shared_player_counter.get_lock():
+            player_id = shared_player_counter.value
+            if player_id > MAX_PLAYERS:
+                return None
+            shared_player_counter.value = player_id + 1
+        return player_id
+    if len(clients) >= MAX_PLAYERS:
+        return None
     player_id = next_player_id
     next_player_id += 1
+    return player_id
+
+
+def _register_client(addr, player_id, caps=0, version=1):
+    """Register a new client address under player_id and return its client_data dict."""
     clients[addr] = {
         'player_id': player_id,
+        # header version negotiated in INIT; every packet to this client uses it
+        'version': version,
+        'caps': caps,  # CAP_* bits both sides support
         'seq_num': 1,
         'last_recv_seq': 0,
         'last_seen': time.time(),
         'last_heartbeat_recv': time.time(),
-        'state': 'pending'  # pending → active after ACK
+        'state': 'pending',  # pending → active after ACK
+        # delta mode: action seq covered by the newest snapshot the client ACKed
+        # (None until it ACKs one, i.e. a legacy client that gets last-K snapshots)
+        'acked_action_seq': None,
+        # action seq covered by the oldest full snapshot not yet ACKed
+        'full_action_seq': None,
+        'full_sent_time': 0.0,
+        # whether that full snapshot went out as SNAPSHOT_FRAG fragments
+        'full_fragmented': False,
+        # CAP_RELIABLE_ACTIONS: action ids received, and the ACTION_ACK trailer
+        # appended to this client's packets until ack_until
+        'action_acks': ActionAcks(ACTION_WINDOW) if caps & CAP_RELIABLE_ACTIONS else None,
+        'ack_trailer': None,
+        'ack_until': 0.0,
     }
-    print(f"[SERVER] Registered new client {addr} as Player {player_id}, pending ack")
-    return clients[addr], player_id
+    logger.info("Registered new client %s as Player %d, pending ack", addr, player_id)
+    return clients[addr]
+
+
+def _full_snapshot_payload(grid):
+    """(action seq, payload, encoding cache) of the current full snapshot, grid state or action history.
+
+    Encoded once per action seq, so every pending client and resync in a tick
+    shares one encode (and one compression per variant, via the cache).
+    """
+    # read the seq first: actions applied meanwhile are then at worst resent
+    seq = game.action_seq
+    cached = full_payloads.get(grid)
+    if cached is None or cached[0] is not game or cached[1] != seq:
+        if grid:
+            payload = pack_grid_payload(game.rows, game.cols, game.owner_cells())
+        else:
+            payload = pack_actions_payload(game.actions)
+        cached = full_payloads[grid] = (game, seq, payload, {})
+    return cached[1:]
+
+
+def _send_init_ack(sock, addr, client_data):
+    """Send the INIT ACK: the capabilities we use with this client and its player id."""
+    ack_payload = pack_init_ack(client_data['caps'], client_data['player_id'])
+    ack = pack_header(MSG_ACK, 0, client_data['seq_num'], len(ack_payload), client_data['version'])
+    sock.sendto(ack + ack_payload, addr)
+    client_data['seq_num'] += 1
 
 
 def _send_full_snapshot_to_client(sock, addr, client_data):
-    """Send a full-action snapshot to the given client address."""
+    """Send a full snapshot (board state or whole action history) to the given client address.
+
+    A pending client gets the INIT ACK again in front of it: the client only
+    connects once it holds its caps and player id, so a lost INIT ACK is
+    repaired like a lost full snapshot.
+    """
+    fragmented = client_data['caps'] & CAP_FRAGMENTS
+    if fragmented and client_data['full_fragmented'] and time.time() - client_data['full_sent_time'] < FRAGMENT_RETRY_INTERVAL:
+        # a fragmented full snapshot is in flight and FRAG_NACKs repair it
+        return
     try:
-        full_payload = pack_actions_payload(game.actions)
-        header = pack_header(MSG_SNAPSHOT, MAXFOURBYTE, client_data['seq_num'], len(full_payload))
-        sock.sendto(header + full_payload, addr)
-        client_data['seq_num'] += 1
-        print(f"[SERVER] Sent FULL SNAPSHOT #{MAXFOURBYTE} to Player {client_data['player_id']} (actions: {len(game.actions)})")
+        if client_data['state'] == 'pending':
+            _send_init_ack(sock, addr, client_data)
+        grid = bool(client_data['caps'] & CAP_GRID_SNAPSHOT)
+        full_seq, full_payload, encoded = _full_snapshot_payload(grid)
+        msg_type = MSG_GRID_SNAPSHOT if grid else MSG_SNAPSHOT
+        msg_type, full_payload = _encode_payload(msg_type, full_payload, client_data['caps'], encoded)
+        if fragmented and len(full_payload) > FRAGMENT_SIZE:
+            _send_fragments(sock, addr, client_data, MAXFOURBYTE, _fragment(msg_type, MAXFOURBYTE, full_payload))
+            client_data['full_fragmented'] = True
+        else:
+            header = pack_header(msg_type, MAXFOURBYTE, client_data['seq_num'], len(full_payload), client_data['version'])
+            sock.sendto(header + full_payload + (client_data['ack_trailer'] or b''), addr)
+            client_data['seq_num'] += 1
+            client_data['full_fragmented'] = False
+        # every full snapshot covers all actions, so an ACK for any of the
+        # outstanding ones covers at least the oldest
+        if client_data['full_action_seq'] is None:
+            client_data['full_action_seq'] = full_seq
+        client_data['full_sent_time'] = time.time()
+        events.info('full_snapshot', "Sent FULL SNAPSHOT #%d to Player %d (actions: %d, bytes: %d)",
+                    MAXFOURBYTE, client_data['player_id'], full_seq, len(full_payload))
     except Exception:
         pass
 
 
-def _process_existing_client_packet(sock, addr, data, msg_type, heartbeat_id, seq_num, timestamp_ms):
+def _process_existing_client_packet(sock, addr, header, payload):
     """Process a packet from a client that is already registered."""
     client_data = clients[addr]
     player_id = client_data['player_id']
+    msg_type = header.msg_type
+    heartbeat_id = header.snapshot_id
+    timestamp_ms = header.timestamp_ms
+    seq_num = header.seq_num
+    if header.size == HEADER_V2_SIZE:
+        seq_num = extend_seq16(seq_num, client_data['last_recv_seq'])
 
     # drop duplicate or older seqs
     if seq_num <= client_data.get('last_recv_seq', 0):
         return
 
-    # drop stale packets
+    # drop stale packets; heartbeats and ACKs are exempt, as they arrive before the client
+    # has measured its clock skew (with the heartbeats) and stamps packets in our time
     now_ms = int(time.time() * 1000)
-    if now_ms - timestamp_ms > int(PACKET_LIFETIME * 1000):
+    if now_ms - timestamp_ms > int(PACKET_LIFETIME * 1000) and msg_type not in (MSG_HEARTBEAT, MSG_ACK):
         return
 
     # accept and update last recv seq
     client_data['last_recv_seq'] = seq_num
 
+    if msg_type == MSG_FRAG_NACK:
+        # repair a fragmented snapshot in any state, so a pending client can finish its full snapshot
+        _handle_frag_nack(sock, addr, client_data, payload)
+        return
+
+    if msg_type == MSG_INIT:
+        # the client (re)starts its session and waits for the INIT ACK: resend it
+        # with a full snapshot, as for a new client, until the client ACKs
+        events.info('resync', "INIT from known Player %d — sending INIT ACK and full snapshot", player_id)
+        client_data['state'] = 'pending'
+        _send_full_snapshot_to_client(sock, addr, client_data)
+        return
+
     if client_data.get('state') == 'pending':
         # Only accept ACK to activate from pending state
         if msg_type == MSG_ACK:
             client_data['state'] = 'active'
             client_data['last_seen'] = time.time()
-            print(f"[SERVER] Received ACK from Player {player_id} → activated")
+            _handle_snapshot_ack(client_data, heartbeat_id)
+            logger.info("Received ACK from Player %d → activated", player_id)
         else:
+            if msg_type == MSG_HEARTBEAT:
+                _reply_heartbeat(sock, addr, client_data, heartbeat_id, payload)
             _send_full_snapshot_to_client(sock, addr, client_data)
         return
 
     # If client is inactive and sends anything, deliver full actions snapshot (do not re-activate)
     if client_data.get('state') == 'inactive':
-        print(f"[SERVER] Inactive client {player_id} sent data — sending full actions snapshot")
+        events.info('resync', "Inactive client %d sent data — sending full actions snapshot", player_id)
         _send_full_snapshot_to_client(sock, addr, client_data)
         client_data['last_seen'] = time.time()
         client_data['state'] = 'pending'  # remain inactive
@@ -96,175 +241,562 @@ def _process_existing_client_packet(sock, addr, data, msg_type, heartbeat_id, se
     client_data['last_seen'] = time.time()
 
     if msg_type == MSG_ACTION:
-        _handle_action_message(player_id, data)
-        
+        if client_data['action_acks'] is not None:
+            _handle_reliable_action(client_data, payload)
+        else:
+            _handle_action_message(player_id, payload, client_data['caps'] & CAP_ACTION_BATCH)
+
+    elif msg_type == MSG_ACK:
+        _handle_snapshot_ack(client_data, heartbeat_id)
+
     elif msg_type == MSG_HEARTBEAT:
-        # Client sent heartbeat (unidirectional): update last heartbeat receive time
-        client_data['last_heartbeat_recv'] = time.time()
-        # Reply with ACK that contains same heartbeat id in snapshot_id field
-        header = pack_header(MSG_ACK, heartbeat_id, client_data['seq_num'], 0)
-        try:
-            sock.sendto(header, addr)
-            client_data['seq_num'] += 1
-        except Exception:
-            pass
+        _reply_heartbeat(sock, addr, client_data, heartbeat_id, payload)
 
-    
 
+def _reply_heartbeat(sock, addr, client_data, heartbeat_id, payload):
+    """Reply to a HEARTBEAT with an ACK carrying the same heartbeat id in snapshot_id.
 
-def _handle_action_message(player_id, data):
+    With CAP_CLOCK_SYNC the ACK payload echoes the client's send time with
+    our receive and send times, so the client can estimate our clock offset.
+    """
+    received = client_data['last_heartbeat_recv'] = time.time()
+    reply = b''
+    if client_data['caps'] & CAP_CLOCK_SYNC and len(payload) >= CLOCK_STAMP.size:
+        reply = CLOCK_REPLY.pack(CLOCK_STAMP.unpack_from(payload)[0], int(received * 1e6), int(time.time() * 1e6))
+    ack = pack_header(MSG_ACK, heartbeat_id, client_data['seq_num'], len(reply), client_data['version'])
     try:
-        row, col = struct.unpack("!HH", data[28:32])
-        if game.grid[row][col] != 0:
-            print(f"[SERVER] ACTION rejected from Player {player_id} → Cell ({row},{col}) occupied")
-        elif game.apply_action(player_id, row, col):
-            print(f"[SERVER] ACTION from Player {player_id} → Cell ({row},{col})")
-        else:
-            print(f"[SERVER] Invalid cell ({row},{col}) from Player {player_id}")
+        sock.sendto(ack + reply + (client_data['ack_trailer'] or b''), addr)
+        client_data['seq_num'] += 1
     except Exception:
         pass
 
+    
+
+
+def _handle_snapshot_ack(client_data, acked_snapshot_id):
+    """Advance the client's delta base to the action seq of the snapshot it ACKed.
+
+    Legacy clients ACK the full snapshot with id 0 and never ACK regular
+    snapshots, so they stay on last-K snapshots.
+    """
+    if acked_snapshot_id == MAXFOURBYTE:
+        acked_seq = client_data['full_action_seq']
+        client_data['full_action_seq'] = None
+    else:
+        acked_seq = snapshot_action_seqs.get(acked_snapshot_id)
+    if acked_seq is None:
+        return
+    current = client_data['acked_action_seq']
+    if current is None or acked_seq > current:
+        client_data['acked_action_seq'] = acked_seq
+
+
+def _fragment(msg_type, snapshot_id, payload):
+    """Split a snapshot payload into SNAPSHOT_FRAG payloads and cache them for FRAG_NACKs."""
+    global next_transfer_id
+    transfer_id = next_transfer_id
+    next_transfer_id = (next_transfer_id + 1) & 0xFFFFFFFF or 1
+    fragments = fragment_payload(transfer_id, msg_type, payload, FRAGMENT_SIZE)
+    fragment_cache[transfer_id] = (snapshot_id, fragments)
+    while len(fragment_cache) > FRAGMENT_CACHE:
+        fragment_cache.popitem(last=False)
+    return fragments
+
+
+def _send_fragments(sock, addr, client_data, snapshot_id, fragments):
+    for fragment in fragments:
+        header = pack_header(MSG_SNAPSHOT_FRAG, snapshot_id, client_data['seq_num'], len(fragment), client_data['version'])
+        sock.sendto(header + fragment + (client_data['ack_trailer'] or b''), addr)
+        client_data['seq_num'] += 1
+
+
+def _handle_frag_nack(sock, addr, client_data, payload):
+    """Resend the fragments a client reports missing from a cached transfer."""
+    try:
+        transfer_id, missing = unpack_frag_nack(payload)
+    except Exception:
+        return
+    cached = fragment_cache.get(transfer_id)
+    if cached is None:
+        # evicted: the client drops it and a later snapshot replaces it
+        return
+    snapshot_id, fragments = cached
+    resend = [fragments[i] for i in missing if i < len(fragments)]
+    _send_fragments(sock, addr, client_data, snapshot_id, resend)
+    events.debug('frag_resend', "Resent %d/%d fragments of transfer %d to Player %d",
+                 len(resend), len(fragments), transfer_id, client_data['player_id'])
+
+
+def _handle_action_message(player_id, payload, batched=False):
+    """Apply an ACTION packet in order and return one ACTION_* result per action.
+
+    The payload is one (row, col), or with CAP_ACTION_BATCH a count-prefixed
+    list of them.
+    """
+    try:
+        cells = unpack_action_batch(payload) if batched else [struct.unpack("!HH", payload[:4])]
+    except struct.error:
+        return []
+    if len(cells) == 1:
+        # check-and-set in one call so the rule holds across sharded workers
+        row, col = cells[0]
+        results = [game.claim_cell(player_id, row, col)]
+    else:
+        results = game.apply_actions([(row, col, player_id) for row, col in cells])
+    for (row, col), result in zip(cells, results):
+        if result == ACTION_OCCUPIED:
+            events.info('action_rejected', "ACTION rejected from Player %d → Cell (%d,%d) occupied", player_id, row, col)
+        elif result == ACTION_APPLIED:
+            events.info('action', "ACTION from Player %d → Cell (%d,%d)", player_id, row, col)
+        else:
+            events.info('action_invalid', "Invalid cell (%d,%d) from Player %d", row, col, player_id)
+    if len(cells) > 1:
+        events.debug('action_batch', "ACTION batch of %d from Player %d", len(cells), player_id)
+    return results
+
+
+def _handle_reliable_action(client_data, payload):
+    """Apply a CAP_RELIABLE_ACTIONS packet once and ack it on the client's next packets.
+
+    A retransmit of an action id already received is acked again but not
+    applied again.
+    """
+    try:
+        action_id = ACTION_ID.unpack_from(payload)[0]
+    except struct.error:
+        return
+    if client_data['action_acks'].receive(action_id):
+        _handle_action_message(client_data['player_id'], payload[ACTION_ID.size:], batched=True)
+    else:
+        events.debug('action_duplicate', "Duplicate ACTION id %d from Player %d", action_id, client_data['player_id'])
+    client_data['ack_trailer'] = client_data['action_acks'].pack()
+    client_data['ack_until'] = time.time() + ACTION_ACK_LINGER
+
+
+def _server_caps():
+    """CAP_* bits this server is configured to use."""
+    caps = 0
+    if FULL_SNAPSHOT_ENCODING == "grid":
+        caps |= CAP_GRID_SNAPSHOT
+    if FRAGMENT_SIZE > 0:
+        caps |= CAP_FRAGMENTS
+    caps |= CAP_ACTION_BATCH | CAP_RELIABLE_ACTIONS | CAP_CLOCK_SYNC
+    if SNAPSHOT_MODE == "delta":
+        # only delta snapshots use the per-snapshot ACKs; redundant mode would just ignore them
+        caps |= CAP_SNAPSHOT_ACKS
+    if COMPRESSION_LEVEL > 0:
+        caps |= CAP_COMPRESSION
+        if COMPRESSION_USE_ZDICT:
+            caps |= CAP_COMPRESSION_ZDICT
+    return caps
+
+
+def _dispatch_packet(sock, data, addr):
+    """Validate a single datagram and route it to the INIT or existing-client path.
+
+    `sock` only needs a `sendto(data, addr)` method, so this works for both a
+    plain UDP socket and an asyncio datagram transport. `data` may be a
+    memoryview over the receive buffer, valid only until this returns.
+    """
+    global packets_received
+    packets_received += 1
+    # Validate header/auth before processing (v1 or v2; heartbeat_id rides in snapshot_id)
+    header = parse_header(data)
+    if header is None:
+        # ignore invalid packets
+        return
+    payload = data[header.size:]
+
+    if addr not in clients:
+        # Only register new client on explicit INIT message
+        if header.msg_type != MSG_INIT:
+            return
+        # Check if we've reached max players
+        player_id = _allocate_player_id()
+        if player_id is None:
+            events.info('init_rejected', "INIT from %s rejected: max players (%d) reached", addr, MAX_PLAYERS)
+            return
+        caps = unpack_caps(payload) & _server_caps()
+        if not caps & CAP_ACTION_BATCH:
+            # reliable ACTION payloads use the batch layout after the action id
+            caps &= ~CAP_RELIABLE_ACTIONS
+        # the INIT version byte is the newest header version the client offers
+        version = max(1, min(header.version, SERVER_PROTOCOL_VERSION))
+        client_data = _register_client(addr, player_id, caps, version)
+        client_data['last_recv_seq'] = header.seq_num
+        logger.info("INIT from %s → Player %d (header v%d)", addr, player_id, version)
+        # INIT ACK and full history snapshot for the late-joining client
+        _send_full_snapshot_to_client(sock, addr, client_data)
+    else:
+        _process_existing_client_packet(sock, addr, header, payload)
+
 
 def handle_client(sock):
-    """Main loop: receive and dispatch incoming packets."""
-    global snapshot_id, next_player_id
+    """Main loop: receive and dispatch incoming packets.
+
+    Datagrams are received into one preallocated buffer and handed on as
+    memoryview slices of it; every handler is done with them before the
+    next recvfrom_into, so the datagram bytes are never copied (only small
+    view objects are created per packet).
+    """
+    buf = bytearray(SOCKET_BUFFER_SIZE)
+    view = memoryview(buf)
     while running:
+        addr = None
         try:
-            data, addr = sock.recvfrom(2048)
-            # Validate header/auth before processing
-            ok, reason = check_auth(data[:28])
-            if not ok:
-                # ignore invalid packets
-                continue
-
-            msg_type = data[5]
-            # parse heartbeat_id, seq and timestamp for validation
-            heartbeat_id = struct.unpack("!I", data[6:10])[0]
-            seq_num = struct.unpack("!I", data[10:14])[0]
-            timestamp_ms = struct.unpack("!Q", data[14:22])[0]
-
-            if addr not in clients:
-                # Only register new client on explicit INIT message
-                if msg_type != MSG_INIT:
-                    continue
-                # Check if we've reached max players
-                if len(clients) >= MAX_PLAYERS:
-                    print(f"[SERVER] INIT from {addr} rejected: max players ({MAX_PLAYERS}) reached")
-                    continue
-                client_data, player_id = _register_client(addr)
-                print(f"[SERVER] INIT from {addr} → Player {player_id}")
-                # send ACK for INIT
-                header = pack_header(MSG_ACK, 0, client_data['seq_num'], 0)
-                sock.sendto(header, addr)
-                client_data['seq_num'] += 1
-                # send full history snapshot to late-joining client
-                _send_full_snapshot_to_client(sock, addr, client_data)
-                continue
-            else:
-                _process_existing_client_packet(sock, addr, data, msg_type, heartbeat_id, seq_num, timestamp_ms)
-
+            nbytes, addr = sock.recvfrom_into(buf)
+            _dispatch_packet(sock, view[:nbytes], addr)
         except socket.timeout:
             continue
         except Exception:
-            break
+            if not running or sock.fileno() == -1:
+                break
+            # one bad packet or failed send must not take the whole server down
+            logger.exception("Error handling packet from %s", addr)
 
 
 
 def _init_csv_file():
-    """Initialize CSV file with headers at startup."""
-    global csv_file, csv_initialized
-    
-    if not csv_initialized:
-        file_exists = os.path.exists(csv_file)
-        with open(csv_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow([
-                    'timestamp_ms', 'snapshot_id', 'active_clients',
-                    'total_actions', 'cpu_percent'
-                ])
-            f.flush()
-            os.fsync(f.fileno())
-        csv_initialized = True
-
-def _log_server_metrics_to_csv(snapshot_id, active_clients, total_actions):
-    """Log server metrics to CSV file."""
-    global csv_file, csv_initialized, csv_lock
-
-    with csv_lock:
-        if not csv_initialized:
-            _init_csv_file()
-
-        timestamp_ms = int(time.time() * 1000)
-        cpu_percent = psutil.cpu_percent()
-
-        with open(csv_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                timestamp_ms, snapshot_id, active_clients,
-                total_actions, cpu_percent
-            ])
-            f.flush()
-            os.fsync(f.fileno())
+    """Start the metrics writer for csv_file (writes the header if the file is new)."""
+    global metrics_writer
+    if metrics_writer is None:
+        metrics_writer = MetricsWriter(csv_file, SERVER_METRICS_HEADER, types=SERVER_METRICS_TYPES)
+        metrics_writer.start()
 
 
-def broadcast_snapshots(sock):
-    global snapshot_id
-    while running:
-        time.sleep(SNAPSHOT_BROADCAST_INTERVAL)
-        if not clients:
-            continue
+def _close_csv_file():
+    """Write out queued metrics rows and stop the writer."""
+    global metrics_writer
+    if metrics_writer is None:
+        return
+    metrics_writer.close()
+    if metrics_writer.dropped:
+        logger.warning("Metrics writer dropped %d rows (queue full)", metrics_writer.dropped)
+    if metrics_writer.failed:
+        logger.warning("Metrics writer lost %d rows (write errors)", metrics_writer.failed)
+    metrics_writer = None
+
+
+def _log_server_metrics_to_csv(snapshot_id, active_clients, total_actions, scheduler=None):
+    """Queue one server metrics row for the CSV writer.
 
-        # ALWAYS increment snapshot_id so clients don't drop packets as duplicates
-        snapshot_id += 1
+    With a scheduler, the row also records the tick period, the work time of
+    this tick so far, how late it started and the ticks skipped so far.
+    """
+    if metrics_writer is None:
+        return
+
+    timestamp_ms = int(time.time() * 1000)
+    cpu_percent = psutil.cpu_percent()
+    tick_stats = ['', '', '', '']
+    if scheduler is not None:
+        tick_stats = [
+            round(scheduler.interval * 1000, 3), round(scheduler.elapsed() * 1000, 3),
+            round(scheduler.lateness * 1000, 3), scheduler.total_skipped
+        ]
+    # compressed / original bytes and CPU per compressed payload since the last row
+    payloads, bytes_in, bytes_out, seconds = compressor.take_stats()
+    compression_stats = ['', '']
+    if payloads:
+        compression_stats = [round(bytes_out / bytes_in, 4), round(seconds / payloads * 1e6, 1)]
+    metrics_writer.write([
+        timestamp_ms, snapshot_id, active_clients,
+        total_actions, cpu_percent, packets_received
+    ] + tick_stats + compression_stats)
+
+
+def _encode_payload(msg_type, payload, caps, cache):
+    """(msg_type, payload) as sent to a client with these caps, compressed when it pays off.
+
+    `cache` maps the compression variant to its result so a payload shared
+    by many clients is compressed once per variant.
+    """
+    if not caps & CAP_COMPRESSION or COMPRESSION_LEVEL <= 0:
+        return msg_type, payload
+    use_zdict = bool(caps & CAP_COMPRESSION_ZDICT)
+    if use_zdict not in cache:
+        data = compressor.compress(payload, use_zdict)
+        if data is None:
+            cache[use_zdict] = (msg_type, payload)
+        else:
+            cache[use_zdict] = (msg_type | MSG_COMPRESSED | (MSG_COMPRESSED_ZDICT if use_zdict else 0), data)
+    return cache[use_zdict]
+
+
+def _send_snapshot(sock, msg_type, snapshot_id, payload, recipients):
+    """Send one payload to (addr, client_data) recipients, one header template per protocol version.
+
+    Recipients are grouped by version and encoding caps, and each encoding
+    (compressed or not, fragmented or not) is built once. Payloads over
+    FRAGMENT_SIZE go out as SNAPSHOT_FRAG fragments to clients that support
+    them. Sends and bumps each client's seq_num.
+    """
+    groups = {}
+    for recipient in recipients:
+        client_data = recipient[1]
+        groups.setdefault((client_data['version'], client_data['caps'] & _ENCODING_CAPS), []).append(recipient)
+
+    encoded = {}
+    fragmented = {}
+    for (version, caps), group in groups.items():
+        body_type, body = _encode_payload(msg_type, payload, caps, encoded)
+        frame = snapshot_frames[version]
+        if caps & CAP_FRAGMENTS and len(body) > FRAGMENT_SIZE:
+            variant = caps & (CAP_COMPRESSION | CAP_COMPRESSION_ZDICT)
+            if variant not in fragmented:
+                fragmented[variant] = _fragment(body_type, snapshot_id, body)
+            for fragment in fragmented[variant]:
+                frame.prepare(MSG_SNAPSHOT_FRAG, snapshot_id, fragment)
+                frame.send_many(sock, group)
+        else:
+            frame.prepare(body_type, snapshot_id, body)
+            frame.send_many(sock, group)
 
-        # Get the last K actions via game logic
+
+def _broadcast_tick(sock, scheduler=None):
+    """Run one snapshot tick: send every active client its last-K or delta snapshot."""
+    global snapshot_id, last_tick_seq
+    if not clients:
+        last_tick_seq = game.action_seq
+        return
+
+    # ALWAYS increment snapshot_id so clients don't drop packets as duplicates
+    snapshot_id += 1
+
+    # action seq this snapshot covers; delta clients that ACK it resume from here
+    tick_seq = game.action_seq
+    if SNAPSHOT_MODE == "delta":
+        snapshot_action_seqs[snapshot_id] = tick_seq
+        while len(snapshot_action_seqs) > SNAPSHOT_HISTORY:
+            snapshot_action_seqs.popitem(last=False)
+
+    # iterate over a copy: the threaded engine may register clients meanwhile
+    tick_clients = list(clients.items())
+    inactiveClients = 0
+    recipients = []
+    # delta mode: acked action seq -> clients, so each distinct delta is encoded once
+    delta_groups = {}
+    now = time.time()
+    for addr, client_data in tick_clients:
+        if client_data['ack_trailer'] is not None and now > client_data['ack_until']:
+            # the client had ACTION_ACK_LINGER seconds of packets carrying the ack; a
+            # retransmit would mean it missed them all and re-arms it
+            client_data['ack_trailer'] = None
+
+        if(client_data.get('state') == 'inactive'):
+            inactiveClients += 1
+            continue  # Skip inactive clients
+
+        elif(client_data.get('state') == 'pending'):
+            _send_full_snapshot_to_client(sock, addr, client_data)
+            continue  # Skip pending clients until they ACK
+
+        base = client_data['acked_action_seq']
+        if SNAPSHOT_MODE != "delta" or base is None:
+            recipients.append((addr, client_data))
+        elif tick_seq - base > DELTA_MAX_ACTIONS or base < game.oldest_action_seq:
+            # too far behind for a delta: resync, at most once per heartbeat interval
+            if now - client_data['full_sent_time'] >= HEARTBEAT_INTERVAL:
+                _send_full_snapshot_to_client(sock, addr, client_data)
+        else:
+            delta_groups.setdefault(base, []).append((addr, client_data))
+
+    # every action since the previous tick plus the last K as redundancy, so a
+    # batch of more than K actions in one tick still reaches every client
+    since = max(game.oldest_action_seq, min(last_tick_seq, tick_seq - LAST_K_ACTIONS))
+    last_tick_seq = tick_seq
+    recent_actions = game.actions_since(since)
+    if recent_actions is None:
         recent_actions = game.get_recent_actions(LAST_K_ACTIONS)
+    else:
+        recent_actions = recent_actions[:tick_seq - since]
+    if recipients:
         # Pack payload using util helper
         payload = pack_actions_payload(recent_actions)
+        # encode the shared header fields once; per client only seq/checksum change
+        _send_snapshot(sock, MSG_SNAPSHOT, snapshot_id, payload, recipients)
 
-        inactiveClients = 0
-        for addr in clients:
-            if(clients[addr].get('state') == 'inactive'):
-                inactiveClients += 1
-                continue  # Skip inactive clients
+    for base, group in delta_groups.items():
+        delta = game.actions_since(base)
+        if delta is None:
+            # history moved on since grouping; the next tick resyncs these clients
+            continue
+        delta = delta[:tick_seq - base]
+        _send_snapshot(sock, MSG_SNAPSHOT, snapshot_id, pack_actions_payload(delta), group)
 
-            elif(clients[addr].get('state') == 'pending'):
-                _send_full_snapshot_to_client(sock, addr, clients[addr])
-                continue  # Skip pending clients until they ACK
+    if SNAPSHOT_MODE == "delta":
+        events.info('snapshot', "Sent SNAPSHOT #%d to %d clients (deltas: %d, last-K: %d)",
+                    snapshot_id, len(tick_clients) - inactiveClients, len(delta_groups), len(recipients))
+    else:
+        events.info('snapshot', "Sent SNAPSHOT #%d to %d clients (actions: %d)",
+                    snapshot_id, len(tick_clients) - inactiveClients, len(recent_actions))
 
-            header = pack_header(MSG_SNAPSHOT, snapshot_id, clients[addr]['seq_num'], len(payload))
-            sock.sendto(header + payload, addr)
-            clients[addr]['seq_num'] += 1
+    # Log metrics to CSV
+    _log_server_metrics_to_csv(snapshot_id, len(tick_clients), tick_seq, scheduler)
 
-        print(f"[SERVER] Sent SNAPSHOT #{snapshot_id} to {len(clients) - inactiveClients} clients (actions: {len(recent_actions)})")
 
-        # Log metrics to CSV
-        _log_server_metrics_to_csv(snapshot_id, len(clients), len(game.actions))
+def _new_tick_scheduler():
+    return TickScheduler(SNAPSHOT_BROADCAST_INTERVAL, degrade=TICK_DEGRADE,
+                         max_interval=TICK_MAX_INTERVAL, budget=TICK_BUDGET)
 
-def main():
-    global running
-    # Initialize CSV file at startup
-    with csv_lock:
-        _init_csv_file()
-    
+
+def _run_tick(sock, scheduler):
+    """Run one broadcast tick with scheduler accounting."""
+    interval = scheduler.interval
+    scheduler.begin()
+    try:
+        _broadcast_tick(sock, scheduler)
+    finally:
+        scheduler.end()
+    if scheduler.skipped:
+        events.log('tick_overrun', logging.WARNING, "Tick overran: work %.1fms, skipped %d tick(s)",
+                   scheduler.work * 1000, scheduler.skipped)
+    if scheduler.interval != interval:
+        logger.info("Tick interval %.1fms → %.1fms", interval * 1000, scheduler.interval * 1000)
+    events.summarize()
+
+
+def broadcast_snapshots(sock):
+    scheduler = _new_tick_scheduler()
+    while running:
+        scheduler.wait()
+        _run_tick(sock, scheduler)
+
+
+class AsyncServerProtocol(asyncio.DatagramProtocol):
+    """Single event-loop server engine.
+
+    The loop owns the receive path, the snapshot tick and all client
+    bookkeeping, so `clients` and `game` are only ever touched from one
+    thread and no socket timeout polling is needed.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.scheduler = None
+        self._tick_handle = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.scheduler = _new_tick_scheduler()
+        loop = asyncio.get_running_loop()
+        self._tick_handle = loop.call_later(self.scheduler.time_until_next(), self._tick)
+
+    def datagram_received(self, data, addr):
+        try:
+            _dispatch_packet(self.transport, data, addr)
+        except Exception:
+            # as in handle_client: one bad packet must not go unnoticed, nor stop the loop
+            logger.exception("Error handling packet from %s", addr)
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable from a closed client) are not fatal
+        pass
+
+    def connection_lost(self, exc):
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+
+    def _tick(self):
+        try:
+            _run_tick(self.transport, self.scheduler)
+        except Exception:
+            # log and keep ticking: a silent failure here would just stop all snapshots
+            logger.exception("Error in snapshot tick #%d", snapshot_id)
+        if self.transport is not None and not self.transport.is_closing():
+            loop = asyncio.get_running_loop()
+            self._tick_handle = loop.call_later(self.scheduler.time_until_next(), self._tick)
+
+
+async def _serve_async(sock, duration):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(AsyncServerProtocol, sock=sock)
+    stop_at = loop.time() + duration
+    try:
+        # wake up regularly so _request_stop() (e.g. from SIGTERM) ends the run too
+        while running and loop.time() < stop_at:
+            await asyncio.sleep(min(SOCKET_TIMEOUT, stop_at - loop.time()))
+    finally:
+        transport.close()
+
+
+def run_async_server(sock, duration=SERVER_RUN_DURATION):
+    """Serve on an already-bound UDP socket with the asyncio engine."""
+    sock.setblocking(False)
+    asyncio.run(_serve_async(sock, duration))
+
+
+def _create_socket(reuse_port=False):
+    """Create the server UDP socket bound to SERVER_ADDR.
+
+    With reuse_port, several processes can bind the same port and the kernel
+    spreads clients across them by address hash (Linux SO_REUSEPORT).
+    """
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind(SERVER_ADDR)
-    sock.settimeout(SOCKET_TIMEOUT)
+    return sock
 
-    print(f"[SERVER] Listening on {SERVER_ADDR[0]}:{SERVER_ADDR[1]}")
+
+def _request_stop():
+    global running
+    running = False
+
+
+def _handle_sigterm(signum, frame):
+    # `kill` from the test scripts: stop like at the end of the run, so the
+    # finally blocks still flush the metrics
+    _request_stop()
+
+
+def serve(sock, duration=SERVER_RUN_DURATION):
+    """Run the configured engine on a bound socket for `duration` seconds."""
+    if SERVER_ENGINE == "asyncio":
+        run_async_server(sock, duration)
+        return
+    sock.settimeout(SOCKET_TIMEOUT)
     threading.Thread(target=broadcast_snapshots, args=(sock,), daemon=True).start()
+    if duration != float('inf'):
+        stop_timer = threading.Timer(duration, _request_stop)
+        stop_timer.daemon = True
+        stop_timer.start()
+    handle_client(sock)
+
+
+def main():
+    global running
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+    if SERVER_WORKERS > 1:
+        import sharding
+        # a --port given to `python3 server.py` lives in __main__, not the `server` module the workers use
+        sharding.server.SERVER_ADDR = SERVER_ADDR
+        sharding.run_sharded(SERVER_WORKERS)
+        return
+
+    # Start the metrics writer at startup
+    _init_csv_file()
+
+    sock = _create_socket()
 
-    start_time = time.time()
+    logger.info("Listening on %s:%d (engine: %s)", SERVER_ADDR[0], SERVER_ADDR[1], SERVER_ENGINE)
     try:
-        while time.time() - start_time < SERVER_RUN_DURATION:
-            handle_client(sock)
+        serve(sock, SERVER_RUN_DURATION)
     except KeyboardInterrupt:
         pass
     finally:
         running = False
         sock.close()
-        print("[SERVER] Shutting down...")
+        _close_csv_file()
+        events.summarize(force=True)
+        logger.info("Shutting down...")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="GridSync server")
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    SERVER_ADDR = (SERVER_HOST, args.port)
     main()
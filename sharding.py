@@ -0,0 +1,166 @@
+"""
+Multi-process server mode: N workers bind SERVER_PORT with SO_REUSEPORT.
+
+The kernel hashes each client address to one worker, so a client always
+talks to the same process. Workers share one authoritative board through
+game.SharedGridGame and one player-id counter, and each writes its own
+server_metrics.w<N>.csv which is merged into server_metrics.csv on exit
+(with a worker_id column) so throughput can be compared with one process.
+With METRICS_FORMAT "columns" the same merge is done on the .cols tables.
+"""
+import csv
+import multiprocessing
+import os
+import shutil
+import signal
+
+import server
+from game import SharedGridGame
+from metrics import ColumnFiles, columns_path, read_columns
+from config import GRID_SIZE, SERVER_RUN_DURATION, METRICS_FORMAT
+
+
+def _worker_csv_file(worker_id):
+    base, ext = os.path.splitext(server.csv_file)
+    return f"{base}.w{worker_id}{ext}"
+
+
+def _worker_main(worker_id, shared_game, player_counter, duration):
+    """Entry point of one worker process."""
+    server.game = shared_game
+    server.shared_player_counter = player_counter
+    server.csv_file = _worker_csv_file(worker_id)
+    server._init_csv_file()
+    signal.signal(signal.SIGTERM, server._handle_sigterm)
+
+    sock = server._create_socket(reuse_port=True)
+    server.logger.info("Worker %d (pid %d) listening on %s:%d (engine: %s)", worker_id, os.getpid(),
+                       server.SERVER_ADDR[0], server.SERVER_ADDR[1], server.SERVER_ENGINE)
+    try:
+        server.serve(sock, duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.running = False
+        sock.close()
+        server._close_csv_file()
+        server.events.summarize(force=True)
+
+
+def merge_worker_metrics(worker_files, out_file):
+    """Merge per-worker metrics CSVs into one file ordered by timestamp.
+
+    Rows keep their original columns plus a worker_id column. Returns a
+    dict worker_id -> packets_received (last value seen for that worker).
+    """
+    rows = []
+    header = None
+    packets = {}
+    for worker_id, path in enumerate(worker_files):
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            file_header = next(reader, None)
+            if file_header is None:
+                continue
+            header = header or file_header
+            pkt_col = file_header.index('packets_received') if 'packets_received' in file_header else None
+            for row in reader:
+                if not row:
+                    continue
+                rows.append(row + [worker_id])
+                if pkt_col is not None:
+                    packets[worker_id] = int(row[pkt_col])
+
+    if header is None:
+        return packets
+
+    rows.sort(key=lambda r: int(r[0]))
+    with open(out_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header + ['worker_id'])
+        writer.writerows(rows)
+    return packets
+
+
+def merge_worker_columns(worker_files, out_file):
+    """merge_worker_metrics() for .cols tables: one table ordered by timestamp, plus worker_id."""
+    columns = None
+    packets = {}
+    for worker_id, path in enumerate(worker_files):
+        path = columns_path(path)
+        if not os.path.exists(path):
+            continue
+        table = read_columns(path)
+        rows = len(table['timestamp_ms'])
+        if not rows:
+            continue
+        table['worker_id'] = [worker_id] * rows
+        if columns is None:
+            columns = {name: list(values) for name, values in table.items()}
+        else:
+            for name, values in table.items():
+                columns[name].extend(values)
+        if 'packets_received' in table:
+            packets[worker_id] = table['packets_received'][-1]
+
+    if columns is None:
+        return packets
+
+    order = sorted(range(len(columns['timestamp_ms'])), key=columns['timestamp_ms'].__getitem__)
+    out = columns_path(out_file)
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    table = ColumnFiles(out, list(columns), server.SERVER_METRICS_TYPES + ['q'])
+    table.append([[columns[name][i] for name in columns] for i in order])
+    table.close()
+    return packets
+
+
+def run_sharded(num_workers, duration=SERVER_RUN_DURATION):
+    """Start num_workers server processes and merge their metrics when they exit."""
+    if not hasattr(server.socket, 'SO_REUSEPORT'):
+        raise RuntimeError("SO_REUSEPORT is not available on this platform")
+
+    shared_game = SharedGridGame(GRID_SIZE, GRID_SIZE)
+    player_counter = multiprocessing.Value('i', 1)
+
+    workers = []
+    for worker_id in range(num_workers):
+        p = multiprocessing.Process(
+            target=_worker_main,
+            args=(worker_id, shared_game, player_counter, duration),
+            name=f"gsyn-worker-{worker_id}",
+        )
+        p.start()
+        workers.append(p)
+
+    server.logger.info("Started %d workers on port %d", num_workers, server.SERVER_ADDR[1])
+    # pass a SIGTERM on to the workers; they stop and flush their metrics, then the merge runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: [p.terminate() for p in workers])
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        # workers share our process group and get the same SIGINT
+        for p in workers:
+            p.join()
+    finally:
+        worker_files = [_worker_csv_file(i) for i in range(num_workers)]
+        merged_file = server.csv_file
+        if METRICS_FORMAT == "columns":
+            packets = merge_worker_columns(worker_files, server.csv_file)
+            merged_file = columns_path(server.csv_file)
+            for path in worker_files:
+                shutil.rmtree(columns_path(path), ignore_errors=True)
+        else:
+            packets = merge_worker_metrics(worker_files, server.csv_file)
+            for path in worker_files:
+                if os.path.exists(path):
+                    os.remove(path)
+        for worker_id in sorted(packets):
+            server.logger.info("Worker %d: %d packets received", worker_id, packets[worker_id])
+        server.logger.info("All workers: %d packets received (merged into %s)",
+                           sum(packets.values()), merged_file)
+        server.logger.info("Shutting down...")
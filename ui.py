@@ -22,6 +22,8 @@ COLOR_MAP = {
     3: '#4DFF88',  # green p3
     4: '#FFD24D',  # yellow p4
 }
+# outline of cells predicted by the client but not yet confirmed by the server
+PREDICTED_OUTLINE = 'white'
 
 class GameUI:
     def __init__(self, root):
@@ -83,7 +85,7 @@ class GameUI:
         self.grid_frame.pack(padx=10, pady=10)
 
         # Create top-left stats display (ping & packet loss)
-        self.stats_text = tk.StringVar(value='Ping: -- | Loss: --%')
+        self.stats_text = tk.StringVar(value='Ping: -- | Latency: -- | Loss: --%')
         self.stats_label = tk.Label(self.top_frame, textvariable=self.stats_text, fg='white', bg='black', font=('mono', 9), justify='left')
         self.stats_label.pack(padx=35,pady=(12,0))
 
@@ -147,7 +149,7 @@ class GameUI:
             loss_pct = 0.0
             if total > 0:
                 loss_pct = (packets_lost / total) * 100
-            stats_str = f'Ping: {ping:.1f}ms | Loss: {loss_pct:.1f}%'
+            stats_str = f'Ping: {ping:.1f}ms | Latency: {self.client.latency_ms:.1f}ms | Loss: {loss_pct:.1f}%'
             self.stats_text.set(stats_str)
 
         # schedule next stats update in 1 second
@@ -161,6 +163,9 @@ class GameUI:
             last_ts = getattr(self.client, 'last_grid_update', 0.0)
             if last_ts and last_ts > self._last_grid_ts:
                 grid = self.client.grid
+                # own actions not yet confirmed; stored negated in prev_grid so a
+                # confirmation or rollback redraws just that cell
+                predicted = self.client.prediction_overlay()
                 rects = self.rects
                 cmap = COLOR_MAP
                 default = COLOR_MAP[0]
@@ -170,9 +175,12 @@ class GameUI:
                     rrects = rects[r]
                     for c in range(GRID_SIZE):
                         owner = grow[c]
+                        if not owner and predicted:
+                            owner = -predicted.get((r, c), 0)
                         if prow[c] != owner:
-                            color = cmap.get(owner, default)
-                            self.canvas.itemconfig(rrects[c], fill=color)
+                            color = cmap.get(abs(owner), default)
+                            outline = PREDICTED_OUTLINE if owner < 0 else 'black'
+                            self.canvas.itemconfig(rrects[c], fill=color, outline=outline)
                             prow[c] = owner
                 self._last_grid_ts = last_ts
 